@@ -1,17 +1,27 @@
 # This file is the "main" script that can be run to see the full app
 
 import random
+import os
+import multiprocessing
+
+# Command line paths are relative to where MPRUN was started, the app itself reads its
+# resources relative to its own directory
+launch_directory = os.getcwd()
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
 from src.scripts.imports import *
 from mp_software_stylesheets.styles import macCSS, windowsCSS
-from src.scripts.raw_functions import nameismain, ItemStack
+from src.scripts.raw_functions import ItemStack
 from src.scripts.app_internal import *
-from src.gui.app_screens import AboutWin, VersionWin, FindActionWin, DisclaimerWin, SettingsWin
+from src.gui.app_screens import AboutWin, VersionWin, FindActionWin, DisclaimerWin, SettingsWin, RecentFilesWin
 from src.gui.panels import PropertiesPanel, CharactersPanel, LibrariesPanel, ImageTracingPanel, QuickActionsPanel, \
     CanvasEditorPanel
 from src.gui.icloud_integrator import iCloudIntegraterWin
 from src.gui.custom_widgets import *
 from src.framework.graphics_framework import CustomGraphicsView, CustomGraphicsScene, CustomViewport
 from src.framework.serializer import MPDataRepairer
+from src.framework.render import render_main
+from src.framework.repair import repair_main
 
 if getattr(sys, 'frozen', False):
     os.chdir(sys._MEIPASS)
@@ -60,6 +70,7 @@ class MPRUN(QMainWindow):
             if result == QMessageBox.Discard:
                 try:
                     self.undo_stack.clear()
+                    self.canvas.manager.autosaver.discard()
                     self.w.close()
                     event.accept()
 
@@ -72,6 +83,7 @@ class MPRUN(QMainWindow):
                 if success:
                     try:
                         self.undo_stack.clear()
+                        self.canvas.manager.autosaver.discard()
                         self.w.close()
                         event.accept()
 
@@ -87,6 +99,7 @@ class MPRUN(QMainWindow):
         else:
             try:
                 self.undo_stack.clear()
+                self.canvas.manager.autosaver.discard()
                 self.w.close()
                 event.accept()
 
@@ -175,6 +188,10 @@ class MPRUN(QMainWindow):
 
         self.open_recent_menu = CustomMenu('Open Recent')
 
+        browse_recent_action = QAction('Browse Recent Files', self)
+        browse_recent_action.setShortcut(QKeySequence('Ctrl+Shift+O'))
+        browse_recent_action.triggered.connect(self.browse_recent)
+
         open_template_action = QAction('Open Template', self)
         open_template_action.triggered.connect(self.canvas.template_manager.load_template)
 
@@ -470,6 +487,7 @@ class MPRUN(QMainWindow):
         self.file_menu.addAction(new_action)
         self.file_menu.addAction(open_action)
         self.file_menu.addMenu(self.open_recent_menu)
+        self.file_menu.addAction(browse_recent_action)
         self.file_menu.addAction(open_template_action)
         self.file_menu.addSeparator()
         self.file_menu.addAction(save_action)
@@ -1156,14 +1174,9 @@ class MPRUN(QMainWindow):
                 self.repaint()
 
             elif mode == 'item_update':
-                self.canvas.update()
-                self.canvas_view.update()
-
-                for item in self.canvas.items():
-                    item.update()
-
-                    if isinstance(item, LeaderLineItem):
-                        item.updatePathEndPoint()
+                # Commands and tools marked what they changed, repaint it now rather than
+                # at the end of the event loop pass
+                self.canvas.dirty.flush()
 
     def update_item_pen(self):
         # Update pen and brush
@@ -2353,6 +2366,15 @@ class MPRUN(QMainWindow):
     def open_recent(self, filename: str):
         self.canvas.manager.load_from_file(filename, self)
 
+    def browse_recent(self):
+        recent_files = []
+
+        for data in self.read_recent_files():
+            recent_files.extend(data['recent_files'])
+
+        self.w = RecentFilesWin(recent_files, self)
+        self.w.show()
+
     def show_version(self):
         self.w = VersionWin(self.canvas.mpversion)
         self.w.show()
@@ -2419,6 +2441,7 @@ class MPRUN(QMainWindow):
             self.tab_view_dock.collapse() if user_data['toolbox_collapsed'] else self.tab_view_dock.expand()
             self.undo_stack.setUndoLimit(user_data['undo_limit'])
             self.canvas.setGridSize(user_data['grid_size'])
+            self.canvas.manager.autosaver.setInterval(user_data.get('autosave_interval', 5))
             self.toolbox.setCurrentIndex(user_data['toolbox_index'])
 
             if user_data['geometry'][0] == 'maximized':
@@ -2468,6 +2491,35 @@ class MPRUN(QMainWindow):
 
         self.write_recent_file(data)
 
+    def open_recovery_data(self):
+        # Recovery snapshots only outlive a session when MPRUN did not close properly
+        recovery_file = self.canvas.manager.autosaver.latest()
+
+        if recovery_file is None:
+            return
+
+        try:
+            document = self.canvas.manager.autosaver.recovered_document(recovery_file)
+
+        except Exception as e:
+            QMessageBox.warning(self, 'Restore Document', f'MPRUN did not close properly, but the autosaved '
+                                                          f'changes could not be read and were discarded.\n\n{e}')
+            self.canvas.manager.autosaver.discard()
+            return
+
+        result = QMessageBox.question(self,
+                                      'Restore Document',
+                                      f'MPRUN did not close properly. Do you want to restore the autosaved '
+                                      f'changes to {os.path.basename(document)}?',
+                                      QMessageBox.Yes | QMessageBox.No,
+                                      QMessageBox.Yes)
+
+        if result == QMessageBox.Yes:
+            self.canvas.manager.restore_recovery(recovery_file)
+
+        else:
+            self.canvas.manager.autosaver.discard()
+
     def update_recent_file_data(self, file: str):
         data = self.read_recent_files()
 
@@ -2604,13 +2656,38 @@ def main() -> None:
 
     window.open_settings_data()
     window.open_recent_file_data()
+    window.open_recovery_data()
 
     if len(sys.argv) > 1:
-        file_path = sys.argv[1]
+        # Relative to where MPRUN was started, not the directory it runs from
+        file_path = os.path.join(launch_directory, sys.argv[1])
         window.open_recent(file_path)
 
     sys.exit(app.exec_())
 
 
-if nameismain:
-    main()
+def render() -> None:
+    # mprun render <document> [options], exports canvases without building the main window
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    sys.exit(render_main(sys.argv[2:], launch_directory))
+
+
+def repair() -> None:
+    # mprun repair <document> [options], checks and repairs documents without the main window
+    sys.exit(repair_main(sys.argv[2:], launch_directory))
+
+
+# A plain __name__ check, render worker processes import this module as __mp_main__ and must
+# not start the app again
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    if sys.argv[1:2] == ['render']:
+        render()
+
+    elif sys.argv[1:2] == ['repair']:
+        repair()
+
+    else:
+        main()
@@ -0,0 +1,1051 @@
+# Benchmarks for MPRUN's document and rendering pipeline
+#
+# Run from the repository root, for example:
+#   python -m src.extras.benchmarks container
+#
+# Every benchmark builds a synthetic course in an offscreen scene, so no window is shown.
+
+import argparse
+import os
+import tempfile
+import timeit
+
+try:
+    import resource
+
+except ImportError:
+    # Windows, peak memory isn't reported there
+    resource = None
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from src.scripts.imports import *
+from src.framework.graphics_framework import CustomGraphicsScene
+from src.framework.custom_classes import *
+from src.framework.serializer import MPSerializer, MPDeserializer, MPProgressiveLoader
+from src.framework.undo_commands import *
+from src.framework.container import MPFileWriter, MPFileReader, PATH_ELEMENT_TYPES
+from src.framework.exporter import MPCanvasExporter, MPExportCache, MPTiledExporter, MPDocumentPreview
+from src.framework.svg_writer import MPSVGWriter
+from src.framework.sharing import MPSharePipeline, MPLocalDirectoryBackend
+from src.framework.path_measure import MPPathMeasure
+
+course_elements = [os.path.join('course elements', f) for f in sorted(os.listdir('course elements'))]
+
+
+def build_course(scene, elements=400, paths=100, path_points=2000, labels=50):
+    scene.addItem(CanvasItem(QRectF(0, 0, 4000, 3000), 'Canvas 1'))
+
+    for i in range(elements):
+        filename = course_elements[i % len(course_elements)]
+        item = CustomSvgItem(filename)
+        item.store_filename(filename)
+        item.setPos((i * 37) % 4000, (i * 53) % 3000)
+        item.setToolTip('Imported SVG')
+        scene.addItem(item)
+
+    for i in range(paths):
+        path = QPainterPath()
+        path.moveTo(0, 0)
+        for p in range(path_points):
+            path.lineTo(p, math.sin(p / 25) * 100 + i)
+
+        item = CustomPathItem(path)
+        item.setPen(QPen(QColor('red'), 3))
+        item.setToolTip('Path')
+        scene.addItem(item)
+
+    for i in range(labels):
+        path = QPainterPath()
+        path.moveTo(i * 10, 0)
+        path.lineTo(i * 10 + 100, 100)
+
+        item = LeaderLineItem(path, f'Trick {i}')
+        item.setToolTip('Leader Line')
+        scene.addItem(item)
+
+    return scene
+
+
+class BenchmarkWindow(QWidget):
+    # Stands in for the main window the scene expects as its parent
+    def use_exit_add_canvas(self):
+        pass
+
+    def update_transform_ui(self):
+        pass
+
+
+def report(name, seconds):
+    print(f'{name:<40} {seconds * 1000:10.2f} ms')
+
+
+def legacy_items(items_data):
+    # The records the way SceneManager pickled them before the container existed, paths as
+    # one dict per element and SVG text and image bytes inline in every item using them
+    assets = items_data[0].get('assets', {})
+
+    def convert(record):
+        legacy = {key: value for key, value in record.items() if key not in ('bounds', 'asset', 'path')}
+
+        if isinstance(record.get('path'), dict):
+            types = record['path']['types']
+            coords = np.frombuffer(record['path']['coords'], '<f8').reshape(-1, 2).tolist()
+            legacy['elements'] = [{'type': PATH_ELEMENT_TYPES[element_type], 'x': x, 'y': y}
+                                  for element_type, (x, y) in zip(types, coords)]
+
+        if record['type'] == 'CustomSvgItem' and 'asset' in record:
+            legacy['raw_svg_data'] = bytes(assets[record['asset']]).decode('utf-8')
+
+        elif record['type'] == 'CustomPixmapItem' and 'asset' in record:
+            legacy['data'] = bytes(assets[record['asset']])
+
+        if 'children' in record:
+            legacy['children'] = [convert(child) for child in record['children']]
+
+        return legacy
+
+    metadata = {key: value for key, value in items_data[0].items() if key != 'assets'}
+
+    return [metadata] + [convert(record) for record in items_data[1:]]
+
+
+def bench_container(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()))
+    items_data = MPSerializer(scene).serialize_items()
+    legacy_data = legacy_items(items_data)
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_file = os.path.join(directory, 'course_legacy.mp')
+        pickle_file = os.path.join(directory, 'course_pickle.mp')
+        container_file = os.path.join(directory, 'course_container.mp')
+
+        def save_pickle(filename, data):
+            def run():
+                with open(filename, 'wb') as f:
+                    pickle.dump(data, f)
+
+            return run
+
+        def load_pickle(filename):
+            def run():
+                with open(filename, 'rb') as f:
+                    return pickle.load(f)
+
+            return run
+
+        # The documents MPRUN wrote before the container, and pickle given the same packed
+        # records the container stores, which is the floor for anything built on them
+        legacy_save = min(timeit.repeat(save_pickle(legacy_file, legacy_data), number=1, repeat=repeat))
+        legacy_load = min(timeit.repeat(load_pickle(legacy_file), number=1, repeat=repeat))
+        pickle_save = min(timeit.repeat(save_pickle(pickle_file, items_data), number=1, repeat=repeat))
+        pickle_load = min(timeit.repeat(load_pickle(pickle_file), number=1, repeat=repeat))
+        container_save = min(timeit.repeat(lambda: MPFileWriter(container_file).write(items_data),
+                                           number=1, repeat=repeat))
+        container_load = min(timeit.repeat(lambda: MPFileReader.load(container_file), number=1, repeat=repeat))
+
+        print(f'{len(items_data) - 1} items')
+        report('legacy pickle save', legacy_save)
+        report('legacy pickle load', legacy_load)
+        report('pickle save, packed records', pickle_save)
+        report('pickle load, packed records', pickle_load)
+        report('container save', container_save)
+        report('container load', container_load)
+        print(f'{"save speedup over legacy pickle":<40} {legacy_save / container_save:10.1f} x')
+        print(f'{"load speedup over legacy pickle":<40} {legacy_load / container_load:10.1f} x')
+        print(f'{"legacy pickle size":<40} {os.path.getsize(legacy_file):10d} bytes')
+        print(f'{"pickle size, packed records":<40} {os.path.getsize(pickle_file):10d} bytes')
+        print(f'{"container size":<40} {os.path.getsize(container_file):10d} bytes')
+
+
+def bench_assets(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()), elements=1000, paths=0, labels=0)
+    serializer = MPSerializer(scene)
+    items_data = serializer.serialize_items()
+    svg_records = [data for data in items_data[1:] if data['type'] == 'CustomSvgItem']
+
+    def load_per_item():
+        # What every load did before the asset table, one renderer per item
+        items = []
+        for data in svg_records:
+            item = CustomSvgItem()
+            item.loadFromData(bytes(serializer.assets[data['asset']]).decode('utf-8'))
+            items.append(item)
+
+        return items
+
+    def load_shared():
+        deserializer = MPDeserializer(scene)
+        deserializer.assets = serializer.assets
+        return [deserializer.deserialize_custom_svg_item(data) for data in svg_records]
+
+    inline_size = sum(len(serializer.assets[data['asset']]) for data in svg_records)
+    shared_size = sum(len(data) for data in serializer.assets.values())
+
+    print(f'{len(svg_records)} svg items, {len(serializer.assets)} unique assets')
+    report('serialize', min(timeit.repeat(serializer.serialize_items, number=1, repeat=repeat)))
+    report('load, renderer per item', min(timeit.repeat(load_per_item, number=1, repeat=repeat)))
+    report('load, shared renderers', min(timeit.repeat(load_shared, number=1, repeat=repeat)))
+    print(f'{"svg payload, inline":<40} {inline_size:10d} bytes')
+    print(f'{"svg payload, asset table":<40} {shared_size:10d} bytes')
+
+
+def bench_lazy(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()), elements=2000, paths=200, labels=200)
+
+    # Spread the course over ten canvases side by side, only the first one is on screen
+    for i, item in enumerate(scene.items()):
+        if not isinstance(item, CanvasItem) and item.parentItem() is None:
+            item.moveBy((i % 10) * 5000, 0)
+
+    for i in range(1, 10):
+        canvas = CanvasItem(QRectF(0, 0, 4000, 3000), f'Canvas {i + 1}')
+        canvas.setPos(i * 5000, 0)
+        scene.addItem(canvas)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'course.mp')
+        MPFileWriter(filename).write(MPSerializer(scene).serialize_items())
+
+        target = CustomGraphicsScene(QUndoStack())
+        target.parentWindow = BenchmarkWindow()
+        view = QGraphicsView(target)
+        view.resize(1200, 800)
+        view.setSceneRect(0, 0, 1200, 800)
+
+        def load_eager():
+            MPDeserializer(target).deserialize_items(MPFileReader.load(filename))
+
+        built = []
+
+        def load_viewport():
+            # Only what intersects the viewport is built, the rest is left pending
+            loader = MPProgressiveLoader(target, MPDeserializer(target), MPFileReader(filename).open())
+            loader.start()
+            built.append(loader.total - len(loader.pending))
+            loader.stop()
+
+        # Clearing the scene from the previous run is not part of either load
+        eager = min(timeit.repeat(load_eager, setup=target.clear, number=1, repeat=repeat))
+        viewport = min(timeit.repeat(load_viewport, setup=target.clear, number=1, repeat=repeat))
+
+        print(f'{len(scene.items())} items, 1200x800 viewport')
+        report('eager load', eager)
+        report(f'viewport only, {built[-1]} records built', viewport)
+        print(f'{"speedup until interactive":<40} {eager / viewport:10.1f} x')
+
+
+def bench_journal(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()))
+    scene.parentWindow = BenchmarkWindow()
+    manager = scene.manager
+    items = [item for item in scene.items() if isinstance(item, CustomSvgItem)]
+
+    # Everything else is on the first canvas, the one the thumbnail shows
+    off_canvas = items[1]
+    off_canvas.setPos(6000, 0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'course.mp')
+        manager.filename = filename
+
+        def save_full():
+            manager.write_document(filename)
+
+        def save_incremental(item):
+            # One item moved since the last save, saved the way Ctrl+S does
+            def run():
+                scene.addCommand(PositionChangeCommand(scene.parentWindow, item, item.pos(), item.pos() + QPointF(1, 0)))
+                manager.save()
+
+            return run
+
+        save_full()
+        print(f'{len(scene.items())} items, one item moved between saves')
+        report('full save', min(timeit.repeat(save_full, number=1, repeat=repeat)))
+        save_full()
+        report('incremental save, on the thumbnail', min(timeit.repeat(save_incremental(items[0]), number=1, repeat=repeat)))
+        report('incremental save, off the thumbnail', min(timeit.repeat(save_incremental(off_canvas), number=1, repeat=repeat)))
+
+
+def bench_pixmaps(repeat):
+    photos = 12
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Noisy gradients compress like photos, so they make realistic JPEGs
+        filenames = []
+        for i in range(photos):
+            pixels = (np.random.default_rng(i).random((1500, 2000, 3)) * 64
+                      + np.linspace(0, 191, 2000)[None, :, None]).astype(np.uint8)
+            image = QImage(pixels.tobytes(), 2000, 1500, 6000, QImage.Format_RGB888)
+            filenames.append(os.path.join(directory, f'photo_{i}.jpg'))
+            image.save(filenames[-1], 'JPEG', 85)
+
+        scene = CustomGraphicsScene(QUndoStack())
+        for filename in filenames:
+            item = CustomPixmapItem()
+            item.loadFromFile(filename)
+            item.store_filename(filename)
+            scene.addItem(item)
+
+        serializer = MPSerializer(scene)
+        items_data = serializer.serialize_items()
+        records = items_data[1:]
+
+        def encode_png(pixmap):
+            buffer = QBuffer()
+            buffer.open(QIODevice.WriteOnly)
+            pixmap.save(buffer, 'PNG')
+            return buffer.data().data()
+
+        def save_recode():
+            # What every save did before, one PNG encode per image
+            return [encode_png(item.pixmap()) for item in serializer.serialized_items]
+
+        def load_recode():
+            # The old load path: decode the source file, the stored data, then a PNG round trip
+            items = []
+            for record in records:
+                data = bytes(serializer.assets[record['asset']])
+                item = CustomPixmapItem(QPixmap(record['filename']))
+                item.loadFromData(data)
+                item.loadFromData(encode_png(item.pixmap()))
+                items.append(item)
+
+            return items
+
+        def load_once():
+            deserializer = MPDeserializer(scene)
+            deserializer.assets = serializer.assets
+            return [deserializer.deserialize_custom_pixmap_item(record) for record in records]
+
+        png_size = sum(len(data) for data in save_recode())
+        jpeg_size = sum(len(data) for data in serializer.assets.values())
+
+        print(f'{photos} photos, 2000x1500 JPEG')
+        report('save, PNG recode', min(timeit.repeat(save_recode, number=1, repeat=repeat)))
+        report('save, original bytes', min(timeit.repeat(serializer.serialize_items, number=1, repeat=repeat)))
+        report('load, three decodes and an encode', min(timeit.repeat(load_recode, number=1, repeat=repeat)))
+        report('load, one decode', min(timeit.repeat(load_once, number=1, repeat=repeat)))
+        print(f'{"image payload, PNG":<40} {png_size:10d} bytes')
+        print(f'{"image payload, original JPEG":<40} {jpeg_size:10d} bytes')
+
+
+def bench_paths(repeat):
+    # Freehand strokes like the ones PenDrawerTool produces
+    paths = []
+    for i in range(50):
+        path = QPainterPath()
+        path.moveTo(0, i)
+        for p in range(5000):
+            path.cubicTo(p, i + math.sin(p / 10), p + 0.3, i + math.cos(p / 10), p + 0.6, i)
+
+        paths.append(path)
+
+    serializer = MPSerializer(None)
+    deserializer = MPDeserializer(None)
+
+    def encode_dicts():
+        # The format used before, one dict per element (curve data elements were dropped)
+        encoded = []
+        for path in paths:
+            elements = []
+            for i in range(path.elementCount()):
+                element = path.elementAt(i)
+                if element.isMoveTo():
+                    elements.append({'type': 'moveTo', 'x': element.x, 'y': element.y})
+                elif element.isLineTo():
+                    elements.append({'type': 'lineTo', 'x': element.x, 'y': element.y})
+                elif element.isCurveTo():
+                    elements.append({'type': 'curveTo', 'x': element.x, 'y': element.y})
+
+            encoded.append(elements)
+
+        return encoded
+
+    def encode_packed():
+        return [serializer.serialize_path(path) for path in paths]
+
+    dicts = encode_dicts()
+    packed = encode_packed()
+
+    def decode_dicts():
+        return [deserializer.deserialize_path_elements(elements) for elements in dicts]
+
+    def decode_packed():
+        return [deserializer.deserialize_path({'path': data}) for data in packed]
+
+    exact = all(path == decoded for path, decoded in zip(paths, decode_packed()))
+
+    print(f'{len(paths)} paths, {paths[0].elementCount()} elements each, packed round trip exact: {exact}')
+    report('encode, dicts', min(timeit.repeat(encode_dicts, number=1, repeat=repeat)))
+    report('encode, packed', min(timeit.repeat(encode_packed, number=1, repeat=repeat)))
+    report('decode, dicts', min(timeit.repeat(decode_dicts, number=1, repeat=repeat)))
+    report('decode, packed', min(timeit.repeat(decode_packed, number=1, repeat=repeat)))
+    # The dict format drops curve data elements, so compare the cost per stored element
+    dict_elements = sum(len(elements) for elements in dicts)
+    packed_elements = sum(len(data['types']) for data in packed)
+    print(f'{"pickled bytes per element, dicts":<40} {len(pickle.dumps(dicts)) / dict_elements:10.2f}')
+    print(f'{"pickled bytes per element, packed":<40} {len(pickle.dumps(packed)) / packed_elements:10.2f}')
+
+
+def bench_reader(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()))
+    items_data = MPSerializer(scene).serialize_items()
+    files = 100
+
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = [os.path.join(directory, f'course_{i}.mp') for i in range(files)]
+        for filename in filenames:
+            MPFileWriter(filename).write(items_data)
+
+        def names_full_load():
+            return [[data['name'] for data in MPFileReader.load(filename)[1:] if data['type'] == 'CanvasItem']
+                    for filename in filenames]
+
+        def names_mapped():
+            names = []
+            for filename in filenames:
+                with MPFileReader(filename, mapped=True, verify=False) as reader:
+                    names.append(reader.canvas_names())
+
+            return names
+
+        print(f'{files} documents, {os.path.getsize(filenames[0])} bytes each')
+        report('canvas names, full load', min(timeit.repeat(names_full_load, number=1, repeat=repeat)))
+        report('canvas names, mapped index', min(timeit.repeat(names_mapped, number=1, repeat=repeat)))
+
+
+def bench_decode(repeat):
+    photos = 12
+    scene = build_course(CustomGraphicsScene(QUndoStack()), elements=len(course_elements), paths=0, labels=0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(photos):
+            pixels = (np.random.default_rng(i).random((1500, 2000, 3)) * 64
+                      + np.linspace(0, 191, 2000)[None, :, None]).astype(np.uint8)
+            filename = os.path.join(directory, f'photo_{i}.jpg')
+            QImage(pixels.tobytes(), 2000, 1500, 6000, QImage.Format_RGB888).save(filename, 'JPEG', 85)
+
+            item = CustomPixmapItem()
+            item.loadFromFile(filename)
+            item.store_filename(filename)
+            scene.addItem(item)
+
+        for i in range(200):
+            item = CustomTextItem(f'# Trick {i}\n\n' + '* **Element** with a *note*\n' * 20)
+            font = QFont('Arial')
+            font.setPixelSize(20)
+            item.setFont(font)
+            item.toMarkdown()
+            scene.addItem(item)
+
+        filename = os.path.join(directory, 'course.mp')
+        MPFileWriter(filename).write(MPSerializer(scene).serialize_items())
+
+        target = CustomGraphicsScene(QUndoStack())
+        target.parentWindow = BenchmarkWindow()
+
+        class SerialDeserializer(MPDeserializer):
+            def prefetch(self, records):
+                pass
+
+        def load(deserializer_class, threads):
+            def run():
+                target.clear()
+                deserializer = deserializer_class(target)
+                deserializer.decode_threads = threads
+                deserializer.deserialize_items(MPFileReader.load(filename))
+
+            return run
+
+        threads = MPDeserializer.decode_threads
+        print(f'{len(scene.items())} items, {photos} photos, {len(course_elements)} SVGs, {os.cpu_count()} cores')
+        report('open, decoding on the GUI thread', min(timeit.repeat(load(SerialDeserializer, 1), number=1, repeat=repeat)))
+        report('open, one decoder thread', min(timeit.repeat(load(MPDeserializer, 1), number=1, repeat=repeat)))
+        report(f'open, {threads} decoder threads', min(timeit.repeat(load(MPDeserializer, threads), number=1, repeat=repeat)))
+
+
+def bench_insert(repeat):
+    class LegacyScene(CustomGraphicsScene):
+        # The old addItem, it visited every item in the scene on every insertion
+        def addItem(self, item):
+            QGraphicsScene.addItem(self, item)
+
+            if self.gridEnabled:
+                for item in self.items():
+                    if not isinstance(item, CanvasTextItem):
+                        item.gridEnabled = True
+
+    def make_items(count):
+        items = []
+        for i in range(count):
+            item = CustomPathItem(QPainterPath(QPointF(i, 0)))
+            item.setPos((i * 37) % 4000, (i * 53) % 3000)
+            item.setFlag(QGraphicsItem.ItemIsSelectable)
+            item.setSelected(True)
+            items.append(item)
+
+        return items
+
+    def insert(scene_class, count, bulk):
+        def run():
+            scene = scene_class(QUndoStack())
+            scene.setGridEnabled(True)
+            selection_signals = []
+            scene.selectionChanged.connect(lambda: selection_signals.append(None))
+
+            items = make_items(count)
+            if bulk:
+                scene.addItems(items)
+
+            else:
+                for item in items:
+                    scene.addItem(item)
+
+            scene.itemAt(QPointF(1, 1), QTransform())
+            return len(selection_signals)
+
+        return run
+
+    for count in (1000, 2000, 10000):
+        if count <= 2000:
+            report(f'{count} items, old addItem', min(timeit.repeat(insert(LegacyScene, count, False), number=1, repeat=repeat)))
+
+        report(f'{count} items, addItem', min(timeit.repeat(insert(CustomGraphicsScene, count, False), number=1, repeat=repeat)))
+        report(f'{count} items, addItems', min(timeit.repeat(insert(CustomGraphicsScene, count, True), number=1, repeat=repeat)))
+
+    print(f'{"selectionChanged signals, addItem":<40} {insert(CustomGraphicsScene, 10000, False)():10d}')
+    print(f'{"selectionChanged signals, addItems":<40} {insert(CustomGraphicsScene, 10000, True)():10d}')
+
+
+def bench_export(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()), elements=300, paths=20, labels=20)
+    canvases = [item for item in scene.items() if isinstance(item, CanvasItem)]
+
+    # Eight canvases over the same course
+    for i in range(1, 8):
+        canvas = CanvasItem(QRectF(0, 0, 4000, 3000), f'Canvas {i + 1}')
+        canvas.setPos((i % 2) * 500, (i // 2) * 100)
+        scene.addItem(canvas)
+        canvases.append(canvas)
+
+    with tempfile.TemporaryDirectory() as directory:
+        jobs = [(canvas, os.path.join(directory, f'canvas_{i}.png')) for i, canvas in enumerate(canvases)]
+
+        def export_serial():
+            # The old export loop, every render and encode on the GUI thread
+            for canvas, filename in jobs:
+                rect = canvas.sceneBoundingRect()
+                image = QImage(rect.size().toSize(), QImage.Format_ARGB32)
+                painter = QPainter(image)
+                painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+                painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+                scene.render(painter, target=QRectF(image.rect()), source=rect)
+                painter.end()
+                image.save(filename)
+
+        def export_pool():
+            # Longest gap between event loop passes, the time the app was unresponsive for
+            stalls = [0.0]
+            last = [time.perf_counter()]
+
+            def heartbeat():
+                now = time.perf_counter()
+                stalls[0] = max(stalls[0], now - last[0])
+                last[0] = now
+
+            timer = QTimer()
+            timer.setInterval(5)
+            timer.timeout.connect(heartbeat)
+            timer.start()
+
+            start = time.perf_counter()
+            MPCanvasExporter(scene).exec(jobs)
+            timer.stop()
+
+            return time.perf_counter() - start, stalls[0]
+
+        def export_cached():
+            # Export All again with nothing changed, every canvas comes from the cache
+            MPCanvasExporter(scene, cache=cache).exec(jobs)
+
+        runs = [export_pool() for _ in range(repeat)]
+
+        cache = MPExportCache(os.path.join(directory, 'cache'))
+        MPCanvasExporter(scene, cache=cache).exec(jobs)
+
+        print(f'{len(jobs)} canvases, 4000x3000 PNG, {QThreadPool.globalInstance().maxThreadCount()} threads')
+        report('GUI thread export, app frozen for', min(timeit.repeat(export_serial, number=1, repeat=repeat)))
+        report('thread pool export, total', min(run[0] for run in runs))
+        report('thread pool export, longest freeze', min(run[1] for run in runs))
+        report('unchanged export from cache', min(timeit.repeat(export_cached, number=1, repeat=repeat)))
+
+
+def bench_tiled(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()), elements=300, paths=20, labels=20)
+    canvas = next(item for item in scene.items() if isinstance(item, CanvasItem))
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'canvas.png')
+
+        for scale in (4, 8):
+            exporter = MPTiledExporter(scene, scale)
+            size = exporter.size(canvas)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+
+            seconds = min(timeit.repeat(lambda: exporter.export(canvas, filename, 72 * scale), number=1, repeat=repeat))
+
+            whole = size.width() * size.height() * 4 / 1024 / 1024
+            band = size.width() * exporter.tile_size * 4 / 1024 / 1024
+            print(f'{scale}x, {size.width()}x{size.height()} PNG ({os.path.getsize(filename) / 1024 / 1024:.1f} MB): '
+                  f'whole image {whole:.0f} MB, one band {band:.0f} MB')
+
+            if resource:
+                # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+                grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024
+                print(f'peak memory grew {grown:.0f} MB')
+
+            report(f'tiled export at {scale}x', seconds)
+
+
+def bench_svg(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()), elements=400, paths=20, path_points=500, labels=20)
+    canvas = next(item for item in scene.items() if isinstance(item, CanvasItem))
+    rect = canvas.sceneBoundingRect()
+
+    with tempfile.TemporaryDirectory() as directory:
+        generated = os.path.join(directory, 'generator.svg')
+        written = os.path.join(directory, 'writer.svg')
+
+        def export_generator():
+            # The old export, every paint call recorded by QSvgGenerator
+            svg_generator = QSvgGenerator()
+            svg_generator.setFileName(generated)
+            svg_generator.setSize(rect.size().toSize())
+            svg_generator.setViewBox(rect)
+
+            painter = QPainter(svg_generator)
+            scene.render(painter, target=rect, source=rect)
+            painter.end()
+
+        def export_writer():
+            MPSVGWriter(scene).write(canvas, written)
+
+        print('400 course elements, 20 paths, 20 labels')
+        report('QSvgGenerator export', min(timeit.repeat(export_generator, number=1, repeat=repeat)))
+        report('MPSVGWriter export', min(timeit.repeat(export_writer, number=1, repeat=repeat)))
+        print(f'QSvgGenerator {os.path.getsize(generated) / 1024:.0f} KB, MPSVGWriter {os.path.getsize(written) / 1024:.0f} KB')
+
+
+def bench_share(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()), elements=300, paths=20, labels=20)
+    canvases = [item for item in scene.items() if isinstance(item, CanvasItem)]
+
+    for i in range(1, 8):
+        canvas = CanvasItem(QRectF(0, 0, 1500, 1000), f'Canvas {i + 1}')
+        canvas.setPos((i % 4) * 600, (i // 4) * 700)
+        scene.addItem(canvas)
+        canvases.append(canvas)
+
+    # A quarter second per upload, about what a phone photo takes over home broadband
+    latency = 0.25
+
+    with tempfile.TemporaryDirectory() as directory:
+        jobs = [(canvas, os.path.join(directory, f'canvas_{i}.png')) for i, canvas in enumerate(canvases)]
+        backend = MPLocalDirectoryBackend(os.path.join(directory, 'uploads'), latency)
+
+        def share_serial():
+            # The old share, every canvas exported first and then uploaded one by one
+            for filename in MPCanvasExporter(scene).exec(jobs):
+                backend.upload(filename)
+
+        def share_pipeline():
+            MPSharePipeline(scene, backend).exec(jobs)
+
+        print(f'{len(jobs)} canvases, {latency * 1000:.0f} ms per upload')
+        report('export then upload', min(timeit.repeat(share_serial, number=1, repeat=repeat)))
+        report('pipelined export and upload', min(timeit.repeat(share_pipeline, number=1, repeat=repeat)))
+
+
+def bench_previews(repeat):
+    scene = build_course(CustomGraphicsScene(QUndoStack()))
+    scene.parentWindow = BenchmarkWindow()
+    items_data = MPSerializer(scene).serialize_items()
+    preview = MPDocumentPreview(scene).build(len(items_data) - 1)
+    files = 50
+
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = [os.path.join(directory, f'course_{i}.mp') for i in range(files)]
+        for filename in filenames:
+            MPFileWriter(filename).write(items_data, preview)
+
+        def summaries_full_load():
+            # What a recent files browser had to do before documents carried a preview
+            summaries = []
+            for filename in filenames:
+                items = MPFileReader.load(filename)[1:]
+                summaries.append((sum(1 for data in items if data['type'] == 'CanvasItem'), len(items)))
+
+            return summaries
+
+        def summaries_preview():
+            return [MPFileReader.readPreview(filename) for filename in filenames]
+
+        def thumbnails_preview():
+            pixmaps = []
+            for preview in summaries_preview():
+                pixmap = QPixmap()
+                pixmap.loadFromData(preview['thumbnail'], 'PNG')
+                pixmaps.append(pixmap)
+
+            return pixmaps
+
+        print(f'{files} documents, {len(preview[1])} byte thumbnails')
+        report('building the preview', min(timeit.repeat(lambda: MPDocumentPreview(scene).build(len(items_data) - 1),
+                                                         number=1, repeat=repeat)))
+        report('summaries, full load', min(timeit.repeat(summaries_full_load, number=1, repeat=repeat)))
+        report('summaries, preview only', min(timeit.repeat(summaries_preview, number=1, repeat=repeat)))
+        report('summaries and thumbnails, preview only', min(timeit.repeat(thumbnails_preview, number=1,
+                                                                           repeat=repeat)))
+
+
+def bench_grid(repeat):
+    class LegacyScene(CustomGraphicsScene):
+        # The old drawBackground, every grid line in the exposed rect as a QLine on every repaint
+        def drawBackground(self, painter, rect):
+            QGraphicsScene.drawBackground(self, painter, rect)
+
+            left, right = int(math.floor(rect.left())), int(math.ceil(rect.right()))
+            top, bottom = int(math.floor(rect.top())), int(math.ceil(rect.bottom()))
+            first_left = left - (left % self.gridSize)
+            first_top = top - (top % self.gridSize)
+
+            lines_light, lines_dark = [], []
+            for x in range(first_left, right, self.gridSize):
+                (lines_light if x % (self.gridSize * self.gridSquares) else lines_dark).append(QLine(x, top, x, bottom))
+
+            for y in range(first_top, bottom, self.gridSize):
+                (lines_light if y % (self.gridSize * self.gridSquares) else lines_dark).append(QLine(left, y, right, y))
+
+            painter.setPen(QPen(QColor('#a3a3a3'), 1))
+            painter.drawLines(*lines_light)
+            painter.setPen(QPen(QColor('#b8b8b8'), 1))
+            painter.drawLines(*lines_dark)
+
+    image = QImage(1920, 1080, QImage.Format_ARGB32_Premultiplied)
+
+    def paint(scene, zoom, frames=10):
+        # Frames of a pan across the scene at the given zoom, as a view would paint them
+        def run():
+            for frame in range(frames):
+                painter = QPainter(image)
+                painter.setRenderHint(QPainter.Antialiasing)
+                painter.scale(zoom, zoom)
+                painter.translate(-frame * 37.5, -frame * 21.25)
+                scene.drawBackground(painter, painter.worldTransform().inverted()[0].mapRect(QRectF(image.rect())))
+                painter.end()
+
+        return run
+
+    for scene_class, name in ((LegacyScene, 'old'), (CustomGraphicsScene, 'cached tiles')):
+        scene = scene_class(QUndoStack())
+        scene.setGridEnabled(True)
+
+        for zoom in (2.0, 1.0, 0.25, 0.05):
+            report(f'10 frames at {zoom:g}x, {name}', min(timeit.repeat(paint(scene, zoom), number=1, repeat=repeat)))
+
+
+def bench_text_path(repeat):
+    class LegacyPathItem(CustomPathItem):
+        # The old paint, every character placed with pointAtPercent and drawn on its own
+        def paint(self, painter, option, widget=None):
+            QGraphicsPathItem.paint(self, painter, option, widget)
+
+            pen = painter.pen()
+            pen.setWidth(self.text_along_path_spacing)
+            pen.setColor(self.text_along_path_color)
+            painter.setPen(pen)
+            painter.setFont(self.text_along_path_font)
+
+            path = self.path()
+            percent_increase = 1 / (len(self.text_along_path) + 1)
+            percent = 0
+
+            for char in self.text_along_path:
+                percent += percent_increase
+                painter.save()
+                painter.translate(path.pointAtPercent(percent))
+                painter.rotate(-path.angleAtPercent(percent))
+                painter.drawText(QPointF(0, -pen.width()), char)
+                painter.restore()
+
+    def make_items(item_class, count=20):
+        # Run lines annotated with the tricks along them
+        items = []
+
+        for i in range(count):
+            path = QPainterPath()
+            path.moveTo(0, i * 150)
+            for p in range(0, 2000, 100):
+                path.cubicTo(p + 30, i * 150 - 60, p + 70, i * 150 + 60, p + 100, i * 150)
+
+            item = item_class(path)
+            item.add_text = True
+            item.setTextAlongPath('Kickflip - Backside 50-50 - Frontside Boardslide - ' * 3)
+            items.append(item)
+
+        return items
+
+    image = QImage(1920, 1080, QImage.Format_ARGB32_Premultiplied)
+    option = QStyleOptionGraphicsItem()
+
+    def paint(items, frames=10):
+        def run():
+            for frame in range(frames):
+                painter = QPainter(image)
+                painter.setRenderHint(QPainter.Antialiasing)
+                painter.translate(-frame * 20, 0)
+
+                for item in items:
+                    item.paint(painter, option)
+
+                painter.end()
+
+        return run
+
+    for item_class, name in ((LegacyPathItem, 'old'), (CustomPathItem, 'cached layout')):
+        items = make_items(item_class)
+        report(f'10 frames, 20 paths, {name}', min(timeit.repeat(paint(items), number=1, repeat=repeat)))
+
+    items = make_items(CustomPathItem)
+    report('layout of 20 paths', min(timeit.repeat(lambda: [item.buildTextAlongPathGlyphs() for item in items],
+                                                   number=1, repeat=repeat)))
+
+
+def bench_measure(repeat):
+    def stroke(count):
+        return [QPointF(i, math.sin(i / 25) * 100) for i in range(count)]
+
+    def draw(points, measured):
+        # A stroke drawn point by point, with the tooltip asking for its length on every move
+        def run():
+            path = QPainterPath(points[0])
+            measure = MPPathMeasure()
+            measure.move_to(points[0])
+
+            for point in points[1:]:
+                path.lineTo(point)
+
+                if measured:
+                    measure.line_to(point)
+                    measure.length()
+
+                else:
+                    path.length()
+
+        return run
+
+    for count in (1000, 5000):
+        points = stroke(count)
+        report(f'{count} point stroke, path.length()', min(timeit.repeat(draw(points, False), number=1, repeat=repeat)))
+        report(f'{count} point stroke, MPPathMeasure', min(timeit.repeat(draw(points, True), number=1, repeat=repeat)))
+
+    path = QPainterPath(QPointF(0, 0))
+    for point in stroke(5000):
+        path.lineTo(point)
+
+    measure = MPPathMeasure(path)
+    percents = [i / 1000 for i in range(1000)]
+    lengths = np.array(percents) * measure.length()
+
+    report('1000 points, pointAtPercent', min(timeit.repeat(lambda: [path.pointAtPercent(t) for t in percents],
+                                                            number=1, repeat=repeat)))
+    report('1000 points, point_at_length', min(timeit.repeat(lambda: measure.point_at_length(lengths),
+                                                             number=1, repeat=repeat)))
+
+
+def bench_labels(repeat):
+    class LegacyLeaderLineItem(LeaderLineItem):
+        # The old item: arrowhead and frame worked out on every paint, the endpoint always
+        # written back, and the path item's own bounding rect and shape
+        def boundingRect(self):
+            return QGraphicsPathItem.boundingRect(self)
+
+        def shape(self):
+            return QGraphicsPathItem.shape(self)
+
+        def paint(self, painter, option, widget=None):
+            QGraphicsPathItem.paint(self, painter, option, widget)
+
+            painter.setPen(self.pen())
+            painter.setBrush(self.brush())
+            painter.drawRect(self.mapRectFromItem(self.text_element, self.text_element.boundingRect()))
+
+            try:
+                painter.setPen(self.pen())
+                painter.setBrush(QBrush(QColor(self.pen().color().name())))
+
+                arrow_head = self.arrowHead()
+                if arrow_head is not None:
+                    painter.drawPolygon(arrow_head)
+
+            except Exception as e:
+                print(e)
+
+        def updatePathEndPoint(self):
+            path = self.path()
+            end = path.elementAt(path.elementCount() - 1)
+            text_rect = self.text_element.boundingRect()
+            corners = [self.mapFromItem(self.text_element, corner) for corner in
+                       (text_rect.topLeft(), text_rect.topRight(), text_rect.bottomLeft(), text_rect.bottomRight())]
+            start = min(corners, key=lambda corner: (corner - QPointF(end.x, end.y)).manhattanLength())
+
+            path.setElementPositionAt(0, start.x(), start.y())
+            QGraphicsPathItem.setPath(self, path)
+
+    def make_items(item_class, count=1000):
+        items = []
+
+        for i in range(count):
+            path = QPainterPath()
+            path.moveTo((i % 40) * 50, (i // 40) * 50)
+            path.lineTo((i % 40) * 50 + 30, (i // 40) * 50 + 40)
+
+            item = item_class(path, f'Trick {i}')
+            item.updatePathEndPoint()
+            items.append(item)
+
+        return items
+
+    image = QImage(1920, 1080, QImage.Format_ARGB32_Premultiplied)
+    option = QStyleOptionGraphicsItem()
+
+    def paint(items, frames=10):
+        def run():
+            for frame in range(frames):
+                painter = QPainter(image)
+                painter.setRenderHint(QPainter.Antialiasing)
+
+                for item in items:
+                    painter.save()
+                    painter.translate(item.pos())
+                    item.paint(painter, option)
+                    painter.restore()
+
+                painter.end()
+
+        return run
+
+    def update_end_points(items):
+        # What MPRUN.update('item_update') and undo/redo used to do for every label
+        def run():
+            for item in items:
+                item.updatePathEndPoint()
+                item.boundingRect()
+
+        return run
+
+    for item_class, name in ((LegacyLeaderLineItem, 'old'), (LeaderLineItem, 'cached geometry')):
+        items = make_items(item_class)
+        report(f'10 frames, 1000 labels, {name}', min(timeit.repeat(paint(items), number=1, repeat=repeat)))
+        report(f'1000 endpoint updates, {name}', min(timeit.repeat(update_end_points(items), number=1, repeat=repeat)))
+
+
+def bench_dirty(repeat):
+    def legacy_update(scene):
+        # The old MPRUN.update('item_update'), CustomGraphicsScene.update() then every item again
+        scene.update()
+        invalidated = 0
+
+        for item in scene.items():
+            item.update()
+            invalidated += 1
+
+        for item in scene.items():
+            item.update()
+            invalidated += 1
+
+            if isinstance(item, LeaderLineItem):
+                item.updatePathEndPoint()
+
+        return invalidated
+
+    scene = build_course(CustomGraphicsScene(QUndoStack()))
+    window = BenchmarkWindow()
+    view = QGraphicsView(scene)
+    view.resize(1920, 1080)
+    view.show()
+    QApplication.processEvents()
+
+    items = [item for item in scene.items() if isinstance(item, CustomSvgItem)][:3]
+    view.centerOn(items[0])
+    QApplication.processEvents()
+    invalidated = []
+
+    def frames(legacy, count=20):
+        # Nudges three items per frame, as the align and arrange actions do, and paints
+        def run():
+            for frame in range(count):
+                offset = QPointF(1 if frame % 2 == 0 else -1, 0)
+                command = MultiItemPositionChangeCommand(window, items, [item.pos() for item in items],
+                                                         [item.pos() + offset for item in items])
+                scene.undo_stack.push(command)
+
+                if legacy:
+                    invalidated.append(legacy_update(scene))
+
+                else:
+                    scene.dirty.markCommand(command)
+                    invalidated.append(scene.dirty.flush())
+
+                QApplication.processEvents()
+
+        return run
+
+    for legacy, name in ((True, 'old'), (False, 'dirty tracking')):
+        invalidated.clear()
+        report(f'20 frames, {name}', min(timeit.repeat(frames(legacy), number=1, repeat=repeat)))
+        print(f'{f"items invalidated per frame, {name}":<40} {invalidated[-1]:10d}')
+
+    view.close()
+
+
+benchmarks = {
+    'container': bench_container,
+    'assets': bench_assets,
+    'lazy': bench_lazy,
+    'journal': bench_journal,
+    'pixmaps': bench_pixmaps,
+    'paths': bench_paths,
+    'reader': bench_reader,
+    'decode': bench_decode,
+    'insert': bench_insert,
+    'export': bench_export,
+    'tiled': bench_tiled,
+    'svg': bench_svg,
+    'share': bench_share,
+    'previews': bench_previews,
+    'grid': bench_grid,
+    'dirty': bench_dirty,
+    'textpath': bench_text_path,
+    'measure': bench_measure,
+    'labels': bench_labels,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run MPRUN benchmarks')
+    parser.add_argument('names', nargs='*', default=list(benchmarks), help='benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs (best is reported)')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    for name in args.names:
+        print(f'== {name} ==')
+        benchmarks[name](args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+from src.scripts.imports import *
+from src.framework.serializer import MPSerializer
+from src.framework.container import MPFileWriter, MPFileReader
+
+if getattr(sys, 'frozen', False):
+    os.chdir(sys._MEIPASS)
+
+
+class AutosaveTask(QRunnable):
+    def __init__(self, autosaver, filename, items_data):
+        super().__init__()
+        self.autosaver = autosaver
+        self.filename = filename
+        self.items_data = items_data
+
+    def run(self):
+        # Encoding, compression and fsync all happen here, off the GUI thread. Failures are
+        # reported through the autosaver's signal, which delivers them on the GUI thread
+        try:
+            MPFileWriter(self.filename, compress=True).write(self.items_data)
+
+        except Exception as e:
+            self.autosaver.failed.emit(str(e))
+
+
+class MPAutosaver(QObject):
+    # Periodically writes a recovery snapshot of the scene. Snapshots reuse the record of
+    # every item that has not changed since it was last serialized (or loaded), so the
+    # work left on the GUI thread is proportional to the edits, not to the document
+    failed = pyqtSignal(str)  # error, a snapshot could not be written
+
+    directory = 'internal data/recovery'
+    keep = 3
+
+    def __init__(self, scene):
+        super().__init__()
+        self.scene = scene
+        self.serializer = MPSerializer(scene)
+        self.records = {}
+        self.assets = {}
+        self.slot = 0
+
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.autosave)
+
+    def setInterval(self, minutes):
+        # An interval of 0 turns autosave off
+        if minutes > 0:
+            self.timer.start(minutes * 60 * 1000)
+
+        else:
+            self.timer.stop()
+
+    def clear(self):
+        self.records = {}
+        self.assets = {}
+
+    def seed(self, item, record, bounds=None):
+        # Records read from a document or written by a full save are up to date
+        record = dict(record)
+
+        if bounds is not None:
+            record['bounds'] = list(bounds)
+
+        self.records[item] = record
+
+    def seed_assets(self, assets):
+        self.assets.update(assets)
+
+    def recovery_files(self):
+        return [os.path.join(self.directory, f'recovery_{i}.mp') for i in range(self.keep)]
+
+    def latest(self):
+        existing = [filename for filename in self.recovery_files() if os.path.exists(filename)]
+
+        if not existing:
+            return None
+
+        return max(existing, key=os.path.getmtime)
+
+    def snapshot(self):
+        tracker = self.scene.manager.tracker
+
+        for item in tracker.autosave_dirty:
+            self.records.pop(item, None)
+
+        tracker.autosave_dirty.clear()
+
+        records = {}
+        for item in self.scene.items():
+            if item.parentItem() is not None:
+                continue
+
+            if item not in self.records:
+                data = self.serializer.serialize_item(item)
+
+                if data is None:
+                    continue
+
+                self.records[item] = data
+
+            records[item] = self.records[item]
+
+        # Forget removed items and unused assets
+        self.records = records
+        self.assets.update(self.serializer.assets)
+        self.serializer.reset_assets()
+
+        used = set()
+        for record in records.values():
+            self.collect_assets(record, used)
+
+        self.assets = {key: self.assets[key] for key in used if key in self.assets}
+
+        return [{
+            'mpversion': self.scene.mpversion,
+            'document': self.scene.manager.filename,
+            'autosaved': time.time(),
+            'item_count': len(records),
+            'assets': dict(self.assets),
+        }] + list(records.values())
+
+    def collect_assets(self, record, used):
+        if record.get('asset'):
+            used.add(record['asset'])
+
+        for child in record.get('children', []):
+            self.collect_assets(child, used)
+
+    def autosave(self):
+        # Nothing to recover from an unmodified document, and never queue up snapshots
+        # behind a slow disk
+        if not self.scene.hasChanges() or self.pool.activeThreadCount():
+            return
+
+        loader = self.scene.manager.loader
+
+        if loader is not None and loader.isLoading():
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            filename = self.recovery_files()[self.slot]
+            self.slot = (self.slot + 1) % self.keep
+
+            self.pool.start(AutosaveTask(self, filename, self.snapshot()))
+
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def discard(self):
+        # The document is safely on disk (or was closed on purpose)
+        self.pool.waitForDone()
+
+        for filename in self.recovery_files():
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def recovered_document(self, filename):
+        with MPFileReader(filename) as reader:
+            return reader.metadata().get('document', 'Untitled')
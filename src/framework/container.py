@@ -0,0 +1,903 @@
+import io
+import mmap
+import struct
+import tempfile
+import zlib
+from array import array
+
+from src.scripts.imports import *
+
+# MPRUN binary document container
+#
+# Layout (all values little-endian):
+#   header          fixed size, see HEADER
+#   preview         thumbnail and summary, see PREVIEW_HEADER, at the fixed offset HEADER.size
+#                   with room reserved to grow so incremental saves can rewrite it in place
+#   sections        raw section payloads, in any order
+#   section table   section_count * SECTION_ENTRY, located by the header
+#
+# The section table is written last so the header only has to be patched once the
+# payload offsets are known.
+#
+# Incremental saves append a JRNL section plus a new copy of the section table to the
+# end of the file and then repoint the header, the previous table is left behind as
+# dead bytes until the next full save compacts the document.
+#
+# The preview lives in what used to be reserved header space, documents saved without one
+# have zeros there and older readers simply never look at it.
+MAGIC = b'\x89MPRUN\r\n'
+FORMAT_VERSION = 4
+
+HEADER = struct.Struct('<8sHHIQIII28x')
+PREVIEW_HEADER = struct.Struct('<II')
+SECTION_ENTRY = struct.Struct('<4sQQI')
+INDEX_HEADER = struct.Struct('<HI')
+INDEX_ENTRY = struct.Struct('<BQIddddd')
+INDEX_ENTRY_V2 = struct.Struct('<BQId')
+ASSET_ENTRY = struct.Struct('<32sQI')
+JOURNAL_HEADER = struct.Struct('<II')
+JOURNAL_ENTRY = struct.Struct('<BIBQIddddd')
+RECORD_HEADER = struct.Struct('<IH')
+BLOB_LENGTH = struct.Struct('<I')
+
+SECTION_META = b'META'
+SECTION_ITEMS = b'ITEM'
+SECTION_INDEX = b'INDX'
+SECTION_ASSETS = b'ASST'
+SECTION_JOURNAL = b'JRNL'
+
+# Header flags
+FLAG_COMPRESSED = 1
+
+# Smallest room reserved for the preview, a 256 px PNG thumbnail is usually 20-40 KB
+PREVIEW_CAPACITY = 64 * 1024
+
+# Journal operations, items are identified by their uid (their position in the item index
+# of the last full save, or a new uid handed out by MPChangeTracker)
+JOURNAL_PUT = 0
+JOURNAL_DELETE = 1
+
+# Item type codes used by the item index, the order must never change
+ITEM_TYPES = [
+    'CanvasItem',
+    'CustomTextItem',
+    'CustomPathItem',
+    'CustomGraphicsItemGroup',
+    'LeaderLineItem',
+    'CustomSvgItem',
+    'CustomPixmapItem',
+]
+
+# Fields that are stored outside the JSON record header
+TEXT_BLOB_FIELDS = ('raw_svg_data',)
+BINARY_BLOB_FIELDS = ('data',)
+PACKED_PATH_FIELDS = ('path',)
+PATH_FIELDS = ('elements',)
+PATH_ELEMENT_TYPES = ['moveTo', 'lineTo', 'curveTo']
+
+
+# Every record header is a JSON object that starts with the item type, which is what a scan
+# of a damaged document looks for (MPFileReader.scan)
+RECORD_START = b'{"type":"'
+
+# One encoder for every record header, json.dumps would build a new one per call. Records
+# are plain trees of dicts and lists, so the circular reference check is skipped
+RECORD_ENCODER = json.JSONEncoder(separators=(',', ':'), check_circular=False)
+
+
+class MPFileError(Exception):
+    pass
+
+
+class MPFileWriter:
+    def __init__(self, filename, compress=False):
+        # Compressed sections trade random access for size, used for recovery snapshots
+        self.filename = filename
+        self.compress = compress
+
+    def write(self, items_data, preview=None):
+        # items_data is the list built by MPSerializer.serialize_items (metadata first),
+        # preview an optional (summary, thumbnail PNG bytes) pair, see MPDocumentPreview
+        metadata = dict(items_data[0])
+        assets = metadata.pop('assets', {})
+        records = items_data[1:]
+
+        # The records are written part by part, so the path and image blobs are never
+        # copied into one big buffer first
+        parts = []
+        index = [INDEX_HEADER.pack(INDEX_ENTRY.size, len(records))]
+        offset = 0
+
+        for record in records:
+            record_parts = self.record_parts(record)
+            length = sum(map(len, record_parts))
+            parts.extend(record_parts)
+
+            index.append(INDEX_ENTRY.pack(ITEM_TYPES.index(record['type']),
+                                          offset,
+                                          length,
+                                          self.record_z_value(record),
+                                          *self.record_bounds(record)))
+            offset += length
+
+        metadata['format_version'] = FORMAT_VERSION
+
+        sections = [
+            (SECTION_META, json.dumps(metadata, separators=(',', ':')).encode('utf-8')),
+            (SECTION_INDEX, b''.join(index)),
+            (SECTION_ITEMS, parts),
+            (SECTION_ASSETS, self.encode_assets(assets)),
+        ]
+
+        flags = 0
+
+        if self.compress:
+            flags |= FLAG_COMPRESSED
+            sections = [(tag, zlib.compress(b''.join(payload) if isinstance(payload, list) else payload))
+                        for tag, payload in sections]
+
+        preview_payload = self.encode_preview(preview)
+        preview_capacity = self.preview_capacity(preview_payload)
+
+        # Write to a temporary file first so a failed save never truncates the document
+        temp_filename = f'{self.filename}.tmp'
+
+        with open(temp_filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, flags, 0, 0, 0, 0, 0))
+            f.write(preview_payload.ljust(preview_capacity, b'\0'))
+
+            table = []
+            for tag, payload in sections:
+                offset = f.tell()
+                crc = self.copy(payload, f)
+                table.append(SECTION_ENTRY.pack(tag, offset, f.tell() - offset, crc))
+
+            table_offset = f.tell()
+            f.write(b''.join(table))
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(table), table_offset,
+                                len(preview_payload), preview_capacity, zlib.crc32(preview_payload)))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_filename, self.filename)
+
+    def append(self, puts, deletes, assets, preview=None):
+        # puts is a list of (uid, record), deletes a list of uids, assets only holds the
+        # assets the document does not contain yet. Returns the size of the journal section
+        entries = []
+        records = io.BytesIO()
+        records_offset = JOURNAL_HEADER.size + (len(puts) + len(deletes)) * JOURNAL_ENTRY.size
+
+        for uid, record in puts:
+            offset = records.tell()
+            records.write(self.encode_record(record))
+
+            entries.append(JOURNAL_ENTRY.pack(JOURNAL_PUT,
+                                              uid,
+                                              ITEM_TYPES.index(record['type']),
+                                              records_offset + offset,
+                                              records.tell() - offset,
+                                              self.record_z_value(record),
+                                              *self.record_bounds(record)))
+
+        for uid in deletes:
+            entries.append(JOURNAL_ENTRY.pack(JOURNAL_DELETE, uid, 0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0))
+
+        payload = b''.join([JOURNAL_HEADER.pack(len(entries), records_offset + records.tell())]
+                           + entries
+                           + [records.getvalue(), self.encode_assets(assets)])
+
+        with open(self.filename, 'r+b') as f:
+            (magic, version, flags, section_count, table_offset,
+             preview_length, preview_capacity, preview_crc) = HEADER.unpack(f.read(HEADER.size))
+
+            if magic != MAGIC or version != FORMAT_VERSION or flags & FLAG_COMPRESSED:
+                raise MPFileError(f'{self.filename} has to be saved in full before it can be journaled')
+
+            f.seek(table_offset)
+            table = f.read(section_count * SECTION_ENTRY.size)
+
+            f.seek(0, os.SEEK_END)
+            journal_offset = f.tell()
+            f.write(payload)
+
+            new_table_offset = f.tell()
+            f.write(table + SECTION_ENTRY.pack(SECTION_JOURNAL, journal_offset, len(payload), zlib.crc32(payload)))
+
+            # A new preview is written over the old one when it fits the reserved room, the
+            # old one is kept otherwise. If the save dies before the header is rewritten the
+            # checksum no longer matches and the document just shows no preview
+            preview_payload = self.encode_preview(preview)
+
+            if preview is not None and len(preview_payload) <= preview_capacity:
+                f.seek(HEADER.size)
+                f.write(preview_payload)
+                preview_length, preview_crc = len(preview_payload), zlib.crc32(preview_payload)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+            # The document only changes once the header points at the new table
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, flags, section_count + 1, new_table_offset,
+                                preview_length, preview_capacity, preview_crc))
+            f.flush()
+            os.fsync(f.fileno())
+
+        return len(payload)
+
+    def copy(self, payload, f):
+        # Writes bytes, a spooled file or a list of those, returns their checksum
+        if isinstance(payload, list):
+            crc = 0
+
+            for part in payload:
+                crc = self.copy_part(part, f, crc)
+
+            return crc
+
+        return self.copy_part(payload, f, 0)
+
+    def copy_part(self, part, f, crc):
+        if isinstance(part, bytes):
+            f.write(part)
+            return zlib.crc32(part, crc)
+
+        part.seek(0)
+
+        while True:
+            chunk = part.read(1024 * 1024)
+
+            if not chunk:
+                return crc
+
+            f.write(chunk)
+            crc = zlib.crc32(chunk, crc)
+
+    def encode_preview(self, preview):
+        # Summary length and thumbnail length, then the JSON summary and the PNG thumbnail
+        if preview is None:
+            return b''
+
+        summary, thumbnail = preview
+        summary = json.dumps(summary, separators=(',', ':')).encode('utf-8')
+
+        return PREVIEW_HEADER.pack(len(summary), len(thumbnail)) + summary + thumbnail
+
+    def preview_capacity(self, preview_payload):
+        # Leaves room for the thumbnail to grow by half before an incremental save has to
+        # keep the old one, rounded up to whole 4 KB pages
+        if not preview_payload:
+            return 0
+
+        capacity = max(PREVIEW_CAPACITY, len(preview_payload) * 3 // 2)
+
+        return (capacity + 4095) // 4096 * 4096
+
+    def encode_assets(self, assets):
+        # Asset table: count, then one (sha256, offset, length) entry per asset, then the data
+        table = [struct.pack('<I', len(assets))]
+        payloads = []
+        offset = 4 + len(assets) * ASSET_ENTRY.size
+
+        for key, data in assets.items():
+            table.append(ASSET_ENTRY.pack(bytes.fromhex(key), offset, len(data)))
+            payloads.append(data)
+            offset += len(data)
+
+        return b''.join(table + payloads)
+
+    def encode_record(self, record):
+        return b''.join(self.record_parts(record))
+
+    def record_parts(self, record):
+        # Record header, JSON header, blob lengths and then the blobs themselves
+        blobs = []
+        packed = self.pack_fields(record, blobs)
+
+        # Scene bounds only live in the item index
+        packed.pop('bounds', None)
+
+        header = RECORD_ENCODER.encode(packed).encode('utf-8')
+        lengths = struct.pack(f'<{len(blobs)}I', *map(len, blobs))
+
+        return [RECORD_HEADER.pack(len(header), len(blobs)), header, lengths] + blobs
+
+    def pack_fields(self, record, blobs):
+        packed = dict(record)
+
+        for field in TEXT_BLOB_FIELDS:
+            if isinstance(packed.get(field), str):
+                blobs.append(packed[field].encode('utf-8'))
+                packed[field] = {'$text': len(blobs) - 1}
+
+        for field in BINARY_BLOB_FIELDS:
+            if isinstance(packed.get(field), (bytes, bytearray)):
+                blobs.append(bytes(packed[field]))
+                packed[field] = {'$blob': len(blobs) - 1}
+
+        for field in PACKED_PATH_FIELDS:
+            if isinstance(packed.get(field), dict):
+                path = packed[field]
+                blobs.append(bytes(path['types']))
+                blobs.append(bytes(path['coords']))
+                packed[field] = {'$packed': [len(blobs) - 2, len(blobs) - 1], 'fillrule': path.get('fillrule', 0)}
+
+        # Paths from documents saved before they were packed
+        for field in PATH_FIELDS:
+            if isinstance(packed.get(field), list):
+                elements = packed[field]
+                blobs.append(bytes(PATH_ELEMENT_TYPES.index(element['type']) for element in elements))
+                blobs.append(array('d', [value for element in elements
+                                         for value in (element['x'], element['y'])]).tobytes())
+                packed[field] = {'$path': [len(blobs) - 2, len(blobs) - 1]}
+
+        if 'children' in packed:
+            packed['children'] = [self.pack_fields(child, blobs) for child in packed['children']]
+
+        return packed
+
+    def record_z_value(self, record):
+        try:
+            return float(record['attr'][0]['zval'])
+
+        except (KeyError, IndexError, TypeError):
+            return 0.0
+
+    def record_bounds(self, record):
+        # Scene bounding rect as x, y, width, height, records without bounds (for example
+        # ones salvaged by MPDataRepairer) get an empty rect and are simply loaded last
+        bounds = record.get('bounds')
+
+        if not bounds or len(bounds) != 4:
+            return 0.0, 0.0, 0.0, 0.0
+
+        return tuple(map(float, bounds))
+
+
+class MPStreamWriter(MPFileWriter):
+    # Writes a document one record at a time, for when the records do not fit in memory at
+    # once (MPRepairEngine). Records and assets are spooled to temporary files, only the
+    # item index is kept in memory, and close() assembles the document like write() does
+    def __init__(self, filename, metadata):
+        super().__init__(filename)
+        self.metadata = dict(metadata)
+        self.metadata.pop('assets', None)
+
+        self.items = tempfile.TemporaryFile()
+        self.assets = tempfile.TemporaryFile()
+        self.index = io.BytesIO()
+        self.asset_table = []
+        self.asset_keys = set()
+        self.count = 0
+
+    def add(self, record):
+        offset = self.items.tell()
+        self.items.write(self.encode_record(record))
+
+        self.index.write(INDEX_ENTRY.pack(ITEM_TYPES.index(record['type']),
+                                          offset,
+                                          self.items.tell() - offset,
+                                          self.record_z_value(record),
+                                          *self.record_bounds(record)))
+        self.count += 1
+
+    def add_asset(self, key, data):
+        if key not in self.asset_keys:
+            self.asset_keys.add(key)
+            self.asset_table.append((key, self.assets.tell(), len(data)))
+            self.assets.write(data)
+
+    def close(self, preview=None):
+        self.metadata['format_version'] = FORMAT_VERSION
+
+        asset_table = [struct.pack('<I', len(self.asset_table))]
+        asset_offset = 4 + len(self.asset_table) * ASSET_ENTRY.size
+
+        for key, offset, length in self.asset_table:
+            asset_table.append(ASSET_ENTRY.pack(bytes.fromhex(key), asset_offset + offset, length))
+
+        sections = [
+            (SECTION_META, json.dumps(self.metadata, separators=(',', ':')).encode('utf-8')),
+            (SECTION_INDEX, INDEX_HEADER.pack(INDEX_ENTRY.size, self.count) + self.index.getvalue()),
+            (SECTION_ITEMS, self.items),
+            (SECTION_ASSETS, [b''.join(asset_table), self.assets]),
+        ]
+
+        preview_payload = self.encode_preview(preview)
+        preview_capacity = self.preview_capacity(preview_payload)
+        temp_filename = f'{self.filename}.tmp'
+
+        try:
+            with open(temp_filename, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0, 0, 0, 0, 0))
+                f.write(preview_payload.ljust(preview_capacity, b'\0'))
+
+                table = []
+                for tag, payload in sections:
+                    offset = f.tell()
+                    crc = self.copy(payload, f)
+                    table.append(SECTION_ENTRY.pack(tag, offset, f.tell() - offset, crc))
+
+                table_offset = f.tell()
+                f.write(b''.join(table))
+
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(table), table_offset,
+                                    len(preview_payload), preview_capacity, zlib.crc32(preview_payload)))
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(temp_filename, self.filename)
+
+        finally:
+            self.discard()
+
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+    def discard(self):
+        self.items.close()
+        self.assets.close()
+
+
+class MPFileReader:
+    # Random access to a document through its item index. With mapped=True the file is
+    # memory-mapped, so only the pages of the sections and records that are actually read
+    # get loaded, and everything returned is a copy that does not keep the mapping alive.
+    # verify=False skips the section checksums, which would otherwise read whole sections
+    def __init__(self, filename, mapped=False, verify=True):
+        self.filename = filename
+        self.mapped = mapped
+        self.verify = verify
+        self.mapping = None
+        self.data = None
+        self.sections = {}
+        self.version = None
+        self.flags = 0
+        self.item_section = None
+        self.journals = []
+        self.journal_payloads = {}
+        self.preview_length = 0
+        self.preview_crc = 0
+
+    def open(self):
+        with open(self.filename, 'rb') as f:
+            if self.mapped:
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.data = memoryview(self.mapping)
+
+            else:
+                self.data = memoryview(f.read())
+
+        if not self.isContainer():
+            raise MPFileError(f'{self.filename} is not an MPRUN container')
+
+        (magic, self.version, self.flags, section_count, table_offset,
+         self.preview_length, preview_capacity, self.preview_crc) = HEADER.unpack_from(self.data, 0)
+
+        if self.version > FORMAT_VERSION:
+            raise MPFileError(f'{self.filename} was saved by a newer version of MPRUN '
+                              f'(format {self.version})')
+
+        self.sections = {}
+        self.journals = []
+        for i in range(section_count):
+            tag, offset, length, crc = SECTION_ENTRY.unpack_from(self.data, table_offset + i * SECTION_ENTRY.size)
+
+            if tag == SECTION_JOURNAL:
+                self.journals.append((offset, length, crc))
+            else:
+                self.sections[tag] = (offset, length, crc)
+
+        return self
+
+    def close(self):
+        # Windows refuses to replace a file that is still mapped, so close the reader
+        # before saving over the document it was opened from
+        if self.item_section is not None:
+            self.item_section.release()
+
+        for payload in self.journal_payloads.values():
+            payload.release()
+
+        self.item_section = None
+        self.journal_payloads = {}
+
+        if self.data is not None:
+            self.data.release()
+            self.data = None
+
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    def __enter__(self):
+        return self.open() if self.data is None else self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def isContainer(self):
+        return bytes(self.data[:len(MAGIC)]) == MAGIC
+
+    def section(self, tag, verify=None):
+        if tag not in self.sections:
+            raise MPFileError(f'Section {tag.decode()} is missing from {self.filename}')
+
+        return self.payload(tag, *self.sections[tag], verify=self.verify if verify is None else verify)
+
+    def journal(self, number):
+        if number not in self.journal_payloads:
+            self.journal_payloads[number] = self.payload(SECTION_JOURNAL, *self.journals[number], verify=self.verify)
+
+        return self.journal_payloads[number]
+
+    def payload(self, tag, offset, length, crc, verify=True):
+        payload = self.data[offset:offset + length]
+
+        if verify and zlib.crc32(payload) != crc:
+            raise MPFileError(f'Section {tag.decode()} of {self.filename} is corrupted')
+
+        if self.flags & FLAG_COMPRESSED:
+            return memoryview(zlib.decompress(payload))
+
+        return payload
+
+    def metadata(self):
+        return json.loads(bytes(self.section(SECTION_META)))
+
+    def preview(self):
+        return self.decode_preview(self.data[HEADER.size:HEADER.size + self.preview_length], self.preview_crc)
+
+    @staticmethod
+    def decode_preview(payload, crc):
+        # The summary dict with the PNG thumbnail under 'thumbnail', or None when the document
+        # has no (intact) preview
+        if not payload or zlib.crc32(payload) != crc:
+            return None
+
+        summary_length, thumbnail_length = PREVIEW_HEADER.unpack_from(payload, 0)
+        summary = json.loads(bytes(payload[PREVIEW_HEADER.size:PREVIEW_HEADER.size + summary_length]))
+        summary['thumbnail'] = bytes(payload[PREVIEW_HEADER.size + summary_length:
+                                             PREVIEW_HEADER.size + summary_length + thumbnail_length])
+
+        return summary
+
+    def index(self):
+        entries = self.base_index()
+
+        # Replay the journals in the order they were saved
+        for number in range(len(self.journals)):
+            self.replay_journal(number, entries)
+
+        return list(entries.values())
+
+    def base_index(self):
+        # The item index of the last full save, keyed by uid
+        payload = self.section(SECTION_INDEX)
+        entry_size, count = INDEX_HEADER.unpack_from(payload, 0)
+
+        # Format 2 entries have no scene bounds
+        has_bounds = entry_size >= INDEX_ENTRY.size
+        entry_format = INDEX_ENTRY if has_bounds else INDEX_ENTRY_V2
+
+        entries = {}
+        for i in range(count):
+            values = entry_format.unpack_from(payload, INDEX_HEADER.size + i * entry_size)
+            entries[i] = {
+                'uid': i,
+                'type': ITEM_TYPES[values[0]],
+                'offset': values[1],
+                'length': values[2],
+                'zval': values[3],
+                'bounds': values[4:8] if has_bounds else None,
+                'journal': None,
+            }
+
+        return entries
+
+    def replay_journal(self, number, entries):
+        payload = self.journal(number)
+        entry_count, assets_offset = JOURNAL_HEADER.unpack_from(payload, 0)
+
+        for i in range(entry_count):
+            values = JOURNAL_ENTRY.unpack_from(payload, JOURNAL_HEADER.size + i * JOURNAL_ENTRY.size)
+            operation, uid = values[:2]
+
+            if operation == JOURNAL_DELETE:
+                entries.pop(uid, None)
+
+            else:
+                entries[uid] = {
+                    'uid': uid,
+                    'type': ITEM_TYPES[values[2]],
+                    'offset': values[3],
+                    'length': values[4],
+                    'zval': values[5],
+                    'bounds': values[6:10],
+                    'journal': number,
+                }
+
+    def hasBounds(self):
+        entry_size, count = INDEX_HEADER.unpack_from(self.section(SECTION_INDEX), 0)
+        return entry_size >= INDEX_ENTRY.size
+
+    def assets(self):
+        if SECTION_ASSETS not in self.sections:
+            return {}
+
+        assets = self.decode_assets(self.section(SECTION_ASSETS))
+
+        for number in range(len(self.journals)):
+            payload = self.journal(number)
+            entry_count, assets_offset = JOURNAL_HEADER.unpack_from(payload, 0)
+            assets.update(self.decode_assets(payload[assets_offset:]))
+
+        return assets
+
+    def decode_assets(self, payload):
+        count = struct.unpack_from('<I', payload, 0)[0]
+
+        assets = {}
+        for i in range(count):
+            digest, offset, length = ASSET_ENTRY.unpack_from(payload, 4 + i * ASSET_ENTRY.size)
+
+            if self.mapped:
+                assets[digest.hex()] = bytes(payload[offset:offset + length])
+
+            else:
+                assets[digest.hex()] = payload[offset:offset + length]
+
+        return assets
+
+    def asset(self, key):
+        return self.assets().get(key)
+
+    def item_count(self):
+        return len(self.index())
+
+    def items(self, types=None):
+        # Decodes only the records of the given item types, in index order
+        yield from self.read_records([entry for entry in self.index() if types is None or entry['type'] in types])
+
+    def canvases(self):
+        return list(self.items(['CanvasItem']))
+
+    def canvas_names(self):
+        return [canvas['name'] for canvas in self.canvases()]
+
+    def paths(self):
+        return list(self.items(['CustomPathItem']))
+
+    def canvas_items(self, name):
+        # Everything that overlaps the named canvas, found through the bounds in the index
+        # so no other record is decoded
+        if not self.hasBounds():
+            raise MPFileError(f'{self.filename} has no item bounds, open and save it again first')
+
+        entries = self.index()
+        canvas = None
+
+        for entry in entries:
+            if entry['type'] == 'CanvasItem':
+                record = self.read_record(entry)
+
+                if record['name'] == name:
+                    canvas = record
+                    break
+
+        if canvas is None:
+            raise MPFileError(f'{self.filename} has no canvas named {name}')
+
+        left, top = canvas['x'] + canvas['rect'][0], canvas['y'] + canvas['rect'][1]
+        right, bottom = left + canvas['rect'][2], top + canvas['rect'][3]
+
+        overlapping = []
+        for entry in entries:
+            if entry['type'] == 'CanvasItem':
+                continue
+
+            x, y, width, height = entry['bounds']
+
+            if x < right and x + width > left and y < bottom and y + height > top:
+                overlapping.append(entry)
+
+        return self.read_records(overlapping)
+
+    def base_size(self):
+        # Size of the items and assets written by the last full save
+        return sum(self.sections[tag][1] for tag in (SECTION_ITEMS, SECTION_ASSETS) if tag in self.sections)
+
+    def journal_size(self):
+        return sum(length for offset, length, crc in self.journals)
+
+    def read_items(self):
+        metadata = self.metadata()
+        metadata['assets'] = self.assets()
+
+        return [metadata] + self.read_records(self.index())
+
+    def read_record(self, entry):
+        # Decodes a single record located by an index entry
+        return self.decode_record(self.record_payload(entry))
+
+    def read_records(self, entries):
+        return self.decode_records([self.record_payload(entry) for entry in entries])
+
+    def record_payload(self, entry):
+        # The bytes of the record an index entry points at, the item section is only
+        # checksummed the first time
+        if entry.get('journal') is not None:
+            payload = self.journal(entry['journal'])
+
+        else:
+            if self.item_section is None:
+                self.item_section = self.section(SECTION_ITEMS)
+
+            payload = self.item_section
+
+        return payload[entry['offset']:entry['offset'] + entry['length']]
+
+    def scan(self, start, end, strict=True):
+        # Walks the records between start and end without the item index, for documents
+        # whose index is damaged. Yields (offset, record, error), a record that does not
+        # decode is skipped by searching for the start of the next one. strict=False is for
+        # ranges that hold more than records, only what looks like a record is reported
+        position = start
+
+        while position + RECORD_HEADER.size <= end:
+            try:
+                length = self.record_length(position, end)
+                yield position, self.decode_record(self.data[position:position + length]), None
+                position += length
+
+            except (MPFileError, ValueError, TypeError, KeyError, IndexError, struct.error) as e:
+                header = position + RECORD_HEADER.size
+
+                if strict or bytes(self.data[header:header + len(RECORD_START)]) == RECORD_START:
+                    yield position, None, e
+
+                found = bytes(self.data[position + 1:end]).find(RECORD_START)
+
+                if found == -1:
+                    break
+
+                position += 1 + found - RECORD_HEADER.size
+
+    def record_length(self, position, end):
+        # Total length of the record at position, checking every length against end
+        header_length, blob_count = RECORD_HEADER.unpack_from(self.data, position)
+        length = RECORD_HEADER.size + header_length + blob_count * BLOB_LENGTH.size
+
+        if position + length > end:
+            raise MPFileError(f'Record at {position} runs past the end of its section')
+
+        blobs_start = position + RECORD_HEADER.size + header_length
+        for i in range(blob_count):
+            length += BLOB_LENGTH.unpack_from(self.data, blobs_start + i * BLOB_LENGTH.size)[0]
+
+        if position + length > end:
+            raise MPFileError(f'Record at {position} runs past the end of its section')
+
+        return length
+
+    def decode_record(self, payload):
+        header, blobs = self.split_record(payload)
+        return self.unpack_fields(json.loads(bytes(header)), blobs)
+
+    def decode_records(self, payloads):
+        # Decodes many records at once, their JSON headers are joined into one array and
+        # parsed in a single call instead of one json.loads per record
+        headers, blob_lists = [], []
+
+        for payload in payloads:
+            header, blobs = self.split_record(payload)
+            headers.append(header)
+            blob_lists.append(blobs)
+
+        records = json.loads(b'[' + b','.join(headers) + b']')
+
+        return [self.unpack_fields(record, blobs) for record, blobs in zip(records, blob_lists)]
+
+    def split_record(self, payload):
+        # The JSON header and the blobs of a record, as slices of payload
+        header_length, blob_count = RECORD_HEADER.unpack_from(payload, 0)
+        position = RECORD_HEADER.size + header_length
+        header = payload[RECORD_HEADER.size:position]
+
+        lengths = struct.unpack_from(f'<{blob_count}I', payload, position)
+        position += blob_count * BLOB_LENGTH.size
+
+        blobs = []
+        for length in lengths:
+            blobs.append(payload[position:position + length])
+            position += length
+
+        return header, blobs
+
+    def unpack_fields(self, record, blobs):
+        for field in TEXT_BLOB_FIELDS:
+            if isinstance(record.get(field), dict):
+                record[field] = str(blobs[record[field]['$text']], 'utf-8')
+
+        for field in BINARY_BLOB_FIELDS:
+            if isinstance(record.get(field), dict):
+                record[field] = bytes(blobs[record[field]['$blob']])
+
+        for field in PACKED_PATH_FIELDS:
+            if isinstance(record.get(field), dict):
+                types_index, coords_index = record[field]['$packed']
+                record[field] = {'types': bytes(blobs[types_index]),
+                                 'coords': bytes(blobs[coords_index]),
+                                 'fillrule': record[field].get('fillrule', 0)}
+
+        for field in PATH_FIELDS:
+            if isinstance(record.get(field), dict):
+                types_index, coords_index = record[field]['$path']
+                coords = array('d')
+                coords.frombytes(blobs[coords_index])
+                record[field] = [{'type': PATH_ELEMENT_TYPES[element_type],
+                                  'x': coords[i * 2],
+                                  'y': coords[i * 2 + 1]} for i, element_type in enumerate(blobs[types_index])]
+
+        if 'children' in record:
+            record['children'] = [self.unpack_fields(child, blobs) for child in record['children']]
+
+        return record
+
+    @staticmethod
+    def isContainerFile(filename):
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+    @staticmethod
+    def readPreview(filename):
+        # Reads just the header and the preview behind it, so browsing documents never
+        # touches their items. Documents without a preview (legacy pickles, recovery
+        # snapshots, files saved before previews existed) return None
+        with open(filename, 'rb') as f:
+            header = f.read(HEADER.size)
+
+            if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+                return None
+
+            (magic, version, flags, section_count, table_offset,
+             preview_length, preview_capacity, preview_crc) = HEADER.unpack(header)
+
+            if version > FORMAT_VERSION or preview_length == 0:
+                return None
+
+            return MPFileReader.decode_preview(f.read(preview_length), preview_crc)
+
+    @staticmethod
+    def load(filename, mapped=False):
+        # Returns the same list of dicts MPSerializer.serialize_items builds, documents saved
+        # before the container format existed are migrated from pickle on the fly
+        if MPFileReader.isContainerFile(filename):
+            with MPFileReader(filename, mapped) as reader:
+                return reader.read_items()
+
+        with open(filename, 'rb') as f:
+            return LegacyUnpickler(f).load()
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    # Old documents are plain pickles of builtin types and Qt enum values, refuse anything
+    # else so opening a document can never run arbitrary code
+    def find_class(self, module, name):
+        if (module, name) == ('copyreg', '_reconstructor'):
+            return super().find_class(module, name)
+
+        if module == 'builtins' and name in ('int', 'float', 'object'):
+            return super().find_class(module, name)
+
+        if module.startswith('PyQt5.'):
+            cls = super().find_class(module, name)
+
+            if isinstance(cls, type) and issubclass(cls, int):
+                return cls
+
+        raise pickle.UnpicklingError(f'{module}.{name} is not allowed in MPRUN documents')
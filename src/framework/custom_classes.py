@@ -2,6 +2,7 @@ import os.path
 
 from src.scripts.imports import *
 from src.framework.undo_commands import *
+from src.framework.path_measure import MPPathMeasure
 
 
 class CustomGraphicsItemGroup(QGraphicsItemGroup):
@@ -82,6 +83,12 @@ class CustomPathItem(QGraphicsPathItem):
         self.text_along_path_spacing = 3
         self.start_text_from_beginning = False
 
+        # Arc length table of the path and glyph layout of the text along it, see
+        # pathMeasure() and textAlongPathGlyphs()
+        self.path_measure = None
+        self.text_layout = None
+        self.text_layout_key = None
+
         self.gridEnabled = False
 
     def mousePressEvent(self, event):
@@ -179,8 +186,21 @@ class CustomPathItem(QGraphicsPathItem):
 
         return smooth_path
 
+    def setPath(self, path):
+        super().setPath(path)
+        self.path_measure = None
+        self.text_layout = None
+
+    def pathMeasure(self):
+        # Lengths, points and angles along the path, built on first use after a setPath
+        if self.path_measure is None:
+            self.path_measure = MPPathMeasure(self.path())
+
+        return self.path_measure
+
     def setTextAlongPathFromBeginning(self, a0):
         self.start_text_from_beginning = a0
+        self.update()
 
     def setTextAlongPath(self, text):
         self.text_along_path = text
@@ -198,62 +218,85 @@ class CustomPathItem(QGraphicsPathItem):
         self.text_along_path_spacing = spacing
         self.update()
 
+    def textAlongPathGlyphs(self):
+        # The text along the path laid out once: the characters that fit, their points and
+        # angles as arrays, and all their outlines in one path to fill. It is kept until the
+        # path (setPath), text, font, spacing or alignment change
+        key = (self.text_along_path, self.text_along_path_font.key(), self.text_along_path_spacing,
+               self.start_text_from_beginning)
+
+        if self.text_layout is None or self.text_layout_key != key:
+            self.text_layout = self.buildTextAlongPathGlyphs()
+            self.text_layout_key = key
+
+        return self.text_layout
+
+    def buildTextAlongPathGlyphs(self):
+        text = self.text_along_path
+        font_metrics = QFontMetricsF(self.text_along_path_font)
+        measure = self.pathMeasure()
+        total_length = measure.length()
+
+        if not text or total_length <= 0:
+            return '', np.zeros((0, 2)), np.zeros(0), QPainterPath()
+
+        if self.start_text_from_beginning:
+            # Characters follow each other from the start, stopping at the first that would
+            # run past the end of the path
+            widths = np.array([font_metrics.width(char) for char in text])
+            ends = np.cumsum(widths)
+            text = text[:np.searchsorted(ends, total_length, side='right')]
+            lengths = ends[:len(text)] - widths[:len(text)]
+
+        else:
+            # Spread evenly over the path
+            lengths = np.arange(1, len(text) + 1) / (len(text) + 1) * total_length
+
+        points = measure.point_at_length(lengths)
+        angles = measure.angle_at_length(lengths)
+
+        outlines = QPainterPath()
+        glyphs = {}
+
+        for char, (x, y), angle in zip(text, points, angles):
+            if char not in glyphs:
+                glyphs[char] = QPainterPath()
+                glyphs[char].addText(QPointF(0, -self.text_along_path_spacing), self.text_along_path_font, char)
+
+            transform = QTransform()
+            transform.translate(x, y)
+            transform.rotate(-angle)
+            outlines.addPath(transform.map(glyphs[char]))
+
+        return text, points, angles, outlines
+
+    def textAlongPathLayout(self):
+        # (character, point, angle) for each character of the text along the path
+        text, points, angles, outlines = self.textAlongPathGlyphs()
+
+        return [(char, QPointF(x, y), float(angle)) for char, (x, y), angle in zip(text, points, angles)]
+
     def paint(self, painter, option, widget=None):
         super().paint(painter, option, widget)
 
         if self.add_text:
-            path = self.path()
-            text = self.text_along_path
-            pen = painter.pen()
-            pen.setWidth(self.text_along_path_spacing)
-            pen.setColor(self.text_along_path_color)
-            painter.setPen(pen)
-            font = self.text_along_path_font
-            painter.setFont(font)
-
-            font_metrics = QFontMetricsF(font)
-            total_length = path.length()
-            current_length = 0
-
-            if self.start_text_from_beginning:
-                for char in text:
-                    char_width = font_metrics.width(char)
-                    if current_length + char_width > total_length:
-                        break  # Stop adding more text if the current length exceeds the path length
-
-                    percent = current_length / total_length
-                    point = path.pointAtPercent(percent)
-                    angle = path.angleAtPercent(percent)
-
-                    painter.save()
-                    painter.translate(point)
-                    painter.rotate(-angle)
-                    painter.drawText(QPointF(0, -pen.width()), char)
-                    painter.restore()
-
-                    current_length += char_width
-            else:
-                percent_increase = 1 / (len(text) + 1)
-                percent = 0
-
-                for char in text:
-                    percent += percent_increase
-                    point = path.pointAtPercent(percent)
-                    angle = path.angleAtPercent(percent)
-
-                    painter.save()
-                    painter.translate(point)
-                    painter.rotate(-angle)
-                    painter.drawText(QPointF(0, -pen.width()), char)
-                    painter.restore()
+            text, points, angles, outlines = self.textAlongPathGlyphs()
+            painter.fillPath(outlines, self.text_along_path_color)
 
 
 class CustomPixmapItem(QGraphicsPixmapItem):
-    def __init__(self, file):
-        super().__init__(file)
+    def __init__(self, file=None):
+        super().__init__()
 
         self.filename = None
 
+        # The image exactly as it was imported (a JPEG stays a JPEG), written to
+        # documents as is so saving never has to encode the pixmap again
+        self.encoded_data = None
+
+        if file is not None:
+            self.setPixmap(QPixmap(file))
+
         self.gridEnabled = False
 
     def mousePressEvent(self, event):
@@ -274,11 +317,35 @@ class CustomPixmapItem(QGraphicsPixmapItem):
         else:
             super().mouseMoveEvent(event)
 
-    def loadFromData(self, data):
-        pixmap = QPixmap()
-        pixmap.loadFromData(data)
+    def paint(self, painter, option, widget=None):
+        # Export records canvases into QPictures that are played back on worker threads,
+        # where a QPixmap must never be created, so recordings get the image as a QImage
+        if isinstance(painter.device(), QPicture):
+            painter.save()
+            painter.setRenderHint(QPainter.SmoothPixmapTransform,
+                                  self.transformationMode() == Qt.SmoothTransformation)
+            painter.drawImage(self.offset(), self.pixmap().toImage())
+            painter.restore()
+
+        else:
+            super().paint(painter, option, widget)
+
+    def loadFromData(self, data, pixmap=None):
+        # Pass the pixmap when the data has already been decoded
+        if pixmap is None:
+            pixmap = QPixmap()
+            pixmap.loadFromData(data)
+
+        self.encoded_data = bytes(data)
         self.setPixmap(pixmap)
 
+    def loadFromFile(self, file):
+        with open(file, 'rb') as f:
+            self.loadFromData(f.read())
+
+    def encodedData(self):
+        return self.encoded_data
+
     def store_filename(self, file):
         self.filename = file
 
@@ -287,6 +354,7 @@ class CustomPixmapItem(QGraphicsPixmapItem):
 
     def duplicate(self):
         item = CustomPixmapItem(self.pixmap())
+        item.encoded_data = self.encoded_data
         item.setPos(self.pos() + QPointF(10, 10))
         item.setTransformOriginPoint(self.transformOriginPoint())
         item.setScale(self.scale())
@@ -307,6 +375,7 @@ class CustomPixmapItem(QGraphicsPixmapItem):
 
     def copy(self):
         item = CustomPixmapItem(self.pixmap())
+        item.encoded_data = self.encoded_data
         item.setPos(self.pos())
         item.setTransformOriginPoint(self.transformOriginPoint())
         item.setScale(self.scale())
@@ -362,10 +431,13 @@ class CustomSvgItem(QGraphicsSvgItem):
         else:
             super().mouseMoveEvent(event)
 
-    def loadFromData(self, svg_data) -> None:
+    def loadFromData(self, svg_data, renderer=None) -> None:
         try:
             self.svg_data = svg_data
-            renderer = QSvgRenderer(QByteArray(svg_data.encode('utf-8')))
+            if renderer is None:
+                renderer = QSvgRenderer(QByteArray(svg_data.encode('utf-8')))
+
+            self.render = renderer
             self.setSharedRenderer(renderer)
             self.setElementId("")  # Optional: set specific SVG element ID if needed
         except Exception as e:
@@ -600,8 +672,10 @@ class CustomTextItem(QGraphicsTextItem):
         self.setFocus(Qt.MouseFocusReason)
         self.editing = True
 
-    def toMarkdown(self):
-        html_text = markdown.markdown(self.toPlainText())
+    def toMarkdown(self, html_text=None):
+        # Documents being opened pass in HTML that was already rendered off the GUI thread
+        if html_text is None:
+            html_text = markdown.markdown(self.toPlainText())
 
         self.setHtml(html_text)
         self.markdownEnabled = True
@@ -613,17 +687,27 @@ class CustomTextItem(QGraphicsTextItem):
 
         elif change == QGraphicsItem.ItemSelectedChange and isinstance(self.parentItem(), LeaderLineItem):
             self.parentItem().updatePathEndPoint()
+
+        elif change in (QGraphicsItem.ItemPositionHasChanged, QGraphicsItem.ItemTransformHasChanged,
+                        QGraphicsItem.ItemRotationHasChanged, QGraphicsItem.ItemScaleHasChanged) \
+                and isinstance(self.parentItem(), LeaderLineItem):
+            self.parentItem().textGeometryChanged()
+
         return super().itemChange(change, value)
 
 
 class LeaderLineItem(QGraphicsPathItem):
     def __init__(self, path, text: str):
+        # Arrowhead, frame, bounding rect and shape, see leaderGeometry()
+        self.leader_geometry = None
+
         super().__init__(path)
 
         self.gridEnabled = False
         self.text_element = CustomTextItem(text)
         self.text_element.setParentItem(self)
         self.text_element.setToolTip("Text")
+        self.text_element.document().documentLayout().documentSizeChanged.connect(self.textGeometryChanged)
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
@@ -643,52 +727,98 @@ class LeaderLineItem(QGraphicsPathItem):
         else:
             super().mouseMoveEvent(event)
 
+    def setPath(self, path):
+        super().setPath(path)
+        self.leader_geometry = None
+
+    def setPen(self, pen):
+        super().setPen(pen)
+        self.leader_geometry = None
+
+    def textGeometryChanged(self, *args):
+        # The label was moved, transformed or its text relaid out, the frame around it moves too
+        self.prepareGeometryChange()
+        self.leader_geometry = None
+
+    def leaderGeometry(self):
+        # (arrowhead, frame rect, arrowhead brush, bounding rect, shape), worked out once and
+        # kept until the path, pen or label geometry change
+        if self.leader_geometry is None:
+            arrow_head = self.arrowHead()
+            frame_rect = self.mapRectFromItem(self.text_element, self.text_element.boundingRect())
+            arrow_brush = QBrush(QColor(self.pen().color().name()))
+
+            # The line stroked with the pen, as QGraphicsPathItem.shape() makes it (its
+            # boundingRect() calls back into shape(), so neither can be used here)
+            pen = self.pen()
+            stroker = QPainterPathStroker()
+            stroker.setWidth(max(pen.widthF(), 0.00000001))
+            stroker.setCapStyle(pen.capStyle())
+            stroker.setJoinStyle(pen.joinStyle())
+            stroker.setMiterLimit(pen.miterLimit())
+
+            shape = stroker.createStroke(self.path())
+            shape.addPath(self.path())
+
+            # The frame and arrowhead are outlined with the pen, half of it falls outside them
+            margin = pen.widthF() / 2
+            bounding_rect = shape.controlPointRect().united(frame_rect.adjusted(-margin, -margin, margin, margin))
+
+            if arrow_head is not None:
+                bounding_rect = bounding_rect.united(arrow_head.boundingRect().adjusted(-margin, -margin, margin, margin))
+                shape.addPolygon(arrow_head)
+
+            self.leader_geometry = arrow_head, frame_rect, arrow_brush, bounding_rect, shape
+
+        return self.leader_geometry
+
+    def boundingRect(self):
+        return self.leaderGeometry()[3]
+
+    def shape(self):
+        return self.leaderGeometry()[4]
+
     def paint(self, painter, option, widget=None):
         super().paint(painter, option, widget)
 
+        arrow_head, frame_rect, arrow_brush, bounding_rect, shape = self.leaderGeometry()
+
         painter.setPen(self.pen())
         painter.setBrush(self.brush())
+        painter.drawRect(frame_rect)
 
-        mapped_rect = self.mapRectFromItem(self.text_element, self.text_element.boundingRect())
-        painter.drawRect(mapped_rect)
+        if arrow_head is not None:
+            painter.setBrush(arrow_brush)
+            painter.drawPolygon(arrow_head)
 
-        try:
-            painter.setPen(self.pen())
-            painter.setBrush(QBrush(QColor(self.pen().color().name())))
-
-            path = self.path()
-            if path.elementCount() > 1:
-                # Get the last two points of the path
-                last_element = path.elementAt(path.elementCount() - 1)
-                second_last_element = path.elementAt(path.elementCount() - 2)
-                last_point = QPointF(last_element.x, last_element.y)
-                second_last_point = QPointF(second_last_element.x, second_last_element.y)
-
-                # Calculate the angle of the line segment at the end of the path
-                dx = last_point.x() - second_last_point.x()
-                dy = last_point.y() - second_last_point.y()
-                angle = math.atan2(dy, dx)
-
-                # Calculate the new endpoint slightly beyond the last point
-                arrow_offset = 10  # Distance to extend the arrowhead beyond the last point
-                end_point = QPointF(last_point.x() + arrow_offset * math.cos(angle),
-                                    last_point.y() + arrow_offset * math.sin(angle))
-
-                # Define the arrowhead points
-                arrow_size = 12
-                p1 = QPointF(end_point.x() - arrow_size * math.cos(angle - math.pi / 6),
-                             end_point.y() - arrow_size * math.sin(angle - math.pi / 6))
-                p2 = QPointF(end_point.x() - arrow_size * math.cos(angle + math.pi / 6),
-                             end_point.y() - arrow_size * math.sin(angle + math.pi / 6))
-
-                # Create a polygon for the arrowhead
-                arrow_head = QPolygonF([end_point, p1, p2])
-
-                # Draw the arrowhead
-                painter.drawPolygon(arrow_head)
-
-        except Exception as e:
-            print(e)
+    def arrowHead(self):
+        path = self.path()
+        if path.elementCount() > 1:
+            # Get the last two points of the path
+            last_element = path.elementAt(path.elementCount() - 1)
+            second_last_element = path.elementAt(path.elementCount() - 2)
+            last_point = QPointF(last_element.x, last_element.y)
+            second_last_point = QPointF(second_last_element.x, second_last_element.y)
+
+            # Calculate the angle of the line segment at the end of the path
+            dx = last_point.x() - second_last_point.x()
+            dy = last_point.y() - second_last_point.y()
+            angle = math.atan2(dy, dx)
+
+            # Calculate the new endpoint slightly beyond the last point
+            arrow_offset = 10  # Distance to extend the arrowhead beyond the last point
+            end_point = QPointF(last_point.x() + arrow_offset * math.cos(angle),
+                                last_point.y() + arrow_offset * math.sin(angle))
+
+            # Define the arrowhead points
+            arrow_size = 12
+            p1 = QPointF(end_point.x() - arrow_size * math.cos(angle - math.pi / 6),
+                         end_point.y() - arrow_size * math.sin(angle - math.pi / 6))
+            p2 = QPointF(end_point.x() - arrow_size * math.cos(angle + math.pi / 6),
+                         end_point.y() - arrow_size * math.sin(angle + math.pi / 6))
+
+            # Create a polygon for the arrowhead
+            return QPolygonF([end_point, p1, p2])
 
     def updatePathEndPoint(self):
         path = self.path()
@@ -713,6 +843,11 @@ class LeaderLineItem(QGraphicsPathItem):
             closest_corner = min(corners, key=lambda corner: (corners[corner] - end_point).manhattanLength())
             new_start_point = corners[closest_corner]
 
+            # Called on every key press and item change, the cached geometry stays when the
+            # line already starts there
+            if (path.elementAt(0).x, path.elementAt(0).y) == (new_start_point.x(), new_start_point.y()):
+                return
+
             path.setElementPositionAt(0, new_start_point.x(), new_start_point.y())
             self.setPath(path)
 
@@ -922,3 +1057,57 @@ class WaterMarkItem(QGraphicsPixmapItem):
 
         else:
             super().mouseMoveEvent(event)
+
+
+class PlaceholderLayer(QGraphicsItem):
+    def __init__(self, rects: dict, zval):
+        super().__init__()
+
+        # Stands in for every item that is still being loaded, never part of the document.
+        # One item for all of them, documents can have thousands of pending items and
+        # adding an item to the scene for each would cost more than loading the viewport
+        self.rects = dict(rects)
+        self.bounds = QRectF()
+
+        for rect in self.rects.values():
+            self.bounds = self.bounds.united(rect)
+
+        self.pen = QPen(QColor('#b0b0b0'), 0, Qt.DashLine)
+        self.pen.setCosmetic(True)
+
+        self.setZValue(zval)
+        self.setAcceptedMouseButtons(Qt.NoButton)
+
+        # Only the outlines in the exposed rect are drawn
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+        self.gridEnabled = False
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect
+        painter.setPen(self.pen)
+        painter.setBrush(Qt.NoBrush)
+        painter.drawRects([rect for rect in self.rects.values() if rect.intersects(exposed)])
+
+    def itemChange(self, change, value):
+        # Tools that turn flags on for every item must not make it selectable or movable
+        if change == QGraphicsItem.ItemSelectedChange:
+            return False
+
+        elif change == QGraphicsItem.ItemPositionChange:
+            return self.pos()
+
+        return super().itemChange(change, value)
+
+    def remove(self, key):
+        # The item was loaded, its outline goes away
+        rect = self.rects.pop(key, None)
+
+        if rect is not None:
+            self.update(rect.adjusted(-1, -1, 1, 1))
+
+    def isEmpty(self):
+        return not self.rects
@@ -0,0 +1,691 @@
+import re
+import shutil
+import struct
+import zlib
+
+from src.scripts.imports import *
+from src.framework.custom_classes import *
+from src.framework.serializer import MPSerializer
+from src.framework.svg_writer import MPSVGWriter
+
+if getattr(sys, 'frozen', False):
+    os.chdir(sys._MEIPASS)
+
+
+def disable_item_caches(scene):
+    # Cached items would be exported as their cache pixmaps, which is slow to record and
+    # blurry once scaled, so they draw directly while exporting. Returns what to restore
+    cache_modes = [(item, item.cacheMode()) for item in scene.items() if item.cacheMode() != QGraphicsItem.NoCache]
+
+    for item, mode in cache_modes:
+        item.setCacheMode(QGraphicsItem.NoCache)
+
+    return cache_modes
+
+
+def restore_item_caches(cache_modes):
+    for item, mode in cache_modes:
+        item.setCacheMode(mode)
+
+
+def image_array(image: QImage):
+    # The pixels of an RGBA8888 image as a (height, width, 4) array, without copying
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+
+    return np.frombuffer(bits, np.uint8).reshape(image.height(), image.bytesPerLine())[:, :image.width() * 4] \
+        .reshape(image.height(), image.width(), 4)
+
+
+def canvas_order(canvases, order='position'):
+    # Canvases top to bottom then left to right, or by name with numbers compared as numbers
+    # so 'Run 2' comes before 'Run 10'
+    if order == 'name':
+        return sorted(canvases, key=lambda canvas: [int(part) if part.isdigit() else part.lower()
+                                                    for part in re.split(r'(\d+)', canvas.toolTip())])
+
+    return sorted(canvases, key=lambda canvas: (canvas.sceneBoundingRect().top(), canvas.sceneBoundingRect().left()))
+
+
+def export_all_canvases(scene):
+    # Canvases in the order the export all dialog numbers them, the scene's stacking order
+    # (topmost first, canvases share a z value so the last added comes first)
+    return [item for item in scene.items() if isinstance(item, CanvasItem)]
+
+
+def export_all_counts(names):
+    # The count of each name among the names before it, export all writes <name>_<count>
+    # so canvases sharing a name get distinct files
+    tooltip_count = {}
+    counts = []
+
+    for tooltip in names:
+        tooltip_count[tooltip] = tooltip_count.get(tooltip, 0) + 1
+        counts.append(tooltip_count[tooltip])
+
+    return counts
+
+
+class MPExportCache:
+    # Remembers exported canvases by a fingerprint of everything that affects their output:
+    # the canvas, the serialized items over it and the export settings. Outputs are kept by
+    # fingerprint, so an unchanged canvas is copied instead of rendered again, and a manifest
+    # of the files written lets an export skip outputs that are already up to date
+    directory = 'internal data/export cache'
+    keep = 200
+
+    def __init__(self, directory=None):
+        self.directory = directory or self.directory
+        self.manifest_file = os.path.join(self.directory, 'manifest.json')
+        self.manifest = {}
+
+        try:
+            with open(self.manifest_file, 'r') as f:
+                self.manifest = json.load(f)
+
+        except (OSError, ValueError):
+            pass
+
+    def fingerprints(self, canvases, settings=None):
+        # One serializer for all canvases, so shared SVG and image assets are hashed once
+        serializer = MPSerializer(canvases[0].scene()) if canvases else None
+
+        return {canvas: self.fingerprint(canvas, settings, serializer) for canvas in canvases}
+
+    def fingerprint(self, canvas, settings=None, serializer=None):
+        scene = canvas.scene()
+        serializer = serializer or MPSerializer(scene)
+        rect = canvas.sceneBoundingRect()
+
+        items = []
+        for item in scene.items(rect, Qt.IntersectsItemBoundingRect, Qt.AscendingOrder):
+            if item.topLevelItem() is not item:
+                # Groups serialize their children
+                continue
+
+            data = serializer.serialize_item(item)
+
+            if data is None:
+                # Items that aren't saved (watermarks and such) still show up in the export
+                bounds = item.sceneBoundingRect()
+                data = {'type': type(item).__name__, 'bounds': [bounds.x(), bounds.y(), bounds.width(), bounds.height()],
+                        'zval': item.zValue(), 'visible': item.isVisible()}
+
+            items.append(data)
+
+        state = {
+            'rect': [rect.x(), rect.y(), rect.width(), rect.height()],
+            'canvas': [serializer.serialize_brush(canvas.brush()), serializer.serialize_pen(canvas.pen())],
+            'background': serializer.serialize_brush(scene.backgroundBrush()),
+            'items': items,
+            'settings': settings or {},
+        }
+
+        return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def path(self, fingerprint, extension):
+        return os.path.join(self.directory, f'{fingerprint}{extension}')
+
+    def lookup(self, fingerprint, extension):
+        path = self.path(fingerprint, extension)
+
+        return path if os.path.exists(path) else None
+
+    def isUpToDate(self, filename, fingerprint):
+        # The file was written by the cache for this fingerprint and hasn't been touched since
+        entry = self.manifest.get(os.path.abspath(filename))
+
+        return (entry is not None and entry[0] == fingerprint and os.path.exists(filename)
+                and os.path.getmtime(filename) == entry[1])
+
+    def restore(self, filename, fingerprint):
+        # Puts a previous output for the fingerprint at filename, returns False if there is none
+        if self.isUpToDate(filename, fingerprint):
+            return True
+
+        cached = self.lookup(fingerprint, os.path.splitext(filename)[1].lower())
+
+        if cached is None:
+            return False
+
+        shutil.copyfile(cached, filename)
+        self.record(filename, fingerprint)
+
+        return True
+
+    def store(self, filename, fingerprint):
+        # Keeps a copy of a freshly written output
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.copyfile(filename, self.path(fingerprint, os.path.splitext(filename)[1].lower()))
+        self.record(filename, fingerprint)
+
+    def record(self, filename, fingerprint):
+        self.manifest[os.path.abspath(filename)] = [fingerprint, os.path.getmtime(filename)]
+
+    def save(self):
+        # Writes the manifest and drops the oldest outputs past the limit
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(self.manifest_file, 'w') as f:
+            json.dump({filename: entry for filename, entry in self.manifest.items() if os.path.exists(filename)}, f)
+
+        outputs = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name != os.path.basename(self.manifest_file)]
+        outputs.sort(key=os.path.getmtime, reverse=True)
+
+        for output in outputs[self.keep:]:
+            os.remove(output)
+
+
+class CanvasPictureTask(QRunnable):
+    # Plays a recorded canvas back into an image and writes it, off the GUI thread
+    def __init__(self, exporter, picture: QPicture, size: QSizeF, filename):
+        super().__init__()
+        self.exporter = exporter
+        self.picture = picture
+        self.size = size
+        self.filename = filename
+
+    def run(self):
+        if self.exporter.cancelled:
+            self.exporter.exported.emit(self.filename, MPCanvasExporter.cancelled_error)
+            return
+
+        try:
+            self.write_image()
+            self.exporter.exported.emit(self.filename, '')
+
+        except Exception as e:
+            self.exporter.exported.emit(self.filename, str(e))
+
+    def write_image(self):
+        scale = self.exporter.scale
+        image = QImage((self.size * scale).toSize(), QImage.Format_ARGB32)
+        image.fill(Qt.transparent)
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        painter.scale(scale, scale)
+        self.picture.play(painter)
+        painter.end()
+
+        if not image.save(self.filename):
+            raise OSError(f'Could not write {self.filename}')
+
+
+class MPCanvasExporter(QObject):
+    # Exports many canvases without freezing the app. Each canvas is recorded into a QPicture
+    # display list on the GUI thread, one canvas per event loop pass, and the pictures are
+    # rasterized and encoded on a thread pool. SVGs are written straight from the items
+    exported = pyqtSignal(str, str)  # filename, error ('' when written), emitted from the pool
+    progress = pyqtSignal(int)
+    finished = pyqtSignal()
+
+    cancelled_error = 'Export cancelled'
+
+    def __init__(self, scene, scale=1.0, cache: MPExportCache = None):
+        super().__init__()
+        self.scene = scene
+        self.scale = scale
+        self.cache = cache
+
+        self.pool = QThreadPool()
+        self.svg_writer = MPSVGWriter(scene)
+        self.jobs = []
+        self.total = 0
+        self.pending = 0
+        self.written = []
+        self.reused = []
+        self.errors = []
+        self.fingerprints = {}
+        self.cancelled = False
+        self.cache_modes = []
+
+        # Recorded pictures waiting for a thread are kept to a couple per thread
+        self.max_pending = self.pool.maxThreadCount() * 2
+
+        self.timer = QTimer()
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.record_next)
+        self.exported.connect(self.onExported)
+
+    def export(self, jobs):
+        # jobs: (canvas, filename) pairs, finished is emitted once every file is done
+        self.jobs = list(jobs)
+        self.total = len(self.jobs)
+        self.pending = 0
+        self.written = []
+        self.reused = []
+        self.errors = []
+        self.fingerprints = {}
+        self.cancelled = False
+
+        self.scene.clearSelection()
+
+        if self.cache is not None:
+            self.reuse_cached()
+
+        self.cache_modes = disable_item_caches(self.scene)
+
+        if self.jobs:
+            self.timer.start()
+
+        else:
+            self.finish()
+
+    def exec(self, jobs, parent=None, title='Export'):
+        # Runs the export behind a progress dialog and returns the files written, or None
+        # when it was cancelled. The event loop keeps running meanwhile
+        progress = QProgressDialog('Exporting canvases...', 'Cancel', 0, len(jobs), parent)
+        progress.setWindowTitle(title)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.setValue(0)
+        progress.canceled.connect(self.cancel)
+        self.progress.connect(progress.setValue)
+
+        loop = QEventLoop()
+        self.finished.connect(loop.quit)
+        self.export(jobs)
+
+        # Nothing is left to wait for when every canvas came from the cache
+        if self.jobs or self.pending:
+            loop.exec_()
+
+        self.finished.disconnect(loop.quit)
+        self.progress.disconnect(progress.setValue)
+        progress.canceled.disconnect(self.cancel)
+        progress.close()
+
+        return None if self.cancelled else self.written
+
+    def reuse_cached(self):
+        # Canvases that haven't changed since an earlier export are copied (or left alone)
+        # instead of rendered, only the rest stay queued
+        fingerprints = self.cache.fingerprints([canvas for canvas, filename in self.jobs], {'scale': self.scale})
+        self.fingerprints = {filename: fingerprints[canvas] for canvas, filename in self.jobs}
+        jobs = []
+
+        for canvas, filename in self.jobs:
+            try:
+                if self.cache.restore(filename, self.fingerprints[filename]):
+                    self.written.append(filename)
+                    self.reused.append(filename)
+                    continue
+
+            except OSError as e:
+                print(e)
+
+            jobs.append((canvas, filename))
+
+        self.jobs = jobs
+
+    def record(self, canvas):
+        # A canvas region as a display list, with the canvas' top left at the origin. Pixmap
+        # items and the grid draw QImages and lines into it, the picture holds no QPixmaps and
+        # is safe to play back on the pool
+        rect = canvas.sceneBoundingRect()
+        picture = QPicture()
+
+        painter = QPainter(picture)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+        self.scene.render(painter, target=QRectF(QPointF(0, 0), rect.size()), source=rect)
+        painter.end()
+
+        return picture, rect.size()
+
+    def record_next(self):
+        if self.cancelled or not self.jobs or self.pending >= self.max_pending:
+            # Resumed by onExported once a thread frees up
+            self.timer.stop()
+            return
+
+        canvas, filename = self.jobs.pop(0)
+
+        if filename.lower().endswith('.svg'):
+            # Cheap enough to write right away
+            self.pending += 1
+
+            try:
+                self.svg_writer.write(canvas, filename)
+                self.exported.emit(filename, '')
+
+            except Exception as e:
+                self.exported.emit(filename, str(e))
+
+            return
+
+        try:
+            picture, size = self.record(canvas)
+
+        except Exception as e:
+            self.pending += 1
+            self.exported.emit(filename, str(e))
+            return
+
+        self.pending += 1
+        self.pool.start(CanvasPictureTask(self, picture, size, filename))
+
+    def onExported(self, filename, error):
+        self.pending -= 1
+
+        if not error:
+            self.written.append(filename)
+
+            if self.cache is not None:
+                try:
+                    self.cache.store(filename, self.fingerprints[filename])
+
+                except OSError as e:
+                    print(e)
+
+        elif error != self.cancelled_error:
+            self.errors.append(f'{os.path.basename(filename)}: {error}')
+
+        self.progress.emit(len(self.written) + len(self.errors))
+
+        if self.pending == 0 and (self.cancelled or not self.jobs):
+            self.finish()
+
+        elif self.jobs and not self.cancelled and not self.timer.isActive():
+            self.timer.start()
+
+    def cancel(self):
+        # Pictures already on the pool see the flag and return without writing
+        self.cancelled = True
+        self.jobs = []
+
+        if self.pending == 0:
+            self.finish()
+
+    def finish(self):
+        self.timer.stop()
+
+        restore_item_caches(self.cache_modes)
+        self.cache_modes = []
+
+        if self.cache is not None:
+            try:
+                self.cache.save()
+
+            except OSError as e:
+                print(e)
+
+        self.finished.emit()
+
+
+class PNGStreamWriter:
+    # Writes an RGBA PNG a band of rows at a time, the image never has to be in memory whole
+    signature = b'\x89PNG\r\n\x1a\n'
+
+    def __init__(self, filename, width, height, dpi=None, level=6):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.previous = np.zeros((width, 4), np.uint8)
+        self.compressor = zlib.compressobj(level)
+
+        self.file = open(filename, 'wb')
+        self.file.write(self.signature)
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+        if dpi:
+            pixels_per_meter = round(dpi / 0.0254)
+            self.chunk(b'pHYs', struct.pack('>IIB', pixels_per_meter, pixels_per_meter, 1))
+
+    def chunk(self, tag, data):
+        self.file.write(struct.pack('>I', len(data)) + tag + data)
+        self.file.write(struct.pack('>I', zlib.crc32(tag + data)))
+
+    def write(self, rows):
+        # rows: (height, width, 4) RGBA, filtered with PNG's "up" filter (each row minus the
+        # one above) which keeps flat areas and vertical edges cheap to compress
+        above = np.empty_like(rows)
+        above[0] = self.previous
+        above[1:] = rows[:-1]
+
+        scanlines = np.empty((len(rows), 1 + self.width * 4), np.uint8)
+        scanlines[:, 0] = 2
+        scanlines[:, 1:] = (rows - above).reshape(len(rows), -1)
+
+        data = self.compressor.compress(scanlines.tobytes())
+        if data:
+            self.chunk(b'IDAT', data)
+
+        self.previous = rows[-1].copy()
+        self.rows += len(rows)
+
+    def close(self):
+        if self.rows != self.height:
+            self.discard()
+            raise ValueError(f'{self.filename}: wrote {self.rows} of {self.height} rows')
+
+        self.chunk(b'IDAT', self.compressor.flush())
+        self.chunk(b'IEND', b'')
+        self.file.close()
+
+    def discard(self):
+        # Leaves no half written file behind
+        self.file.close()
+        os.remove(self.filename)
+
+
+class MPTiledExporter:
+    # Renders a canvas at any scale in fixed size tiles and streams them into a PNG. Peak
+    # memory is one band of tiles across the canvas rather than the whole image, so a 300
+    # DPI poster does not need gigabytes of RAM
+    tile_size = 512
+
+    def __init__(self, scene, scale=1.0):
+        self.scene = scene
+        self.scale = scale
+
+    def size(self, canvas):
+        return (canvas.sceneBoundingRect().size() * self.scale).toSize()
+
+    def export(self, canvas, filename, dpi=None, progress=None):
+        # progress(done, total) is called after every band and can return False to cancel,
+        # returns False when cancelled
+        rect = canvas.sceneBoundingRect()
+        size = self.size(canvas)
+        bands = math.ceil(size.height() / self.tile_size)
+
+        self.scene.clearSelection()
+        cache_modes = disable_item_caches(self.scene)
+        writer = PNGStreamWriter(filename, size.width(), size.height(), dpi)
+
+        try:
+            for band in range(bands):
+                top = band * self.tile_size
+                height = min(self.tile_size, size.height() - top)
+                rows = np.empty((height, size.width(), 4), np.uint8)
+
+                for left in range(0, size.width(), self.tile_size):
+                    width = min(self.tile_size, size.width() - left)
+                    tile = self.render_tile(rect, QRect(left, top, width, height))
+                    rows[:, left:left + width] = image_array(tile)
+
+                writer.write(rows)
+
+                if progress is not None and progress(band + 1, bands) is False:
+                    writer.discard()
+                    return False
+
+            writer.close()
+            return True
+
+        except Exception:
+            if not writer.file.closed:
+                writer.discard()
+
+            raise
+
+        finally:
+            restore_item_caches(cache_modes)
+
+    def render_tile(self, rect, tile: QRect):
+        # The tile's pixels map back to scene coordinates exactly, so neighbouring tiles
+        # meet without seams
+        source = QRectF(rect.left() + tile.left() / self.scale, rect.top() + tile.top() / self.scale,
+                        tile.width() / self.scale, tile.height() / self.scale)
+
+        image = QImage(tile.size(), QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        self.scene.render(painter, target=QRectF(image.rect()), source=source, mode=Qt.IgnoreAspectRatio)
+        painter.end()
+
+        return image.convertToFormat(QImage.Format_RGBA8888)
+
+
+class MPDocumentPreview:
+    # Builds the thumbnail and summary saved in front of a document, so the recent files
+    # browser can show it without loading any items. The thumbnail is the first canvas,
+    # or everything when the document has no canvas
+    size = 256
+
+    def __init__(self, scene):
+        self.scene = scene
+
+        # The last thumbnail, the scene rect it shows and the top level items drawn in it, so
+        # incremental saves that touch none of them keep it instead of rendering again
+        self.rect = None
+        self.png = None
+        self.items = set()
+
+    def build(self, item_count, changed=None):
+        # item_count is the number of records in the saved document, changed the top level
+        # items added, edited or removed since the last build. None (a full save) always
+        # renders the thumbnail
+        canvases = canvas_order([item for item in self.scene.items() if isinstance(item, CanvasItem)])
+
+        summary = {
+            'canvas_count': len(canvases),
+            'item_count': item_count,
+            'modified': time.time(),
+            'canvases': [canvas.toolTip() for canvas in canvases[:10]],
+        }
+
+        rect = canvases[0].sceneBoundingRect() if canvases else self.scene.itemsBoundingRect()
+
+        if changed is None or self.png is None or rect != self.rect or self.touches(changed, rect):
+            self.png = self.thumbnail(rect)
+            self.rect = rect
+            self.items = {item.topLevelItem() for item in self.scene.items(rect, Qt.IntersectsItemBoundingRect)}
+
+        return summary, self.png
+
+    def touches(self, changed, rect: QRectF):
+        # An item that was drawn in the thumbnail, or is now in its rect
+        return any(item in self.items or (item.scene() is self.scene and item.sceneBoundingRect().intersects(rect))
+                   for item in changed)
+
+    def thumbnail(self, rect: QRectF):
+        if rect.isEmpty():
+            return b''
+
+        size = rect.size().scaled(QSizeF(self.size, self.size), Qt.KeepAspectRatio).toSize()
+        image = QImage(size.expandedTo(QSize(1, 1)), QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+
+        # Selection outlines should not end up in the thumbnail, the selection is put back
+        # without signals so saving does not refresh the panels
+        selected = self.scene.selectedItems()
+        blocked = self.scene.blockSignals(True)
+        self.scene.clearSelection()
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+
+        try:
+            self.scene.render(painter, target=QRectF(image.rect()), source=rect)
+
+        finally:
+            painter.end()
+
+            for item in selected:
+                item.setSelected(True)
+
+            self.scene.blockSignals(blocked)
+
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.WriteOnly)
+        image.save(buffer, 'PNG')
+
+        return bytes(data)
+
+
+class MPPDFExporter:
+    # Writes canvases into one PDF in a single pass, a page per canvas sized to it. Items draw
+    # directly (not from their caches) so pages stay vector, and Qt's PDF engine embeds an
+    # image that is drawn on several pages only once
+    def __init__(self, scene):
+        self.scene = scene
+        self.pages = 0
+        self.seconds = 0.0
+
+    def export(self, canvases, filename, progress=None):
+        # progress(done, total) is called after every page and can return False to cancel,
+        # returns False when cancelled
+        start = time.perf_counter()
+        self.pages = 0
+
+        printer = QPrinter(QPrinter.HighResolution)
+        printer.setOutputFormat(QPrinter.PdfFormat)
+        printer.setOutputFileName(filename)
+        printer.setFullPage(True)
+        printer.setPageMargins(0, 0, 0, 0, QPrinter.Point)
+
+        self.scene.clearSelection()
+        cache_modes = disable_item_caches(self.scene)
+        painter = QPainter()
+
+        try:
+            for canvas in canvases:
+                rect = canvas.sceneBoundingRect()
+
+                # Page sizes apply from the next page on, so the size is set before newPage
+                printer.setPageSize(QPageSize(rect.size(), QPageSize.Point, canvas.toolTip()))
+
+                if self.pages == 0:
+                    if not painter.begin(printer):
+                        raise OSError(f'Could not write {filename}')
+
+                    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+                    painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+                    painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+
+                elif not printer.newPage():
+                    raise OSError(f'Could not add a page to {filename}')
+
+                self.scene.render(painter, target=QRectF(printer.pageRect(QPrinter.DevicePixel)), source=rect)
+                self.pages += 1
+
+                if progress is not None and progress(self.pages, len(canvases)) is False:
+                    # Leaves no half written file behind
+                    printer.abort()
+                    painter.end()
+
+                    if os.path.exists(filename):
+                        os.remove(filename)
+
+                    return False
+
+            return True
+
+        finally:
+            if painter.isActive():
+                painter.end()
+
+            restore_item_caches(cache_modes)
+            self.seconds = time.perf_counter() - start
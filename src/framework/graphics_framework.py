@@ -1,8 +1,13 @@
 import os.path
+from contextlib import contextmanager
 from src.gui.app_screens import TipWin, CanvasItemSelector, AllCanvasExporter, ArrangeWin
 from src.framework.undo_commands import *
 from src.framework.custom_classes import *
-from src.framework.serializer import MPSerializer, MPDeserializer, MPDataRepairer
+from src.framework.serializer import MPSerializer, MPDeserializer, MPDataRepairer, MPProgressiveLoader, MPChangeTracker
+from src.framework.container import MPFileWriter, MPFileReader
+from src.framework.exporter import MPTiledExporter, MPPDFExporter, MPDocumentPreview
+from src.framework.svg_writer import MPSVGWriter
+from src.framework.autosave import MPAutosaver
 from src.framework.tools import *
 from src.scripts.app_internal import *
 from src.scripts.imports import *
@@ -340,8 +345,8 @@ y: {int(self.mapToScene(point).y())}''')
                     item.toMarkdown()
 
             else:
-                pixmap = QPixmap(url.toLocalFile())
-                item = CustomPixmapItem(pixmap)
+                item = CustomPixmapItem()
+                item.loadFromFile(url.toLocalFile())
                 item.store_filename(os.path.abspath(url.toLocalFile()))
                 item.setToolTip('Imported Bitmap')
 
@@ -353,7 +358,6 @@ y: {int(self.mapToScene(point).y())}''')
             # Add item to scene
             add_command = AddItemCommand(self.canvas, item)
             self.canvas.addCommand(add_command)
-            self.canvas.update()
 
     def fitInView(self, *args, **kwargs):
         super().fitInView(*args, **kwargs)
@@ -448,8 +452,224 @@ y: {int(self.mapToScene(point).y())}''')
         self.setDragMode(QGraphicsView.NoDrag)
 
 
+class MPGridRenderer:
+    # Draws the snapping grid by filling the exposed rect with a cached tile of one major
+    # grid cell. Tiles are cached per grid size, zoom (in whole device pixels per tile) and
+    # device pixel ratio, so panning only ever blits. Lines that would be closer together
+    # on screen than min_spacing are left out
+    minor_color = QColor('#a3a3a3')
+    major_color = QColor('#b8b8b8')
+
+    min_spacing = 6
+
+    # Tiles repeat whole major cells until they are at least min_tile_size pixels, tiny
+    # tiles make filling slow. The number of cells is picked so the tile is as close to a
+    # whole number of pixels as possible, Qt only blits a tile 1:1 when it is. Past
+    # max_tile_size (zoomed far in) tiles are not worth caching, the few lines in view are
+    # drawn directly instead
+    min_tile_size = 256
+    max_tile_size = 2048
+
+    # Tiles kept for zoom levels that are not in use
+    max_tiles = 16
+
+    def __init__(self):
+        self.tiles = {}
+        self.minor_pen = QPen(self.minor_color, 1)
+        self.major_pen = QPen(self.major_color, 1)
+
+    def invalidate(self):
+        self.tiles = {}
+
+    def draw(self, painter: QPainter, rect: QRectF, grid_size, grid_squares):
+        transform = painter.worldTransform()
+        scale = math.hypot(transform.m11(), transform.m12())
+        pixel_ratio = painter.device().devicePixelRatioF()
+
+        if scale <= 0 or grid_size <= 0:
+            return
+
+        minor = grid_size if grid_size * scale >= self.min_spacing else None
+        major = grid_size * grid_squares
+
+        # Zoomed far out every 2nd, 4th... major line is kept
+        while major * scale < self.min_spacing:
+            major *= 2
+
+        cell_size = major * scale * pixel_ratio
+        cells = self.cells(cell_size)
+        tile_size = round(cells * cell_size)
+
+        # Exports record into QPictures played back on worker threads, the tiles are pixmaps
+        # and must stay on the GUI thread, lines also stay sharp at any export scale
+        if tile_size > self.max_tile_size or isinstance(painter.device(), QPicture):
+            self.draw_lines(painter, rect, minor, major)
+            return
+
+        painter.save()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.fillRect(rect, self.tile(minor, major, cells, tile_size, scale * pixel_ratio))
+        painter.restore()
+
+    def cells(self, cell_size):
+        first = max(1, math.ceil(self.min_tile_size / cell_size))
+        last = max(first, int(self.max_tile_size // cell_size))
+
+        return min(range(first, last + 1), key=lambda cells: abs(cells * cell_size - round(cells * cell_size)))
+
+    def tile(self, minor, major, cells, tile_size, pixel_scale):
+        key = (minor, major, cells, tile_size)
+
+        if key in self.tiles:
+            # Most recently used last
+            self.tiles[key] = self.tiles.pop(key)
+            return self.tiles[key]
+
+        # Lines are one scene unit wide like the rest of the scene, and never thinner than
+        # a device pixel
+        width = max(1.0, pixel_scale)
+        pixmap = QPixmap(tile_size, tile_size)
+        pixmap.fill(Qt.transparent)
+
+        painter = QPainter(pixmap)
+
+        if minor is not None:
+            step = tile_size * minor / (major * cells)
+
+            for i in range(round(major * cells / minor)):
+                if i % round(major / minor):
+                    painter.fillRect(QRectF(i * step - width / 2, 0, width, tile_size), self.minor_color)
+                    painter.fillRect(QRectF(0, i * step - width / 2, tile_size, width), self.minor_color)
+
+        # Major lines on the tile edges are drawn half on each side
+        step = tile_size / cells
+
+        for i in range(cells + 1):
+            painter.fillRect(QRectF(i * step - width / 2, 0, width, tile_size), self.major_color)
+            painter.fillRect(QRectF(0, i * step - width / 2, tile_size, width), self.major_color)
+
+        painter.end()
+
+        # One tile covers exactly cells major cells of the scene, starting at the origin
+        brush = QBrush(pixmap)
+        brush.setTransform(QTransform.fromScale(major * cells / tile_size, major * cells / tile_size))
+
+        self.tiles[key] = brush
+
+        if len(self.tiles) > self.max_tiles:
+            del self.tiles[next(iter(self.tiles))]
+
+        return brush
+
+    def draw_lines(self, painter: QPainter, rect: QRectF, minor, major):
+        step = minor or major
+        left = math.floor(rect.left() / step) * step
+        top = math.floor(rect.top() / step) * step
+
+        lines_minor, lines_major = [], []
+        for x in range(int(left), int(math.ceil(rect.right())) + 1, int(step)):
+            (lines_minor if x % major else lines_major).append(QLineF(x, rect.top(), x, rect.bottom()))
+
+        for y in range(int(top), int(math.ceil(rect.bottom())) + 1, int(step)):
+            (lines_minor if y % major else lines_major).append(QLineF(rect.left(), y, rect.right(), y))
+
+        painter.setPen(self.minor_pen)
+        painter.drawLines(lines_minor)
+
+        painter.setPen(self.major_pen)
+        painter.drawLines(lines_major)
+
+
+class MPDirtyTracker(QObject):
+    # Collects the items and scene rects that changed and repaints just those, once per pass
+    # of the event loop, instead of updating every item in the scene. Commands are marked
+    # when they are pushed, undone or redone and tools mark what they touch. flushed reports
+    # how many items each frame invalidated
+    flushed = pyqtSignal(int)
+
+    # Frames kept for stats()
+    max_history = 240
+
+    def __init__(self, scene):
+        super().__init__()
+        self.scene = scene
+        self.items = {}  # Insertion ordered set
+        self.rects = []
+        self.history = []
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.flush)
+
+    def mark(self, items):
+        for item in items:
+            if isinstance(item, QGraphicsItem):
+                self.items[item] = None
+
+        self.schedule()
+
+    def markRect(self, rect: QRectF):
+        if not rect.isEmpty():
+            self.rects.append(QRectF(rect))
+            self.schedule()
+
+    def markCommand(self, command):
+        self.mark(MPChangeTracker.commandItems(command))
+
+    def schedule(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        self.timer.stop()
+
+        items, rects = self.items, self.rects
+        self.items, self.rects = {}, []
+
+        # Leader lines follow their label, whichever of the two was touched
+        for item in list(items):
+            if isinstance(item.parentItem(), LeaderLineItem):
+                items[item.parentItem()] = None
+
+        count = 0
+
+        for item in items:
+            if item.scene() is not self.scene:
+                continue
+
+            if isinstance(item, LeaderLineItem):
+                item.updatePathEndPoint()
+
+            item.update()
+            count += 1
+
+        for rect in rects:
+            QGraphicsScene.update(self.scene, rect)
+
+        self.history.append(count)
+        del self.history[:-self.max_history]
+
+        self.flushed.emit(count)
+
+        return count
+
+    def stats(self):
+        # Items invalidated per frame over the recent frames
+        if not self.history:
+            return {'frames': 0, 'items': 0, 'mean': 0.0, 'peak': 0}
+
+        return {
+            'frames': len(self.history),
+            'items': sum(self.history),
+            'mean': sum(self.history) / len(self.history),
+            'peak': max(self.history),
+        }
+
+
 class CustomGraphicsScene(QGraphicsScene):
     itemsMoved = pyqtSignal(object, object)
+    itemsAdded = pyqtSignal(list)
 
     def __init__(self, undoStack):
         super().__init__()
@@ -470,6 +690,10 @@ class CustomGraphicsScene(QGraphicsScene):
         self.gridEnabled = False
         self.gridSize = 10
         self.gridSquares = 5
+        self.gridRenderer = MPGridRenderer()
+
+        # Repaints
+        self.dirty = MPDirtyTracker(self)
 
         # Item Movement
         self.oldPositions = {}
@@ -477,6 +701,11 @@ class CustomGraphicsScene(QGraphicsScene):
         self.oldPos = QPointF()
         self.itemsMoved.connect(self.onItemMoved)
 
+        # Bulk insertion
+        self.batch_depth = 0
+        self.batch_items = []
+        self.batch_selection = set()
+
         # Managers
         self.manager = SceneManager(self)
         self.template_manager = TemplateManager(self)
@@ -504,44 +733,7 @@ class CustomGraphicsScene(QGraphicsScene):
             super().drawBackground(painter, rect)
 
             if self.gridEnabled:
-                # settings
-                self._color_light = QColor("#a3a3a3")
-                self._color_dark = QColor("#b8b8b8")
-
-                self._pen_light = QPen(self._color_light)
-                self._pen_light.setWidth(1)
-                self._pen_dark = QPen(self._color_dark)
-                self._pen_dark.setWidth(1)
-
-                # here we create our grid
-                left = int(math.floor(rect.left()))
-                right = int(math.ceil(rect.right()))
-                top = int(math.floor(rect.top()))
-                bottom = int(math.ceil(rect.bottom()))
-
-                first_left = left - (left % self.gridSize)
-                first_top = top - (top % self.gridSize)
-
-                # compute all lines to be drawn
-                lines_light, lines_dark = [], []
-                for x in range(first_left, right, self.gridSize):
-                    if (x % (self.gridSize * self.gridSquares) != 0):
-                        lines_light.append(QLine(x, top, x, bottom))
-                    else:
-                        lines_dark.append(QLine(x, top, x, bottom))
-
-                for y in range(first_top, bottom, self.gridSize):
-                    if (y % (self.gridSize * self.gridSquares) != 0):
-                        lines_light.append(QLine(left, y, right, y))
-                    else:
-                        lines_dark.append(QLine(left, y, right, y))
-
-                # draw the lines
-                painter.setPen(self._pen_light)
-                painter.drawLines(*lines_light)
-
-                painter.setPen(self._pen_dark)
-                painter.drawLines(*lines_dark)
+                self.gridRenderer.draw(painter, rect, self.gridSize, self.gridSquares)
 
         except Exception:
             pass
@@ -549,25 +741,77 @@ class CustomGraphicsScene(QGraphicsScene):
     def addItem(self, item):
         super().addItem(item)
 
+        # Items already in the scene got the flag when the grid was turned on, only the
+        # new item and its children need it
         if self.gridEnabled:
-            for item in self.items():
-                if isinstance(item, CanvasTextItem):
-                    pass
+            self.setItemGridEnabled(item, True)
 
-                else:
-                    item.gridEnabled = True
+        if self.batch_depth:
+            self.batch_items.append(item)
+
+        else:
+            self.itemsAdded.emit([item])
+
+    def addItems(self, items):
+        with self.batch():
+            for item in items:
+                self.addItem(item)
+
+    @contextmanager
+    def batch(self):
+        # Groups many insertions and removals: selectionChanged and itemsAdded are emitted
+        # once when the outermost batch ends instead of once per item
+        if self.batch_depth == 0:
+            self.batch_items = []
+            self.batch_selection = set(self.selectedItems())
+            self.blockSignals(True)
+
+        self.batch_depth += 1
+
+        try:
+            yield
+
+        finally:
+            self.batch_depth -= 1
+
+            if self.batch_depth == 0:
+                self.blockSignals(False)
+
+                if set(self.selectedItems()) != self.batch_selection:
+                    self.selectionChanged.emit()
+
+                if self.batch_items:
+                    self.itemsAdded.emit(self.batch_items)
+
+                self.batch_items = []
+                self.batch_selection = set()
+
+    def setItemGridEnabled(self, item, enabled: bool):
+        if not isinstance(item, CanvasTextItem):
+            item.gridEnabled = enabled
+
+        for child in item.childItems():
+            self.setItemGridEnabled(child, enabled)
 
     def update(self, rect=None):
-        super().update()
+        # Repaints rect, or the whole view. Items that changed are repainted through
+        # markDirty() instead
+        super().update(rect if rect is not None else QRectF())
 
-        for item in self.items():
-            item.update()
+    def markDirty(self, *items):
+        self.dirty.mark(items)
+
+    def markDirtyRect(self, rect: QRectF):
+        self.dirty.markRect(rect)
 
     def onItemMoved(self, oldPositions, newPositions):
         self.addCommand(ItemMovedUndoCommand(oldPositions, newPositions))
 
     def undo(self):
         if self.undo_stack.canUndo():
+            command = self.undo_stack.command(self.undo_stack.index() - 1)
+            self.manager.tracker.markCommand(command)
+            self.dirty.markCommand(command)
             self.undo_stack.undo()
             self.modified = True
             self.parentWindow.setWindowTitle(f'{os.path.basename(self.manager.filename)}* - MPRUN')
@@ -575,13 +819,11 @@ class CustomGraphicsScene(QGraphicsScene):
         self.parentWindow.update_transform_ui()
         self.parentWindow.update_appearance_ui()
 
-        for item in self.items():
-            if isinstance(item, CustomTextItem):
-                if isinstance(item.parentItem(), LeaderLineItem):
-                    item.parentItem().updatePathEndPoint()
-
     def redo(self):
         if self.undo_stack.canRedo():
+            command = self.undo_stack.command(self.undo_stack.index())
+            self.manager.tracker.markCommand(command)
+            self.dirty.markCommand(command)
             self.undo_stack.redo()
             self.modified = True
             self.parentWindow.setWindowTitle(f'{os.path.basename(self.manager.filename)}* - MPRUN')
@@ -589,13 +831,10 @@ class CustomGraphicsScene(QGraphicsScene):
         self.parentWindow.update_transform_ui()
         self.parentWindow.update_appearance_ui()
 
-        for item in self.items():
-            if isinstance(item, CustomTextItem):
-                if isinstance(item.parentItem(), LeaderLineItem):
-                    item.parentItem().updatePathEndPoint()
-
     def addCommand(self, command):
         self.undo_stack.push(command)
+        self.manager.tracker.markCommand(command)
+        self.dirty.markCommand(command)
         self.setHasChanges(True)
         self.parentWindow.setWindowTitle(f'{os.path.basename(self.manager.filename)}* - MPRUN')
 
@@ -663,7 +902,10 @@ class CustomGraphicsScene(QGraphicsScene):
         self.gridEnabled = enabled
 
     def setGridSize(self, grid_size: int):
-        self.gridSize = grid_size
+        if grid_size != self.gridSize:
+            self.gridSize = grid_size
+            self.gridRenderer.invalidate()
+
         self.update()
 
     def selectBelow(self):
@@ -740,8 +982,20 @@ class SceneManager:
 
         self.serializer = MPSerializer(self.scene)
         self.deserializer = MPDeserializer(self.scene)
+        self.tracker = MPChangeTracker(self.scene)
+        self.autosaver = MPAutosaver(self.scene)
+        self.autosaver.failed.connect(self.autosave_failed)
+        self.preview = MPDocumentPreview(self.scene)
+        self.loader = None
+
+    def autosave_failed(self, error):
+        # Without a snapshot there is nothing to recover after a crash, the user should know
+        self.scene.parentWindow.canvas_view.showMessage('Autosave', f'Recovery data could not be saved: {error}')
 
     def reset_to_default_scene(self):
+        self.stop_loading()
+        self.tracker.clear()
+        self.autosaver.clear()
         self.scene.clear()
         self.scene.setHasChanges(False)
         self.filename = 'Untitled'
@@ -773,15 +1027,85 @@ class SceneManager:
         else:
             self.reset_to_default_scene()
 
+    def open_document(self, filename):
+        self.stop_loading()
+        self.tracker.clear()
+        self.autosaver.clear()
+
+        if MPFileReader.isContainerFile(filename):
+            reader = MPFileReader(filename).open()
+
+            # Documents saved with scene bounds in the item index are loaded viewport first
+            if reader.hasBounds():
+                self.tracker.open(filename, reader)
+                self.loader = MPProgressiveLoader(self.scene, self.deserializer, reader)
+                self.loader.start()
+
+                return
+
+            # Older documents are read in one go, nothing keeps the reader after that
+            with reader:
+                items_data = reader.read_items()
+
+            self.deserializer.deserialize_items(items_data)
+
+            return
+
+        self.deserializer.deserialize_items(MPFileReader.load(filename))
+
+    def stop_loading(self):
+        if self.loader is not None:
+            self.loader.stop()
+            self.loader = None
+
+    def finish_loading(self):
+        if self.loader is not None and self.loader.isLoading():
+            self.loader.finish()
+
+    def write_document(self, filename):
+        items_data = self.serializer.serialize_items()
+        MPFileWriter(filename).write(items_data, self.preview.build(len(items_data) - 1))
+
+        self.tracker.saved(filename, self.serializer.serialized_items, items_data[0]['assets'])
+
+        # Every record is fresh, the next autosave snapshot can reuse all of them
+        self.tracker.autosave_dirty.clear()
+        self.autosaver.seed_assets(items_data[0]['assets'])
+
+        for item, record in zip(self.serializer.serialized_items, items_data[1:]):
+            self.autosaver.seed(item, record)
+
+    def restore_recovery(self, filename):
+        # Opens an autosave snapshot as an unsaved copy of the document it was taken from
+        document = self.autosaver.recovered_document(filename)
+
+        self.scene.undo_stack.clear()
+        self.scene.clear()
+        self.open_document(filename)
+        self.tracker.clear()
+
+        self.filename = document
+        self.scene.setHasChanges(True)
+        self.scene.parentWindow.setWindowTitle(f'{os.path.basename(self.filename)}* - MPRUN')
+
     def save(self):
+        self.finish_loading()
+
         try:
             if self.filename != 'Untitled':
-                with open(self.filename, 'wb') as f:
-                    pickle.dump(self.serializer.serialize_items(), f)
-                    self.scene.parentWindow.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
-                    self.scene.setHasChanges(False)
+                # Only the items changed since the last save are written, unless the
+                # journal is due for compaction
+                if self.tracker.canAppend(self.filename):
+                    self.tracker.append(self.serializer, self.preview)
+
+                else:
+                    self.write_document(self.filename)
+
+                self.scene.parentWindow.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
+                self.scene.setHasChanges(False)
+                self.autosaver.discard()
 
-                    return True
+                return True
 
             else:
                 self.saveas()
@@ -790,20 +1114,22 @@ class SceneManager:
             QMessageBox.critical(self.scene.parentWindow, 'Open File Error', f'Error saving scene: {e}', QMessageBox.Ok)
 
     def saveas(self):
+        self.finish_loading()
+
         filename, _ = QFileDialog.getSaveFileName(self.scene.parentWindow, 'Save As', '', 'MPRUN files (*.mp)')
 
         if filename:
             try:
-                with open(filename, 'wb') as f:
-                    pickle.dump(self.serializer.serialize_items(), f)
+                self.write_document(filename)
 
-                    self.filename = filename
-                    self.scene.setHasChanges(False)
-                    self.scene.parentWindow.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
-                    self.scene.parentWindow.update_recent_file_data(filename)
-                    self.scene.parentWindow.canvas_view.showMessage('File', f'File {self.filename} saved successfully.')
+                self.filename = filename
+                self.scene.setHasChanges(False)
+                self.autosaver.discard()
+                self.scene.parentWindow.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
+                self.scene.parentWindow.update_recent_file_data(filename)
+                self.scene.parentWindow.canvas_view.showMessage('File', f'File {self.filename} saved successfully.')
 
-                    return True
+                return True
 
             except Exception as e:
                 print(e)
@@ -836,28 +1162,26 @@ class SceneManager:
                         self.scene.clear()
                         self.scene.parentWindow.update_recent_file_data(filename)
 
-                        with open(filename, 'rb') as f:
-                            items_data = pickle.load(f)
-                            self.deserializer.deserialize_items(items_data)
+                        self.open_document(filename)
 
-                            self.filename = filename
-                            parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
+                        self.filename = filename
+                        parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
 
-                            if self.repair_needed:
-                                # Display a confirmation dialog
-                                confirmation_dialog = QMessageBox(self.scene.parentWindow)
-                                confirmation_dialog.setWindowTitle('Open Document Error')
-                                confirmation_dialog.setIcon(QMessageBox.Warning)
-                                confirmation_dialog.setText(
-                                    f"The document has file directories that could not be found. Do you want to do a file repair?")
-                                confirmation_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                                confirmation_dialog.setDefaultButton(QMessageBox.Yes)
+                        if self.repair_needed:
+                            # Display a confirmation dialog
+                            confirmation_dialog = QMessageBox(self.scene.parentWindow)
+                            confirmation_dialog.setWindowTitle('Open Document Error')
+                            confirmation_dialog.setIcon(QMessageBox.Warning)
+                            confirmation_dialog.setText(
+                                f"The document has file directories that could not be found. Do you want to do a file repair?")
+                            confirmation_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+                            confirmation_dialog.setDefaultButton(QMessageBox.Yes)
 
-                                # Get the result of the confirmation dialog
-                                result = confirmation_dialog.exec_()
+                            # Get the result of the confirmation dialog
+                            result = confirmation_dialog.exec_()
 
-                                if result == QMessageBox.Yes:
-                                    self.repair_file()
+                            if result == QMessageBox.Yes:
+                                self.repair_file()
 
                 elif result == QMessageBox.Save:
                     parent.save()
@@ -870,41 +1194,7 @@ class SceneManager:
                         self.scene.clear()
                         self.scene.parentWindow.update_recent_file_data(filename)
 
-                        with open(filename, 'rb') as f:
-                            items_data = pickle.load(f)
-                            self.deserializer.deserialize_items(items_data)
-
-                            self.filename = filename
-                            parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
-
-                            if self.repair_needed:
-                                # Display a confirmation dialog
-                                confirmation_dialog = QMessageBox(self.scene.parentWindow)
-                                confirmation_dialog.setWindowTitle('Open Document Error')
-                                confirmation_dialog.setIcon(QMessageBox.Warning)
-                                confirmation_dialog.setText(
-                                    f"The document has file directories that could not be found. Do you want to do a file repair?")
-                                confirmation_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                                confirmation_dialog.setDefaultButton(QMessageBox.Yes)
-
-                                # Get the result of the confirmation dialog
-                                result = confirmation_dialog.exec_()
-
-                                if result == QMessageBox.Yes:
-                                    self.repair_file()
-
-            else:
-                filename, _ = QFileDialog.getOpenFileName(self.scene.parentWindow, 'Open File', '',
-                                                          'MPRUN files (*.mp)')
-
-                if filename:
-                    self.scene.undo_stack.clear()
-                    self.scene.clear()
-                    self.scene.parentWindow.update_recent_file_data(filename)
-
-                    with open(filename, 'rb') as f:
-                        items_data = pickle.load(f)
-                        self.deserializer.deserialize_items(items_data)
+                        self.open_document(filename)
 
                         self.filename = filename
                         parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
@@ -925,6 +1215,36 @@ class SceneManager:
                             if result == QMessageBox.Yes:
                                 self.repair_file()
 
+            else:
+                filename, _ = QFileDialog.getOpenFileName(self.scene.parentWindow, 'Open File', '',
+                                                          'MPRUN files (*.mp)')
+
+                if filename:
+                    self.scene.undo_stack.clear()
+                    self.scene.clear()
+                    self.scene.parentWindow.update_recent_file_data(filename)
+
+                    self.open_document(filename)
+
+                    self.filename = filename
+                    parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
+
+                    if self.repair_needed:
+                        # Display a confirmation dialog
+                        confirmation_dialog = QMessageBox(self.scene.parentWindow)
+                        confirmation_dialog.setWindowTitle('Open Document Error')
+                        confirmation_dialog.setIcon(QMessageBox.Warning)
+                        confirmation_dialog.setText(
+                            f"The document has file directories that could not be found. Do you want to do a file repair?")
+                        confirmation_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+                        confirmation_dialog.setDefaultButton(QMessageBox.Yes)
+
+                        # Get the result of the confirmation dialog
+                        result = confirmation_dialog.exec_()
+
+                        if result == QMessageBox.Yes:
+                            self.repair_file()
+
         except Exception as e:
             QMessageBox.critical(self.scene.parentWindow,
                                  'Open File Error',
@@ -951,18 +1271,48 @@ class SceneManager:
 
                 if result == QMessageBox.Discard:
                     if filename.endswith('.mpt'):
-                        with open(filename, 'r') as f:
-                            data = json.load(f)
-
-                            self.scene.template_manager.deserialize_items(data)
+                        template = self.scene.template_manager.read_template(filename)
+                        self.scene.template_manager.deserialize_items(template)
 
                     elif filename.endswith('.mp'):
                         self.scene.undo_stack.clear()
                         self.scene.clear()
 
-                        with open(filename, 'rb') as f:
-                            items_data = pickle.load(f)
-                            self.deserializer.deserialize_items(items_data)
+                        self.open_document(filename)
+
+                        self.filename = filename
+                        parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
+                        self.scene.setHasChanges(False)
+
+                        if self.repair_needed:
+                            # Display a confirmation dialog
+                            confirmation_dialog = QMessageBox(self.scene.parentWindow)
+                            confirmation_dialog.setWindowTitle('Open Document Error')
+                            confirmation_dialog.setIcon(QMessageBox.Warning)
+                            confirmation_dialog.setText(
+                                f"The document has file directories that could not be found. Do you want to do a file repair?")
+                            confirmation_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+                            confirmation_dialog.setDefaultButton(QMessageBox.Yes)
+
+                            # Get the result of the confirmation dialog
+                            result = confirmation_dialog.exec_()
+
+                            if result == QMessageBox.Yes:
+                                self.repair_file()
+
+                elif result == QMessageBox.Save:
+                    success = self.save()
+
+                    if success:
+                        if filename.endswith('.mpt'):
+                            template = self.scene.template_manager.read_template(filename)
+                            self.scene.template_manager.deserialize_items(template)
+
+                        elif filename.endswith('.mp'):
+                            self.scene.undo_stack.clear()
+                            self.scene.clear()
+
+                            self.open_document(filename)
 
                             self.filename = filename
                             parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
@@ -984,78 +1334,36 @@ class SceneManager:
                                 if result == QMessageBox.Yes:
                                     self.repair_file()
 
-                elif result == QMessageBox.Save:
-                    success = self.save()
-
-                    if success:
-                        if filename.endswith('.mpt'):
-                            with open(filename, 'r') as f:
-                                data = json.load(f)
-
-                                self.scene.template_manager.deserialize_items(data)
-
-                        elif filename.endswith('.mp'):
-                            self.scene.undo_stack.clear()
-                            self.scene.clear()
-
-                            with open(filename, 'rb') as f:
-                                items_data = pickle.load(f)
-                                self.deserializer.deserialize_items(items_data)
-
-                                self.filename = filename
-                                parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
-                                self.scene.setHasChanges(False)
-
-                                if self.repair_needed:
-                                    # Display a confirmation dialog
-                                    confirmation_dialog = QMessageBox(self.scene.parentWindow)
-                                    confirmation_dialog.setWindowTitle('Open Document Error')
-                                    confirmation_dialog.setIcon(QMessageBox.Warning)
-                                    confirmation_dialog.setText(
-                                        f"The document has file directories that could not be found. Do you want to do a file repair?")
-                                    confirmation_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                                    confirmation_dialog.setDefaultButton(QMessageBox.Yes)
-
-                                    # Get the result of the confirmation dialog
-                                    result = confirmation_dialog.exec_()
-
-                                    if result == QMessageBox.Yes:
-                                        self.repair_file()
-
             else:
                 if filename.endswith('.mpt'):
-                    with open(filename, 'r') as f:
-                        data = json.load(f)
-
-                        self.scene.template_manager.deserialize_items(data)
+                    template = self.scene.template_manager.read_template(filename)
+                    self.scene.template_manager.deserialize_items(template)
 
                 elif filename.endswith('.mp'):
                     self.scene.undo_stack.clear()
                     self.scene.clear()
 
-                    with open(filename, 'rb') as f:
-                        items_data = pickle.load(f)
-                        self.deserializer.deserialize_items(items_data)
+                    self.open_document(filename)
 
-                        self.filename = filename
-                        parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
-                        self.scene.setHasChanges(False)
+                    self.filename = filename
+                    parent.setWindowTitle(f'{os.path.basename(self.filename)} - MPRUN')
+                    self.scene.setHasChanges(False)
 
-                        if self.repair_needed:
-                            # Display a confirmation dialog
-                            confirmation_dialog = QMessageBox(self.scene.parentWindow)
-                            confirmation_dialog.setWindowTitle('Open Document Error')
-                            confirmation_dialog.setIcon(QMessageBox.Warning)
-                            confirmation_dialog.setText(
-                                f"The document has file directories that could not be found. Do you want to do a file repair?")
-                            confirmation_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                            confirmation_dialog.setDefaultButton(QMessageBox.Yes)
+                    if self.repair_needed:
+                        # Display a confirmation dialog
+                        confirmation_dialog = QMessageBox(self.scene.parentWindow)
+                        confirmation_dialog.setWindowTitle('Open Document Error')
+                        confirmation_dialog.setIcon(QMessageBox.Warning)
+                        confirmation_dialog.setText(
+                            f"The document has file directories that could not be found. Do you want to do a file repair?")
+                        confirmation_dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+                        confirmation_dialog.setDefaultButton(QMessageBox.Yes)
 
-                            # Get the result of the confirmation dialog
-                            result = confirmation_dialog.exec_()
+                        # Get the result of the confirmation dialog
+                        result = confirmation_dialog.exec_()
 
-                            if result == QMessageBox.Yes:
-                                self.repair_file()
+                        if result == QMessageBox.Yes:
+                            self.repair_file()
 
         except Exception as e:
             QMessageBox.critical(self.scene.parentWindow,
@@ -1078,17 +1386,23 @@ class TemplateManager:
             filename, _ = QFileDialog.getOpenFileName(self.scene.parentWindow,
                                                       'Open Template',
                                                       '',
-                                                      'MPRUN template files (*.mpt)')
+                                                      'MPRUN template files (*.mpt);;MPRUN files (*.mp)')
 
             if filename:
-                with open(filename, 'r') as f:
-                    data = json.load(f)
-
-                    self.deserialize_items(data)
+                self.deserialize_items(self.read_template(filename))
 
         except Exception as e:
             print(e)
 
+    def read_template(self, filename):
+        # Any document can be used as a template, only its canvases are read from it
+        if MPFileReader.isContainerFile(filename):
+            with MPFileReader(filename, mapped=True) as reader:
+                return reader.canvases()
+
+        with open(filename, 'r') as f:
+            return json.load(f)
+
     def save_template(self):
         try:
             filename, _ = QFileDialog.getSaveFileName(self.scene.parentWindow,
@@ -1122,13 +1436,14 @@ class TemplateManager:
         }
 
     def deserialize_items(self, items_data):
-        for item_data in items_data:
-            item = None
-            if item_data['type'] == 'CanvasItem':
-                item = self.deserialize_canvas(item_data)
+        with self.scene.batch():
+            for item_data in items_data:
+                item = None
+                if item_data['type'] == 'CanvasItem':
+                    item = self.deserialize_canvas(item_data)
 
-            if item is not None:
-                self.scene.addItem(item)
+                if item is not None:
+                    self.scene.addItem(item)
 
         self.scene.parentWindow.use_exit_add_canvas()
 
@@ -1185,8 +1500,8 @@ class ImportManager:
                     self.create_item_attributes(item)
 
             else:
-                image1 = QPixmap(file_path)
-                image2 = CustomPixmapItem(image1)
+                image2 = CustomPixmapItem()
+                image2.loadFromFile(file_path)
                 image2.store_filename(file_path)
 
                 add_command = AddItemCommand(self.canvas, image2)
@@ -1210,6 +1525,9 @@ class ExportManager:
         self.canvas = canvas
 
     def normalExport(self):
+        # Everything has to be loaded before it can be exported
+        self.canvas.manager.finish_loading()
+
         # Exit add canvas tool if active
         self.canvas.parentWindow.use_exit_add_canvas()
         self.canvas.parentWindow.select_btn.trigger()
@@ -1236,7 +1554,7 @@ class ExportManager:
                         if isinstance(item, CanvasItem):
                             item.setTransparentMode()
 
-                self.filterSelectedCanvasForExport(selected_item)
+                self.filterSelectedCanvasForExport(selected_item, selector.resolution_combo.currentData())
 
             else:
                 QMessageBox.warning(self.canvas.parentWindow,
@@ -1251,59 +1569,74 @@ class ExportManager:
         selector = AllCanvasExporter(self.canvas, self.canvas.parentWindow)
         selector.show()
 
-    def exportAsBitmap(self, filename, selected_item):
-        # Create a QImage with the size of the selected item (QGraphicsRectItem)
+    def exportAsBitmap(self, filename, selected_item, dpi=72):
         rect = selected_item.sceneBoundingRect()
-        image = QImage(rect.size().toSize(), QImage.Format_ARGB32)
-
-        print(rect)
-
-        # Render the QGraphicsRectItem onto the image
-        painter = QPainter(image)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
-        self.canvas.render(painter, target=QRectF(image.rect()), source=rect)
-        painter.end()
+        scale = dpi / 72
 
         try:
-            # Save the image to file
-            success = image.save(filename)
+            if filename.lower().endswith('.png'):
+                # PNGs are streamed out in tiles, so high resolutions don't need the whole image in memory
+                if not self.exportAsTiledPNG(filename, selected_item, scale, dpi):
+                    return
 
-            if success:
-                self.show_export_finished()
+            else:
+                # Other encoders need the whole image
+                image = QImage((rect.size() * scale).toSize(), QImage.Format_ARGB32)
+                image.fill(Qt.transparent)
+                image.setDotsPerMeterX(round(dpi / 0.0254))
+                image.setDotsPerMeterY(round(dpi / 0.0254))
+
+                if image.isNull():
+                    raise MemoryError(f'{image.width()} x {image.height()} is too large, export as PNG instead')
+
+                # Render the QGraphicsRectItem onto the image
+                painter = QPainter(image)
+                painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+                painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+                painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+                self.canvas.render(painter, target=QRectF(image.rect()), source=rect)
+                painter.end()
+
+                if not image.save(filename):
+                    raise OSError(f'Could not write {filename}')
+
+            self.show_export_finished()
 
-                # Open the image with the default image viewer
-                QDesktopServices.openUrl(QUrl.fromLocalFile(filename))
+            # Open the image with the default image viewer
+            QDesktopServices.openUrl(QUrl.fromLocalFile(filename))
 
         except Exception as e:
             # If saving failed, show an error notification
             QMessageBox.critical(self.canvas.parentWindow, "Export Error", f"Failed to export canvas to file: {e}")
 
-    def exportAsSVG(self, file_path, selected_item):
+    def exportAsTiledPNG(self, filename, selected_item, scale, dpi):
+        # Returns False when cancelled
+        exporter = MPTiledExporter(self.canvas, scale)
+
+        progress = QProgressDialog('Exporting canvas...', 'Cancel', 0, 0, self.canvas.parentWindow)
+        progress.setWindowTitle('Export')
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+
+        def update(done, total):
+            progress.setMaximum(total)
+            progress.setValue(done)
+
+            return not progress.wasCanceled()
+
         try:
-            # Get the bounding rect
-            rect = selected_item.sceneBoundingRect()
+            return exporter.export(selected_item, filename, dpi, update)
 
-            # Export as SVG
-            svg_generator = QSvgGenerator()
-            svg_generator.setFileName(file_path)
-            svg_generator.setSize(rect.size().toSize())
-            svg_generator.setViewBox(rect)
+        finally:
+            progress.close()
 
+    def exportAsSVG(self, file_path, selected_item):
+        try:
             # Clear selection
             self.canvas.clearSelection()
 
-            # Create a QPainter to paint onto the QSvgGenerator
-            painter = QPainter()
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-            painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
-            painter.begin(svg_generator)
-
-            # Render the scene onto the QPainter
-            self.canvas.render(painter, target=rect, source=rect)
-
-            # End painting
-            painter.end()
+            # Written from the items, course elements are defined once and text stays text
+            MPSVGWriter(self.canvas).write(selected_item, file_path)
 
             self.show_export_finished()
 
@@ -1317,39 +1650,19 @@ class ExportManager:
 
     def exportAsPDF(self, file_path, selected_item):
         try:
-            # Get the bounding rect of the selected item
-            bounding_rect = selected_item.sceneBoundingRect()
-
-            # Configure the printer
-            printer = QPrinter(QPrinter.HighResolution)
-            printer.setOutputFormat(QPrinter.PdfFormat)
-            printer.setOutputFileName(file_path)
-
-            # Adjust the printer's page size to match the bounding rect
-            printer.setPageSizeMM(QSizeF(bounding_rect.width(), bounding_rect.height()))
-
-            # Start painting
-            painter = QPainter()
-            painter.begin(printer)
-
-            # Translate painter to the bounding rect top-left
-            painter.translate(-bounding_rect.topLeft())
-
-            # Render the selected item
-            self.canvas.render(painter, QRectF(), bounding_rect)
-
-            # End painting
-            painter.end()
+            # One page exactly the size of the canvas
+            MPPDFExporter(self.canvas).export([selected_item], file_path)
 
         except Exception as e:
-            print(e)
+            QMessageBox.critical(self.canvas.parentWindow, "Export Error", f"Failed to export canvas to file: {e}")
+            return
 
         self.show_export_finished()
 
         # Open the PDF with the default viewer
         QDesktopServices.openUrl(QUrl.fromLocalFile(file_path))
 
-    def filterSelectedCanvasForExport(self, selected_item):
+    def filterSelectedCanvasForExport(self, selected_item, dpi=72):
         # File dialog, filepath
         file_dialog = QFileDialog()
 
@@ -1372,7 +1685,7 @@ class ExportManager:
             else:
                 try:
                     self.canvas.clearSelection()
-                    self.exportAsBitmap(file_path, selected_item)
+                    self.exportAsBitmap(file_path, selected_item, dpi)
 
                 except Exception as e:
                     print(e)
@@ -0,0 +1,196 @@
+from src.scripts.imports import *
+
+if getattr(sys, 'frozen', False):
+    os.chdir(sys._MEIPASS)
+
+
+class MPPathMeasure:
+    # Arc length lookup table for a QPainterPath. The path is flattened once into straight
+    # segments, after which length() is a lookup and points and angles at any distance along
+    # it (or many distances at once, as arrays) are a binary search away, instead of a walk
+    # over the whole path like QPainterPath.length() and pointAtPercent() do. A stroke being
+    # drawn is extended with move_to() and line_to() as it grows
+
+    # Curves are cut into chords of about this length, fine enough for the angle of a chord
+    # to pass for the tangent
+    segment_length = 2.0
+    max_curve_segments = 1024
+
+    def __init__(self, path: QPainterPath = None):
+        # Per segment: start point, vector to its end, length, distance along the path at
+        # its start and angle in degrees counterclockwise (as QLineF.angle() and
+        # QPainterPath.angleAtPercent() give it). The arrays have room to grow, only the
+        # first count rows are in use
+        self.count = 0
+        self.total = 0.0
+        self.current = None
+
+        self.starts = np.zeros((16, 2))
+        self.vectors = np.zeros((16, 2))
+        self.lengths = np.zeros(16)
+        self.offsets = np.zeros(16)
+        self.angles = np.zeros(16)
+
+        if path is not None:
+            # Jumps between subpaths (moveTo) do not count towards the length
+            for points in self.flatten(path):
+                self.move_to(points[0])
+                self.extend(points[1:])
+
+    def move_to(self, point):
+        self.current = self.coordinates(point)
+
+    def line_to(self, point):
+        # One segment at a time is what a stroke being drawn does on every mouse move, done
+        # without the overhead of building arrays
+        x, y = self.coordinates(point)
+
+        if self.current is None:
+            self.current = (x, y)
+            return
+
+        (start_x, start_y), self.current = self.current, (x, y)
+        dx, dy = x - start_x, y - start_y
+        length = math.hypot(dx, dy)
+
+        if length == 0:
+            return
+
+        self.reserve(self.count + 1)
+
+        self.starts[self.count] = start_x, start_y
+        self.vectors[self.count] = dx, dy
+        self.lengths[self.count] = length
+        self.offsets[self.count] = self.total
+        self.angles[self.count] = math.degrees(math.atan2(-dy, dx)) % 360
+
+        self.count += 1
+        self.total += length
+
+    def extend(self, points):
+        # Lines from the current point through each of points
+        if not isinstance(points, np.ndarray):
+            points = [self.coordinates(point) for point in points]
+
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+
+        if self.current is None:
+            if not len(points):
+                return
+
+            self.current, points = tuple(points[0]), points[1:]
+
+        points = np.concatenate(([self.current], points))
+        self.current = tuple(points[-1])
+
+        vectors = np.diff(points, axis=0)
+        lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+
+        # Zero length segments have no direction
+        keep = lengths > 0
+        starts, vectors, lengths = points[:-1][keep], vectors[keep], lengths[keep]
+
+        if not len(lengths):
+            return
+
+        self.reserve(self.count + len(lengths))
+
+        end = self.count + len(lengths)
+        self.starts[self.count:end] = starts
+        self.vectors[self.count:end] = vectors
+        self.lengths[self.count:end] = lengths
+        self.offsets[self.count:end] = self.total + np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+        self.angles[self.count:end] = np.degrees(np.arctan2(-vectors[:, 1], vectors[:, 0])) % 360
+
+        self.count = end
+        self.total = float(self.offsets[end - 1] + self.lengths[end - 1])
+
+    def reserve(self, count):
+        # Grows the arrays by doubling, so extending a stroke point by point stays cheap
+        if count <= len(self.lengths):
+            return
+
+        capacity = max(count, len(self.lengths) * 2)
+
+        for name in ('starts', 'vectors', 'lengths', 'offsets', 'angles'):
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:])
+            grown[:self.count] = array[:self.count]
+            setattr(self, name, grown)
+
+    @staticmethod
+    def coordinates(point):
+        if isinstance(point, (QPointF, QPoint)):
+            return float(point.x()), float(point.y())
+
+        return float(point[0]), float(point[1])
+
+    def length(self):
+        return self.total
+
+    def segment_at_length(self, lengths):
+        return np.clip(np.searchsorted(self.offsets[:self.count], lengths, side='right') - 1, 0, self.count - 1)
+
+    def point_at_length(self, lengths):
+        # An (n, 2) array of points for an array of lengths (or one point for a single
+        # length), distances past either end are clamped to it
+        lengths = np.asarray(lengths, dtype=float)
+
+        if not self.count:
+            return np.zeros(lengths.shape + (2,))
+
+        segments = self.segment_at_length(lengths)
+        t = np.clip((lengths - self.offsets[segments]) / self.lengths[segments], 0, 1)
+
+        return self.starts[segments] + self.vectors[segments] * t[..., np.newaxis]
+
+    def angle_at_length(self, lengths):
+        lengths = np.asarray(lengths, dtype=float)
+
+        if not self.count:
+            return np.zeros(lengths.shape)
+
+        return self.angles[self.segment_at_length(lengths)]
+
+    @classmethod
+    def flatten(cls, path: QPainterPath):
+        # An array of points for each subpath
+        subpaths, points = [], []
+        i = 0
+
+        while i < path.elementCount():
+            element = path.elementAt(i)
+
+            if element.type == QPainterPath.MoveToElement:
+                if len(points) > 1:
+                    subpaths.append(np.array(points))
+
+                points = [(element.x, element.y)]
+                i += 1
+
+            elif element.type == QPainterPath.LineToElement:
+                points.append((element.x, element.y))
+                i += 1
+
+            else:
+                # A curve is its two control points and end point, starting where the last
+                # element ended
+                controls = np.array([points[-1]] + [(path.elementAt(i + k).x, path.elementAt(i + k).y)
+                                                    for k in range(3)])
+                points.extend(map(tuple, cls.cubic(controls)[1:]))
+                i += 3
+
+        if len(points) > 1:
+            subpaths.append(np.array(points))
+
+        return subpaths
+
+    @classmethod
+    def cubic(cls, controls):
+        # Points along a cubic bezier, its control polygon bounds its length
+        hull = np.hypot(*np.diff(controls, axis=0).T).sum()
+        count = int(min(max(math.ceil(hull / cls.segment_length), 1), cls.max_curve_segments))
+        t = np.linspace(0, 1, count + 1)[:, np.newaxis]
+
+        return ((1 - t) ** 3 * controls[0] + 3 * (1 - t) ** 2 * t * controls[1]
+                + 3 * (1 - t) * t ** 2 * controls[2] + t ** 3 * controls[3])
@@ -0,0 +1,432 @@
+import argparse
+import fnmatch
+import glob
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.scripts.imports import *
+from src.framework.custom_classes import *
+from src.framework.container import MPFileReader, MPFileError
+from src.framework.serializer import MPDeserializer
+from src.framework.exporter import MPTiledExporter, MPPDFExporter, export_all_canvases, export_all_counts
+from src.framework.svg_writer import MPSVGWriter
+from src.framework.graphics_framework import CustomGraphicsScene
+
+# Headless rendering of MPRUN documents, used by `mprun render`
+#
+#   mprun render course.mp --format pdf --canvas "Run*" --output exports
+#
+#   mprun render runs/*.mp --output exports --jobs 4
+#
+# Several documents are spread over a pool of worker processes, documents whose outputs are
+# newer than the document itself are skipped.
+#
+# Exit codes, for scripts. With several documents any failure gives EXIT_RENDER_FAILED.
+EXIT_OK = 0
+EXIT_RENDER_FAILED = 1  # the document opened, but some canvases could not be written
+EXIT_USAGE = 2  # bad arguments (argparse uses the same code)
+EXIT_OPEN_FAILED = 3  # the document could not be read, or no documents were found
+EXIT_NO_CANVASES = 4  # no canvas matched the filter
+
+if getattr(sys, 'frozen', False):
+    os.chdir(sys._MEIPASS)
+
+
+class HeadlessWindow(QWidget):
+    # Stands in for the main window a scene expects as its parent, none of the toolbars or
+    # panels exist when rendering from the command line
+    def use_exit_add_canvas(self):
+        pass
+
+    def use_add_canvas(self):
+        pass
+
+    def update_transform_ui(self):
+        pass
+
+    def update_appearance_ui(self):
+        pass
+
+
+class MPCanvasRenderer:
+    # Renders the canvases of a scene straight to files, without the export dialogs
+    image_formats = ('png', 'jpg', 'jpeg', 'tiff', 'webp', 'bmp')
+    formats = image_formats + ('svg', 'pdf')
+
+    # Scene units are points, 72 per inch, so 72 DPI keeps one pixel per unit like the
+    # export dialogs do
+    default_dpi = 72
+
+    def __init__(self, scene, dpi=default_dpi, transparent=False):
+        self.scene = scene
+        self.dpi = dpi
+        self.transparent = transparent
+
+    @staticmethod
+    def open(filename):
+        # Builds a scene for the document without a main window
+        scene = CustomGraphicsScene(QUndoStack())
+        scene.setParentWindow(HeadlessWindow())
+
+        MPDeserializer(scene, interactive=False).deserialize_items(MPFileReader.load(filename))
+
+        return scene
+
+    def canvases(self):
+        # Every canvas, in the order the export all dialog numbers them
+        return export_all_canvases(self.scene)
+
+    @staticmethod
+    def matches(name, patterns):
+        # Shell style wildcards, no patterns at all matches every canvas
+        return not patterns or any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+    @staticmethod
+    def filenames(names, directory, pattern, format, document=''):
+        # Same naming as the export all dialog, <name>_<count> counts canvases sharing a name.
+        # names are every canvas of the document in export_all_canvases() order
+        filenames = []
+
+        for index, (tooltip, count) in enumerate(zip(names, export_all_counts(names)), 1):
+            name = pattern.format(name=tooltip.replace('/', '_').replace('\\', '_'),
+                                  count=count,
+                                  index=index,
+                                  document=document,
+                                  format=format)
+            filenames.append(os.path.join(directory, name))
+
+        return filenames
+
+    def render(self, canvas, filename, format=None):
+        # The format defaults to the file extension
+        format = (format or os.path.splitext(filename)[1][1:]).lower()
+
+        self.scene.clearSelection()
+
+        if self.transparent:
+            self.scene.setBackgroundBrush(QBrush(QColor(Qt.transparent)))
+            canvas.setTransparentMode()
+
+        if format == 'svg':
+            self.render_svg(canvas, filename)
+
+        elif format == 'pdf':
+            self.render_pdf(canvas, filename)
+
+        elif format in self.image_formats:
+            self.render_image(canvas, filename)
+
+        else:
+            raise ValueError(f'Unsupported format: {format}')
+
+    def render_image(self, canvas, filename):
+        rect = canvas.sceneBoundingRect()
+        scale = self.dpi / self.default_dpi
+
+        if filename.lower().endswith('.png'):
+            # Streamed in tiles, so memory stays bounded at any DPI
+            MPTiledExporter(self.scene, scale).export(canvas, filename, self.dpi)
+            return
+
+        image = QImage((rect.size() * scale).toSize(), QImage.Format_ARGB32)
+        image.fill(Qt.transparent)
+        image.setDotsPerMeterX(round(self.dpi / 0.0254))
+        image.setDotsPerMeterY(round(self.dpi / 0.0254))
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        self.scene.render(painter, target=QRectF(image.rect()), source=rect)
+        painter.end()
+
+        if not image.save(filename):
+            raise OSError(f'Could not write {filename}')
+
+    def render_svg(self, canvas, filename):
+        MPSVGWriter(self.scene).write(canvas, filename)
+
+    def render_pdf(self, canvas, filename):
+        # One page exactly the size of the canvas, in points
+        MPPDFExporter(self.scene).export([canvas], filename)
+
+
+class MPRenderJob:
+    # Renders one document, jobs are plain picklable objects so the batch farm can hand them
+    # to worker processes
+    def __init__(self, document, output, pattern, format, canvases=None, dpi=MPCanvasRenderer.default_dpi,
+                 transparent=False, force=False):
+        self.document = document
+        self.output = output
+        self.pattern = pattern
+        self.format = format
+        self.canvases = canvases
+        self.dpi = dpi
+        self.transparent = transparent
+        self.force = force
+
+    def document_name(self):
+        return os.path.splitext(os.path.basename(self.document))[0]
+
+    def filenames(self, names):
+        return MPCanvasRenderer.filenames(names, self.output, self.pattern, self.format, self.document_name())
+
+    def indexed_filenames(self):
+        # The files this document will produce, worked out from the canvas records alone so
+        # up to date documents are never loaded, None for documents older than the container
+        if not MPFileReader.isContainerFile(self.document):
+            return None
+
+        with MPFileReader(self.document, mapped=True, verify=False) as reader:
+            names = [canvas['name'] for canvas in reader.canvases()]
+
+        # Loading adds the canvases in index order and they share a z value, so the scene
+        # lists them last added first
+        names.reverse()
+
+        return [filename for name, filename in zip(names, self.filenames(names))
+                if MPCanvasRenderer.matches(name, self.canvases)]
+
+    def result(self, **values):
+        result = {
+            'document': self.document,
+            'code': EXIT_OK,
+            'outputs': [],
+            'errors': [],
+            'skipped': False,
+            'seconds': 0.0,
+        }
+        result.update(values)
+
+        return result
+
+    def isIndexedUpToDate(self):
+        # Failures are left for run() to report
+        try:
+            return self.isUpToDate(self.indexed_filenames())
+
+        except Exception:
+            return False
+
+    def isUpToDate(self, filenames):
+        if self.force or not filenames:
+            return False
+
+        modified = os.path.getmtime(self.document)
+
+        return all(os.path.exists(filename) and os.path.getmtime(filename) >= modified for filename in filenames)
+
+    def run(self):
+        # Never raises, everything that went wrong is reported in the result
+        start = time.perf_counter()
+        result = self.result()
+
+        try:
+            if self.isUpToDate(self.indexed_filenames()):
+                result['skipped'] = True
+
+            else:
+                self.render(result)
+
+        except Exception as e:
+            result['code'] = EXIT_OPEN_FAILED
+            result['errors'].append(f'could not open {self.document}: {e}')
+
+        result['seconds'] = time.perf_counter() - start
+
+        return result
+
+    def render(self, result):
+        renderer = MPCanvasRenderer(MPCanvasRenderer.open(self.document), self.dpi, self.transparent)
+        canvases = renderer.canvases()
+
+        # Every canvas counts towards the _<count> suffixes, also the ones filtered out
+        filenames = self.filenames([canvas.toolTip() for canvas in canvases])
+        selected = [(canvas, filename) for canvas, filename in zip(canvases, filenames)
+                    if MPCanvasRenderer.matches(canvas.toolTip(), self.canvases)]
+
+        if not selected:
+            result['code'] = EXIT_NO_CANVASES
+            result['errors'].append(f'no canvases to render in {self.document}')
+            return
+
+        canvases, filenames = [list(values) for values in zip(*selected)]
+
+        # Documents that had to be loaded to find their canvases are skipped here instead
+        if self.isUpToDate(filenames):
+            result['skipped'] = True
+            return
+
+        for canvas, filename in zip(canvases, filenames):
+            try:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                renderer.render(canvas, filename, self.format)
+                result['outputs'].append(filename)
+
+            except Exception as e:
+                result['code'] = EXIT_RENDER_FAILED
+                result['errors'].append(f'{canvas.toolTip()}: {e}')
+
+
+# The application of a render worker process
+render_app = None
+
+
+def start_render_worker(decode_threads):
+    # Every worker process owns its own offscreen application, QGraphicsScene needs the
+    # widgets flavour of it
+    global render_app
+
+    os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+    render_app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    # The processes already use every core, keep decoding from oversubscribing them
+    MPDeserializer.decode_threads = decode_threads
+
+
+def run_render_job(job: MPRenderJob):
+    return job.run()
+
+
+def render_pool_results(pool, jobs):
+    # Results in the order documents finish, a worker that died takes only its own document
+    # down with it
+    futures = {pool.submit(run_render_job, job): job for job in jobs}
+
+    for future in as_completed(futures):
+        try:
+            yield future.result()
+
+        except Exception as e:
+            yield futures[future].result(code=EXIT_RENDER_FAILED,
+                                         errors=[f'{futures[future].document}: render process failed: {e!r}'])
+
+
+def find_documents(paths):
+    # Files, directories (every .mp file inside) and glob patterns, for shells that do not
+    # expand them
+    documents = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            documents.extend(sorted(glob.glob(os.path.join(glob.escape(path), '*.mp'))))
+
+        elif os.path.isfile(path):
+            documents.append(path)
+
+        else:
+            documents.extend(sorted(filename for filename in glob.glob(path) if os.path.isfile(filename)))
+
+    # The same document listed twice would race with itself for its outputs
+    return list(dict.fromkeys(os.path.abspath(document) for document in documents))
+
+
+def render_main(argv=None, launch_directory=None):
+    parser = argparse.ArgumentParser(prog='mprun render',
+                                     description='Render the canvases of MPRUN documents to image, SVG or PDF '
+                                                 'files without opening the main window.')
+    parser.add_argument('documents', nargs='+', metavar='document',
+                        help='.mp documents to render, directories and glob patterns are expanded')
+    parser.add_argument('-f', '--format', default='png', choices=MPCanvasRenderer.formats,
+                        help='output format (default: png)')
+    parser.add_argument('-o', '--output', default='.', help='output directory (default: current directory)')
+    parser.add_argument('-p', '--pattern',
+                        help='output filename pattern, may use {name}, {count}, {index}, {document} and {format} '
+                             '(default: {name}_{count}.{format}, {document}/{name}_{count}.{format} for '
+                             'several documents)')
+    parser.add_argument('-c', '--canvas', action='append', metavar='NAME',
+                        help='only render canvases with this name, wildcards allowed, may be repeated')
+    parser.add_argument('-d', '--dpi', type=float, default=MPCanvasRenderer.default_dpi,
+                        help=f'resolution of bitmap output (default: {MPCanvasRenderer.default_dpi})')
+    parser.add_argument('-t', '--transparent', action='store_true', help='render without the canvas background')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='documents rendered in parallel, one process each (default: number of cores)')
+    parser.add_argument('--force', action='store_true', help='render documents whose outputs are up to date')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only report failures')
+    args = parser.parse_args(argv)
+
+    if args.dpi <= 0:
+        parser.error('--dpi must be positive')
+
+    if args.jobs <= 0:
+        parser.error('--jobs must be positive')
+
+    # Paths are relative to where the command was run, not to MPRUN's own directory
+    launch_directory = launch_directory or os.getcwd()
+    documents = find_documents([os.path.join(launch_directory, path) for path in args.documents])
+    output = os.path.join(launch_directory, args.output)
+
+    if not documents:
+        print('mprun render: no documents found', file=sys.stderr)
+        return EXIT_OPEN_FAILED
+
+    # Several documents get a folder each, canvases of different documents often share names
+    if args.pattern is None:
+        args.pattern = '{name}_{count}.{format}' if len(documents) == 1 else '{document}/{name}_{count}.{format}'
+
+    try:
+        args.pattern.format(name='', count=1, index=1, document='', format=args.format)
+
+    except (KeyError, IndexError, ValueError) as e:
+        parser.error(f'invalid --pattern: {e}')
+
+    jobs = [MPRenderJob(document, output, args.pattern, args.format, args.canvas, args.dpi, args.transparent,
+                        args.force) for document in documents]
+    start = time.perf_counter()
+
+    # Up to date documents are found from their index here, so they never cost a worker
+    pending = [job for job in jobs if args.force or not job.isIndexedUpToDate()]
+    results = [job.result(skipped=True) for job in jobs if job not in pending]
+    processes = max(1, min(args.jobs, len(pending)))
+
+    if processes == 1:
+        start_render_worker(MPDeserializer.decode_threads)
+        results = itertools.chain(results, map(run_render_job, pending))
+
+    else:
+        # Spawned rather than forked, a forked Qt process is not safe to use
+        pool = ProcessPoolExecutor(processes, multiprocessing.get_context('spawn'), start_render_worker,
+                                   (max(1, (os.cpu_count() or 1) // processes),))
+        results = itertools.chain(results, render_pool_results(pool, pending))
+
+    rendered = skipped = failed = 0
+
+    for result in results:
+        for error in result['errors']:
+            print(f'mprun render: {error}', file=sys.stderr)
+
+        if result['skipped']:
+            skipped += 1
+
+            if not args.quiet:
+                print(f'{result["document"]}: up to date')
+
+        else:
+            if result['code'] == EXIT_OK:
+                rendered += 1
+
+            else:
+                failed += 1
+
+            if not args.quiet:
+                for filename in result['outputs']:
+                    print(filename)
+
+                if len(jobs) > 1 and result['code'] == EXIT_OK:
+                    print(f'{result["document"]}: {len(result["outputs"])} canvases in {result["seconds"]:.2f} s')
+
+                elif len(jobs) > 1:
+                    print(f'{result["document"]}: failed after {result["seconds"]:.2f} s')
+
+    if processes > 1:
+        pool.shutdown()
+
+    if len(jobs) == 1:
+        return result['code']
+
+    if not args.quiet:
+        print(f'{rendered} rendered, {skipped} up to date, {failed} failed in {time.perf_counter() - start:.2f} s '
+              f'with {processes} {"process" if processes == 1 else "processes"}')
+
+    return EXIT_RENDER_FAILED if failed else EXIT_OK
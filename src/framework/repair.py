@@ -0,0 +1,916 @@
+import argparse
+import copy
+import glob
+import shutil
+import struct
+import zlib
+
+from src.scripts.imports import *
+from src.scripts.app_internal import copyright_message
+from src.framework.container import (MPFileReader, MPStreamWriter, MPFileError, LegacyUnpickler, HEADER,
+                                     FLAG_COMPRESSED, SECTION_META, SECTION_INDEX, SECTION_ITEMS,
+                                     SECTION_ASSETS, ASSET_ENTRY, JOURNAL_HEADER, PATH_ELEMENT_TYPES)
+
+# Repairs damaged MPRUN documents, used by File > Repair File and `mprun repair`
+#
+#   mprun repair course.mp
+#
+#   mprun repair runs/*.mp --check --report report.json
+#
+# Records are read, checked against the schema of their item type (what MPDeserializer
+# reads) and written to the repaired document one at a time, so only one record is ever in
+# memory besides the output being spooled to disk. A record that cannot be decoded is
+# dropped and the next one is read regardless, when the item index itself is damaged the
+# item section is scanned for records instead.
+#
+# Exit codes, for scripts. With several documents the highest code wins.
+EXIT_OK = 0  # the document had nothing to repair
+EXIT_REPAIRED = 1  # problems were found, and repaired unless --check was used
+EXIT_USAGE = 2  # bad arguments (argparse uses the same code)
+EXIT_OPEN_FAILED = 3  # nothing could be read from the document
+
+if getattr(sys, 'frozen', False):
+    os.chdir(sys._MEIPASS)
+
+
+class MPRepairError(Exception):
+    # A record (or group child) that cannot be repaired and has to be dropped
+    pass
+
+
+# Marks a field that has no sensible default, a record missing it is dropped
+REQUIRED = object()
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_boolean(value):
+    return isinstance(value, bool)
+
+
+def is_string(value):
+    return isinstance(value, str)
+
+
+def is_filename(value):
+    return value is None or isinstance(value, str)
+
+
+def is_asset_key(value):
+    return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def is_one_of(*values):
+    return lambda value: is_integer(value) and value in values
+
+
+def is_between(low, high):
+    return lambda value: is_integer(value) and low <= value <= high
+
+
+def is_rect(value):
+    # Canvas rects, x, y, width, height with a size to draw
+    return (isinstance(value, list) and len(value) == 4 and all(is_number(v) for v in value)
+            and value[2] > 0 and value[3] > 0)
+
+
+def is_bounds(value):
+    return isinstance(value, (list, tuple)) and len(value) == 4 and all(is_number(v) for v in value)
+
+
+def describe(value):
+    text = repr(value)
+    return text if len(text) <= 40 else f'{text[:37]}...'
+
+
+class Field:
+    def __init__(self, check, default=REQUIRED, optional=False):
+        # check is a function, or a Schema / ListOf / PathData for nested data. Optional
+        # fields may be missing, invalid ones without a default are removed
+        self.check = check
+        self.default = default
+        self.optional = optional
+
+
+class Schema:
+    def __init__(self, fields: dict, one_of=()):
+        # one_of: fields of which at least one has to be present (a path, say)
+        self.fields = fields
+        self.one_of = one_of
+
+    def repair(self, data, path, issues):
+        # Fixes data in place and returns it, issues gets (field, problem, action) tuples.
+        # Raises MPRepairError when a field without a default cannot be fixed
+        if not isinstance(data, dict):
+            raise MPRepairError(f'{path or "record"} is {describe(data)}, not an object')
+
+        for name, field in self.fields.items():
+            field_path = f'{path}.{name}' if path else name
+
+            if name not in data:
+                if field.optional:
+                    continue
+
+                value = self.default(field, field_path, 'missing', issues)
+
+            elif isinstance(field.check, (Schema, ListOf, PathData)):
+                try:
+                    value = field.check.repair(data[name], field_path, issues)
+
+                except MPRepairError as e:
+                    value = self.default(field, field_path, str(e), issues)
+
+            elif not field.check(data[name]):
+                value = self.default(field, field_path, f'invalid value {describe(data[name])}', issues)
+
+            else:
+                continue
+
+            if value is REQUIRED:
+                del data[name]
+
+            else:
+                data[name] = value
+
+        if self.one_of and not any(name in data for name in self.one_of):
+            raise MPRepairError(f'{path or "record"} has none of {", ".join(self.one_of)}')
+
+        return data
+
+    def default(self, field, path, problem, issues):
+        # The value to use instead, REQUIRED when an optional field should be removed
+        if field.default is not REQUIRED:
+            issues.append((path, problem, 'set to default'))
+            return copy.deepcopy(field.default)
+
+        if field.optional:
+            issues.append((path, problem, 'removed'))
+            return REQUIRED
+
+        raise MPRepairError(f'{path} is {problem}' if problem == 'missing' else f'{path}: {problem}')
+
+
+class ListOf:
+    # A list whose items all follow one schema, broken items are removed
+    def __init__(self, schema: Schema):
+        self.schema = schema
+
+    def repair(self, data, path, issues):
+        if not isinstance(data, list):
+            raise MPRepairError(f'{path} is {describe(data)}, not a list')
+
+        repaired = []
+        for i, value in enumerate(data):
+            try:
+                repaired.append(self.schema.repair(value, f'{path}[{i}]', issues))
+
+            except MPRepairError as e:
+                issues.append((f'{path}[{i}]', str(e), 'removed'))
+
+        return repaired
+
+
+class PathData:
+    # Packed paths (see MPSerializer.serialize_path). A damaged path is cut back to the
+    # elements before the damage, curves are only kept whole
+    def repair(self, data, path, issues):
+        if not isinstance(data, dict) or not isinstance(data.get('types'), (bytes, bytearray)) \
+                or not isinstance(data.get('coords'), (bytes, bytearray)):
+            raise MPRepairError(f'{path} is not a packed path')
+
+        types = np.frombuffer(data['types'], np.uint8)
+        coords = np.frombuffer(data['coords'][:len(data['coords']) // 16 * 16], '<f8').reshape(-1, 2)
+        count = min(len(types), len(coords))
+
+        # Element types are moveTo, lineTo, curveTo and the two control points after a curveTo
+        valid = (types[:count] <= 3) & np.isfinite(coords[:count]).all(axis=1)
+        end = count if valid.all() else int(np.argmin(valid))
+
+        curve_starts = np.flatnonzero(types[:end] == 2)
+        for start in curve_starts[::-1]:
+            if start + 3 > end or not (types[start + 1:start + 3] == 3).all():
+                end = int(start)
+
+        if end == 0:
+            raise MPRepairError(f'{path} has no intact elements')
+
+        if end != len(types) or end != len(coords) or len(data['coords']) % 16:
+            issues.append((path, f'damaged after element {end} of {len(types)}', 'cut back'))
+            data['types'] = types[:end].tobytes()
+            data['coords'] = coords[:end].tobytes()
+
+        if data.get('fillrule', 0) not in (0, 1):
+            issues.append((f'{path}.fillrule', f'invalid value {describe(data["fillrule"])}', 'set to default'))
+            data['fillrule'] = 0
+
+        return data
+
+
+# Defaults are what Qt gives a new pen, brush, font and so on
+COLOR = Schema({
+    'red': Field(is_between(0, 255), 0),
+    'green': Field(is_between(0, 255), 0),
+    'blue': Field(is_between(0, 255), 0),
+    'alpha': Field(is_between(0, 255), 255),
+})
+BLACK = {'red': 0, 'green': 0, 'blue': 0, 'alpha': 255}
+
+PEN = Schema({
+    'width': Field(is_between(0, 10000), 1),
+    'color': Field(COLOR, BLACK),
+    'style': Field(is_between(0, 6), 1),
+    'capstyle': Field(is_one_of(0x00, 0x10, 0x20), 0x10),
+    'joinstyle': Field(is_one_of(0x00, 0x40, 0x80, 0x100), 0x40),
+})
+DEFAULT_PEN = {'width': 1, 'color': BLACK, 'style': 1, 'capstyle': 0x10, 'joinstyle': 0x40}
+
+BRUSH = Schema({
+    'color': Field(COLOR, BLACK),
+    'style': Field(is_between(0, 24), 0),
+})
+DEFAULT_BRUSH = {'color': BLACK, 'style': 0}
+
+FONT = Schema({
+    'family': Field(is_string, 'Arial'),
+    'pointsize': Field(is_integer, 20),
+    'letterspacing': Field(is_number, 0),
+    'bold': Field(is_boolean, False),
+    'italic': Field(is_boolean, False),
+    'underline': Field(is_boolean, False),
+})
+DEFAULT_FONT = {'family': 'Arial', 'pointsize': 20, 'letterspacing': 0, 'bold': False, 'italic': False,
+                'underline': False}
+
+TRANSFORM = Schema({name: Field(is_number, 1.0 if name in ('m11', 'm22', 'm33') else 0.0)
+                    for name in ('m11', 'm12', 'm13', 'm21', 'm22', 'm23', 'm31', 'm32', 'm33')})
+IDENTITY = {name: 1.0 if name in ('m11', 'm22', 'm33') else 0.0
+            for name in ('m11', 'm12', 'm13', 'm21', 'm22', 'm23', 'm31', 'm32', 'm33')}
+
+POINT = Schema({'x': Field(is_number, 0.0), 'y': Field(is_number, 0.0)})
+ORIGIN = {'x': 0.0, 'y': 0.0}
+
+ATTRIBUTES = Schema({
+    'rotation': Field(is_number, 0.0),
+    'transform': Field(TRANSFORM, IDENTITY),
+    'scale': Field(is_number, 1.0),
+    'transformorigin': Field(POINT, ORIGIN),
+    'x': Field(is_number, 0.0),
+    'y': Field(is_number, 0.0),
+    'name': Field(is_string, ''),
+    'zval': Field(is_number, 0.0),
+    'visible': Field(is_boolean, True),
+})
+DEFAULT_ATTRIBUTES = [{'rotation': 0.0, 'transform': IDENTITY, 'scale': 1.0, 'transformorigin': ORIGIN, 'x': 0.0,
+                       'y': 0.0, 'name': '', 'zval': 0.0, 'visible': True}]
+
+PATH_ELEMENT = Schema({
+    'type': Field(lambda value: value in PATH_ELEMENT_TYPES),
+    'x': Field(is_number),
+    'y': Field(is_number),
+})
+
+COMMON_FIELDS = {
+    'attr': Field(ListOf(ATTRIBUTES), DEFAULT_ATTRIBUTES),
+    'bounds': Field(is_bounds, optional=True),
+}
+
+PATH_FIELDS = {
+    'pen': Field(PEN, DEFAULT_PEN),
+    'brush': Field(BRUSH, DEFAULT_BRUSH),
+    'path': Field(PathData(), optional=True),
+    'elements': Field(ListOf(PATH_ELEMENT), optional=True),
+}
+
+# One schema per item type, matching what MPDeserializer reads
+SCHEMAS = {
+    'CanvasItem': Schema({
+        'rect': Field(is_rect),
+        'name': Field(is_string, 'Canvas'),
+        'x': Field(is_number, 0.0),
+        'y': Field(is_number, 0.0),
+        'bounds': Field(is_bounds, optional=True),
+    }),
+    'CustomTextItem': Schema({
+        **COMMON_FIELDS,
+        'markdown': Field(is_boolean, optional=True),
+        'text': Field(is_string),
+        'font': Field(FONT, DEFAULT_FONT),
+        'color': Field(COLOR, BLACK),
+        'locked': Field(is_boolean, False),
+    }),
+    'CustomPathItem': Schema({
+        **COMMON_FIELDS,
+        **PATH_FIELDS,
+        'smooth': Field(is_boolean, optional=True),
+    }, one_of=('path', 'elements')),
+    'CustomGraphicsItemGroup': Schema({
+        **COMMON_FIELDS,
+    }),
+    'LeaderLineItem': Schema({
+        **COMMON_FIELDS,
+        **PATH_FIELDS,
+        'text': Field(is_string, ''),
+        'textcolor': Field(COLOR, BLACK),
+        'textfont': Field(FONT, DEFAULT_FONT),
+        'textposx': Field(is_number, 0.0),
+        'textposy': Field(is_number, 0.0),
+        'textzval': Field(is_number, 0.0),
+        'texttransform': Field(TRANSFORM, IDENTITY),
+        'textscale': Field(is_number, 1.0),
+        'texttransformorigin': Field(POINT, ORIGIN),
+        'textrotation': Field(is_number, 0.0),
+        'textvisible': Field(is_boolean, True),
+    }, one_of=('path', 'elements')),
+    'CustomSvgItem': Schema({
+        **COMMON_FIELDS,
+        'filename': Field(is_filename, None),
+        'asset': Field(is_asset_key, optional=True),
+        'raw_svg_data': Field(is_string, optional=True),
+    }),
+    'CustomPixmapItem': Schema({
+        **COMMON_FIELDS,
+        'filename': Field(is_filename, None),
+        'asset': Field(is_asset_key, optional=True),
+        'data': Field(lambda value: isinstance(value, (bytes, bytearray)), optional=True),
+    }),
+}
+
+# Item types MPDeserializer can put in a group
+CHILD_TYPES = ('CustomTextItem', 'CustomPathItem', 'CustomSvgItem', 'CustomPixmapItem')
+
+# Group children are saved with their attributes flattened into the child, which
+# MPDeserializer does not read
+CHILD_ATTRIBUTES = ('rotation', 'transform', 'scale', 'transformorigin', 'x', 'y', 'name', 'zval', 'visible')
+
+
+class MPRepairReport:
+    # What a repair found and did. Records are identified by their uid when the item index
+    # could be read, and by their file offset when the document had to be scanned
+    def __init__(self, filename):
+        self.filename = filename
+        self.output = None
+        self.mode = None  # 'index', 'scan' or 'legacy'
+        self.records = 0
+        self.kept = 0
+        self.repaired = 0
+        self.dropped = 0
+        self.issues = []
+        self.errors = []
+        self.written = False
+        self.cancelled = False
+        self.failed = None
+        self.seconds = 0.0
+
+    def add(self, location, item_type, field, problem, action):
+        self.issues.append({
+            'record': location,
+            'type': item_type,
+            'field': field,
+            'problem': problem,
+            'action': action,
+        })
+
+    def error(self, message):
+        # Problems with the document itself rather than one record
+        self.errors.append(message)
+
+    def hasProblems(self):
+        return bool(self.issues or self.errors or self.dropped)
+
+    def code(self):
+        if self.failed is not None:
+            return EXIT_OPEN_FAILED
+
+        return EXIT_REPAIRED if self.hasProblems() else EXIT_OK
+
+    def toDict(self):
+        return {
+            'filename': self.filename,
+            'output': self.output,
+            'mode': self.mode,
+            'records': self.records,
+            'kept': self.kept,
+            'repaired': self.repaired,
+            'dropped': self.dropped,
+            'written': self.written,
+            'cancelled': self.cancelled,
+            'failed': self.failed,
+            'seconds': round(self.seconds, 3),
+            'errors': self.errors,
+            'issues': self.issues,
+        }
+
+    def summary(self):
+        name = os.path.basename(self.filename)
+
+        if self.failed is not None:
+            return f'{name} could not be repaired: {self.failed}'
+
+        if self.cancelled:
+            return f'Repairing {name} was cancelled, the document was not changed.'
+
+        if not self.hasProblems():
+            return f'{name} is intact, all {self.records} items passed the checks.'
+
+        summary = (f'{name}: {self.records} items read, {self.kept} kept ({self.repaired} repaired), '
+                   f'{self.dropped} dropped.')
+
+        if self.written:
+            summary += f' The repaired document was saved to {self.output}.'
+
+        return summary
+
+    def details(self):
+        lines = [f'Document: {error}' for error in self.errors]
+
+        for issue in self.issues:
+            item = f'{issue["type"] or "Unknown item"} ({issue["record"]})'
+            field = f'{issue["field"]}: ' if issue['field'] else ''
+            lines.append(f'{item}: {field}{issue["problem"]}, {issue["action"]}')
+
+        return '\n'.join(lines)
+
+
+class MPRepairEngine:
+    # Streams a document through the item schemas into a repaired copy. The repaired copy
+    # replaces the document (which is kept as <document>.bak) unless an output is given,
+    # and nothing is written when there was nothing to repair or check_only is set
+    def __init__(self, filename, output=None, backup=True, check_only=False):
+        self.filename = filename
+        self.output = output or filename
+        self.backup = backup
+        self.check_only = check_only
+
+        self.report = MPRepairReport(filename)
+        self.reader = None
+        self.writer = None
+        self.assets = {}
+        self.asset_status = {}
+        self.counts = {}
+
+    def run(self, progress=None):
+        # progress(done, total) is called after every record and can return False to
+        # cancel, returns the MPRepairReport
+        start = time.perf_counter()
+
+        try:
+            if MPFileReader.isContainerFile(self.filename):
+                self.repair_container(progress)
+
+            else:
+                self.repair_legacy(progress)
+
+        except (OSError, MPFileError, pickle.UnpicklingError, EOFError, ValueError, TypeError, struct.error) as e:
+            self.report.failed = str(e) or type(e).__name__
+            self.discard()
+
+        finally:
+            self.close_reader()
+            self.report.seconds = time.perf_counter() - start
+
+        return self.report
+
+    def repair_container(self, progress):
+        self.reader = MPFileReader(self.filename, mapped=True, verify=False)
+
+        try:
+            self.reader.open()
+            table_intact = True
+
+        except struct.error as e:
+            # The section table is gone, everything after the header gets scanned
+            if self.reader.data is None or self.reader.version is None:
+                raise MPFileError(f'{os.path.basename(self.filename)} has no readable header') from e
+
+            self.report.error(f'The section table is damaged ({e})')
+            self.reader.sections = {}
+            self.reader.journals = []
+            table_intact = False
+
+        if self.reader.flags & FLAG_COMPRESSED:
+            raise MPFileError('Recovery snapshots are compressed and cannot be repaired, restore them instead')
+
+        self.start_writer(self.read_metadata())
+        self.read_assets()
+
+        entries = self.read_index() if table_intact else None
+
+        if entries is not None:
+            self.report.mode = 'index'
+            self.repair_records(self.indexed_records(entries), len(entries), progress)
+
+        else:
+            self.report.mode = 'scan'
+
+            if SECTION_ITEMS in self.reader.sections:
+                offset, length, crc = self.reader.sections[SECTION_ITEMS]
+                start, end, strict = offset, min(offset + length, len(self.reader.data)), True
+
+            else:
+                start, end, strict = HEADER.size, len(self.reader.data), False
+
+            self.repair_records(self.scanned_records(start, end, strict), end - start, progress)
+
+        self.finish()
+
+    def repair_legacy(self, progress):
+        # Pickled documents can only be read whole, they are converted to the container
+        # format on the way
+        self.report.mode = 'legacy'
+
+        try:
+            with open(self.filename, 'rb') as f:
+                items_data = LegacyUnpickler(f).load()
+
+        except (pickle.UnpicklingError, EOFError, ValueError, TypeError, IndexError) as e:
+            raise MPFileError(f'{os.path.basename(self.filename)} is not an MPRUN document ({e})')
+
+        if not isinstance(items_data, list) or not items_data:
+            raise MPFileError(f'{os.path.basename(self.filename)} holds no MPRUN items')
+
+        metadata = items_data.pop(0)
+
+        if not isinstance(metadata, dict) or 'mpversion' not in metadata:
+            self.report.error('The document metadata is missing')
+            items_data.insert(0, metadata)
+            metadata = self.default_metadata()
+
+        self.assets = metadata.get('assets', {}) if isinstance(metadata.get('assets'), dict) else {}
+        self.start_writer(metadata)
+
+        records = ((f'item {i}', i + 1, record, None) for i, record in enumerate(items_data))
+        self.repair_records(records, len(items_data), progress)
+        self.finish()
+
+    def default_metadata(self):
+        return {'mpversion': 'unknown', 'copyright': copyright_message, 'item_count': 0}
+
+    def start_writer(self, metadata):
+        if not self.check_only:
+            self.writer = MPStreamWriter(self.output, metadata)
+
+    def read_metadata(self):
+        try:
+            if not self.intact(SECTION_META):
+                raise MPFileError('checksum mismatch')
+
+            metadata = self.reader.metadata()
+
+            if not isinstance(metadata, dict):
+                raise MPFileError('not an object')
+
+            return metadata
+
+        except (MPFileError, ValueError, struct.error) as e:
+            self.report.error(f'The document metadata is damaged ({e}), it was reset')
+            return self.default_metadata()
+
+    def read_assets(self):
+        # Assets are located, not read, each one is checked and copied once a record uses it
+        tables = []
+
+        if SECTION_ASSETS in self.reader.sections:
+            offset, length, crc = self.reader.sections[SECTION_ASSETS]
+            tables.append((offset, length))
+
+        # Damaged journals are reported and skipped by read_index
+        for offset, length, crc in self.reader.journals:
+            if zlib.crc32(self.reader.data[offset:offset + length]) == crc:
+                entry_count, assets_offset = JOURNAL_HEADER.unpack_from(self.reader.data, offset)
+                tables.append((offset + assets_offset, length - assets_offset))
+
+        for start, length in tables:
+            try:
+                count = struct.unpack_from('<I', self.reader.data, start)[0]
+
+                for i in range(count):
+                    digest, offset, size = ASSET_ENTRY.unpack_from(self.reader.data, start + 4 + i * ASSET_ENTRY.size)
+
+                    if offset + size <= length:
+                        self.assets[digest.hex()] = self.reader.data[start + offset:start + offset + size]
+
+            except struct.error as e:
+                self.report.error(f'An asset table is damaged ({e}), its assets are restored from their files '
+                                  f'where possible')
+
+    def read_index(self):
+        # The item index with every intact journal replayed, or None when the index is too
+        # damaged to use and the item section has to be scanned
+        try:
+            if not self.intact(SECTION_INDEX):
+                raise MPFileError('checksum mismatch')
+
+            entries = self.reader.base_index()
+
+        except (MPFileError, IndexError, struct.error) as e:
+            self.report.error(f'The item index is damaged ({e}), the items were recovered by scanning the '
+                              f'document')
+
+            if self.reader.journals:
+                self.report.error('Changes saved incrementally since the last full save could not be recovered')
+
+            return None
+
+        if not self.intact(SECTION_ITEMS):
+            self.report.error('The item section checksum does not match, every item was checked separately')
+
+        for number, (offset, length, crc) in enumerate(self.reader.journals):
+            try:
+                if zlib.crc32(self.reader.data[offset:offset + length]) != crc:
+                    raise MPFileError('checksum mismatch')
+
+                self.reader.replay_journal(number, entries)
+
+            except (MPFileError, IndexError, struct.error) as e:
+                self.report.error(f'Incremental save {number + 1} is damaged ({e}), its changes were skipped')
+
+        return list(entries.values())
+
+    def intact(self, tag):
+        if tag not in self.reader.sections:
+            raise MPFileError(f'section {tag.decode()} is missing')
+
+        offset, length, crc = self.reader.sections[tag]
+
+        return zlib.crc32(self.reader.data[offset:offset + length]) == crc
+
+    def indexed_records(self, entries):
+        for done, entry in enumerate(entries, 1):
+            location = f'uid {entry["uid"]}'
+
+            try:
+                record = self.reader.read_record(entry)
+
+                # Bounds live in the index, not the record
+                if entry['bounds'] is not None:
+                    record['bounds'] = list(entry['bounds'])
+
+                yield location, done, record, None
+
+            except (MPFileError, ValueError, TypeError, KeyError, IndexError, struct.error) as e:
+                yield location, done, None, e
+
+    def scanned_records(self, start, end, strict):
+        # Progress is counted in bytes here
+        for offset, record, error in self.reader.scan(start, end, strict):
+            yield f'offset {offset}', offset - start, record, error
+
+    def repair_records(self, records, total, progress):
+        # records yields (location, done, record, error), a record that could not be decoded
+        # comes with the error instead
+        for location, done, record, error in records:
+            self.report.records += 1
+
+            if error is not None:
+                self.report.dropped += 1
+                self.report.add(location, None, '', f'could not be decoded ({error})', 'dropped')
+
+            else:
+                item_type = record.get('type') if isinstance(record, dict) else None
+                issues = []
+
+                try:
+                    record = self.repair_record(record, issues)
+
+                except MPRepairError as e:
+                    record = None
+                    issues.append(('', str(e), 'dropped'))
+
+                for field, problem, action in issues:
+                    self.report.add(location, item_type, field, problem, action)
+
+                if record is None:
+                    self.report.dropped += 1
+
+                else:
+                    self.report.kept += 1
+                    self.report.repaired += 1 if issues else 0
+                    self.counts[item_type] = self.counts.get(item_type, 0) + 1
+
+                    if self.writer is not None:
+                        self.writer.add(record)
+
+            if progress is not None and progress(min(done, total), total) is False:
+                self.report.cancelled = True
+                return
+
+    def repair_record(self, record, issues):
+        item_type = record.get('type') if isinstance(record, dict) else None
+
+        if item_type not in SCHEMAS:
+            raise MPRepairError(f'unknown item type {describe(item_type)}')
+
+        if item_type == 'CustomGraphicsItemGroup':
+            self.repair_children(record, issues)
+
+        SCHEMAS[item_type].repair(record, '', issues)
+
+        if item_type in ('CustomSvgItem', 'CustomPixmapItem'):
+            self.repair_asset(record, '', issues)
+
+        return record
+
+    def repair_children(self, record, issues):
+        children = record.get('children')
+
+        if not isinstance(children, list):
+            raise MPRepairError('the group has no children')
+
+        repaired = []
+        for i, child in enumerate(children):
+            path = f'children[{i}]'
+
+            try:
+                child_type = child.get('type') if isinstance(child, dict) else None
+
+                if child_type not in CHILD_TYPES:
+                    raise MPRepairError(f'unknown item type {describe(child_type)}')
+
+                if 'attr' not in child:
+                    attributes = copy.deepcopy(DEFAULT_ATTRIBUTES[0])
+                    attributes.update({name: child.pop(name) for name in CHILD_ATTRIBUTES if name in child})
+                    child['attr'] = [attributes]
+                    issues.append((f'{path}.attr', 'saved flattened into the child', 'rebuilt from its fields'))
+
+                SCHEMAS[child_type].repair(child, path, issues)
+
+                if child_type in ('CustomSvgItem', 'CustomPixmapItem'):
+                    self.repair_asset(child, path, issues)
+
+                repaired.append(child)
+
+            except MPRepairError as e:
+                issues.append((path, str(e), 'removed'))
+
+        if not repaired:
+            raise MPRepairError('the group has no intact children')
+
+        record['children'] = repaired
+
+    def repair_asset(self, record, path, issues):
+        # SVGs and images need their data, either an intact asset or inline data. When both
+        # are gone the file the item was created from is read again if it still exists
+        svg = record['type'] == 'CustomSvgItem'
+        field = 'raw_svg_data' if svg else 'data'
+        prefix = f'{path}.' if path else ''
+
+        if 'asset' in record:
+            if self.hasAsset(record['asset']):
+                self.keep_asset(record['asset'])
+                return
+
+            problem = f'asset {record.pop("asset")[:12]} is missing or damaged'
+
+        elif record.get(field):
+            return
+
+        else:
+            problem = 'the SVG data is missing' if svg else 'the image data is missing'
+
+        filename = record.get('filename')
+
+        if filename and os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                data = f.read()
+
+            if svg:
+                try:
+                    data.decode('utf-8')
+
+                except UnicodeDecodeError:
+                    raise MPRepairError(f'{problem} and {filename} is not an SVG')
+
+            record.pop(field, None)
+            record['asset'] = self.store_asset(data)
+            issues.append((f'{prefix}asset', problem, f'restored from {filename}'))
+            return
+
+        raise MPRepairError(problem)
+
+    def hasAsset(self, key):
+        # Assets are content addressed, one whose hash does not match its key is damaged
+        if key not in self.asset_status:
+            data = self.assets.get(key)
+            self.asset_status[key] = data is not None and hashlib.sha256(data).hexdigest() == key
+
+        return self.asset_status[key]
+
+    def keep_asset(self, key):
+        if self.writer is not None:
+            self.writer.add_asset(key, bytes(self.assets[key]))
+
+    def store_asset(self, data):
+        key = hashlib.sha256(data).hexdigest()
+
+        if self.writer is not None:
+            self.writer.add_asset(key, data)
+
+        return key
+
+    def finish(self):
+        preview = self.read_preview()
+
+        # The reader has to let go of the document before it can be replaced
+        self.close_reader()
+
+        if self.writer is None or self.report.cancelled or not self.report.hasProblems():
+            self.discard()
+            return
+
+        if self.backup and os.path.abspath(self.output) == os.path.abspath(self.filename):
+            shutil.copy2(self.filename, f'{self.filename}.bak')
+
+        self.writer.close(preview)
+        self.writer = None
+        self.report.output = self.output
+        self.report.written = True
+
+    def read_preview(self):
+        # The old thumbnail is kept, with the counts of what survived the repair
+        if self.reader is None or self.report.mode == 'legacy':
+            return None
+
+        try:
+            preview = self.reader.preview()
+
+        except (ValueError, struct.error):
+            preview = None
+
+        if preview is None:
+            return None
+
+        thumbnail = preview.pop('thumbnail')
+        preview['canvas_count'] = self.counts.get('CanvasItem', 0)
+        preview['item_count'] = self.report.kept
+
+        return preview, thumbnail
+
+    def close_reader(self):
+        for data in self.assets.values():
+            if isinstance(data, memoryview):
+                data.release()
+
+        self.assets = {}
+
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.discard()
+            self.writer = None
+
+
+def repair_main(argv=None, launch_directory=None):
+    parser = argparse.ArgumentParser(prog='mprun repair',
+                                     description='Check MPRUN documents and repair the damaged ones without opening '
+                                                 'the main window.')
+    parser.add_argument('documents', nargs='+', metavar='document', help='.mp documents to repair, glob patterns are expanded')
+    parser.add_argument('-o', '--output', help='write the repaired document here instead of replacing it '
+                                               '(one document only)')
+    parser.add_argument('--check', action='store_true', help='only report problems, change nothing')
+    parser.add_argument('--no-backup', action='store_true',
+                        help='do not keep the damaged document as <document>.bak')
+    parser.add_argument('-r', '--report', help='write the repair reports to this JSON file')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print the summaries')
+    args = parser.parse_args(argv)
+
+    if args.output and (len(args.documents) > 1 or glob.has_magic(args.documents[0])):
+        parser.error('--output can only be used with one document')
+
+    # Paths are relative to where the command was run, not to MPRUN's own directory
+    launch_directory = launch_directory or os.getcwd()
+    output = os.path.join(launch_directory, args.output) if args.output else None
+    reports = []
+
+    # Glob patterns are expanded for shells that do not do it themselves
+    documents = []
+    for document in args.documents:
+        path = os.path.join(launch_directory, document)
+        documents.extend(sorted(glob.glob(path)) if glob.has_magic(path) else [path])
+
+    if not documents:
+        print('mprun repair: no documents found', file=sys.stderr)
+        return EXIT_OPEN_FAILED
+
+    for document in documents:
+        report = MPRepairEngine(document, output, not args.no_backup, args.check).run()
+        reports.append(report)
+
+        print(report.summary(), file=sys.stderr if report.failed else sys.stdout)
+
+        if not args.quiet and report.details():
+            print(report.details())
+
+    if args.report:
+        with open(os.path.join(launch_directory, args.report), 'w') as f:
+            json.dump([report.toDict() for report in reports], f, indent=4)
+
+    return max(report.code() for report in reports)
@@ -1,132 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from src.scripts.imports import *
 from src.framework.custom_classes import *
 from src.scripts.app_internal import copyright_message
+from src.framework.container import MPFileReader, MPFileWriter
+from src.framework.repair import MPRepairEngine
+
+# One QPainterPath element as QDataStream writes it: element type, x, y (big-endian)
+PATH_STREAM_ELEMENT = np.dtype([('type', '>i4'), ('x', '>f8'), ('y', '>f8')])
+
+
+def decode_pixmap_asset(data: bytes):
+    # QPixmap is GUI thread only, workers decode into a QImage
+    return QImage.fromData(data)
 
 
 class MPSerializer:
     def __init__(self, scene):
         self.scene = scene
 
+        # Content addressed assets, every unique SVG or image is stored once per document
+        self.assets = {}
+        self.file_assets = {}
+        self.pixmap_assets = {}
+
+        # The items behind each record of the last serialize_items call, in order
+        self.serialized_items = []
+
+    def reset_assets(self):
+        self.assets = {}
+        self.file_assets = {}
+        self.pixmap_assets = {}
+
     def serialize_items(self):
         items_data = []
 
+        self.reset_assets()
+        self.serialized_items = []
+
         items_data.append({
             'mpversion': self.scene.mpversion,
             'copyright': copyright_message,
             'item_count': len(self.scene.items()),
+            'assets': self.assets,
         })
 
         for item in self.scene.items():
-            if isinstance(item, CanvasItem):
-                items_data.append(self.serialize_canvas(item))
-
-            elif isinstance(item, CustomTextItem):
-                if item.parentItem():
-                    pass
-
-                else:
-                    items_data.append({
-                        'type': 'CustomTextItem',
-                        'markdown': True if item.markdownEnabled else False,
-                        'text': item.old_text if item.markdownEnabled else item.toPlainText(),
-                        'font': self.serialize_font(item.font()),
-                        'color': self.serialize_color(item.defaultTextColor()),
-                        'attr': self.serialize_item_attributes(item),
-                        'locked': True if item.markdownEnabled else False,
-                    })
+            data = self.serialize_item(item)
 
-            elif isinstance(item, CustomPathItem):
-                if item.parentItem():
-                    pass
-
-                else:
-                    path_data = {
-                        'type': 'CustomPathItem',
-                        'pen': self.serialize_pen(item.pen()),
-                        'brush': self.serialize_brush(item.brush()),
-                        'attr': self.serialize_item_attributes(item),
-                        'elements': self.serialize_path(item.path()),
-                        'smooth': True if item.smooth else False,
-                    }
-
-                    items_data.append(path_data)
-
-            elif isinstance(item, CustomGraphicsItemGroup):
-                if item.parentItem():
-                    pass
-
-                else:
-                    items_data.append({
-                        'type': 'CustomGraphicsItemGroup',
-                        'attr': self.serialize_item_attributes(item),
-                        'children': self.serialize_group(item)
-                    })
-
-            elif isinstance(item, LeaderLineItem):
-                if item.parentItem():
-                    pass
-
-                else:
-                    data = {
-                        'type': 'LeaderLineItem',
-                        'pen': self.serialize_pen(item.pen()),
-                        'brush': self.serialize_brush(item.brush()),
-                        'attr': self.serialize_item_attributes(item),
-                        'elements': self.serialize_path(item.path()),
-                        'text': item.text_element.toPlainText(),
-                        'textcolor': self.serialize_color(item.text_element.defaultTextColor()),
-                        'textfont': self.serialize_font(item.text_element.font()),
-                        'textposx': item.text_element.pos().x(),
-                        'textposy': item.text_element.pos().y(),
-                        'textzval': item.text_element.zValue(),
-                        'texttransform': self.serialize_transform(item.text_element.transform()),
-                        'textscale': item.text_element.scale(),
-                        'texttransformorigin': self.serialize_point(item.transformOriginPoint()),
-                        'textrotation': item.text_element.rotation(),
-                        'textvisible': item.text_element.isVisible(),
-                    }
-
-                    items_data.append(data)
-
-            elif isinstance(item, CustomSvgItem):
-                if item.parentItem():
-                    pass
-
-                else:
-                    data = {
-                        'type': 'CustomSvgItem',
-                        'attr': self.serialize_item_attributes(item),
-                        'filename': item.source() if
-                        os.path.exists(item.source() if item.source() is not None else '') else None,
-                        'raw_svg_data': self.serialize_file(item.source()) if
-                        os.path.exists(item.source() if item.source() is not None else '') else item.svgData(),
-                    }
-
-                    items_data.append(data)
-
-            elif isinstance(item, CustomPixmapItem):
-                if item.parentItem():
-                    pass
-
-                else:
-                    pixmap = item.pixmap()
-                    buffer = QBuffer()
-                    buffer.open(QIODevice.WriteOnly)
-                    pixmap.save(buffer, "PNG")
-                    pixmap_data = buffer.data().data()
-
-                    data = {
-                        'type': 'CustomPixmapItem',
-                        'attr': self.serialize_item_attributes(item),
-                        'filename': item.return_filename() if
-                        os.path.exists(item.return_filename() if item.return_filename() is not None else '') else None,
-                        'data': pixmap_data,
-                    }
-
-                    items_data.append(data)
+            if data is not None:
+                items_data.append(data)
+                self.serialized_items.append(item)
 
         return items_data
 
+    def serialize_item(self, item):
+        data = None
+
+        if isinstance(item, CanvasItem):
+            data = self.serialize_canvas(item)
+
+        elif isinstance(item, CustomTextItem):
+            if item.parentItem():
+                pass
+
+            else:
+                data = {
+                    'type': 'CustomTextItem',
+                    'markdown': True if item.markdownEnabled else False,
+                    'text': item.old_text if item.markdownEnabled else item.toPlainText(),
+                    'font': self.serialize_font(item.font()),
+                    'color': self.serialize_color(item.defaultTextColor()),
+                    'attr': self.serialize_item_attributes(item),
+                    'locked': True if item.markdownEnabled else False,
+                }
+
+        elif isinstance(item, CustomPathItem):
+            if item.parentItem():
+                pass
+
+            else:
+                data = {
+                    'type': 'CustomPathItem',
+                    'pen': self.serialize_pen(item.pen()),
+                    'brush': self.serialize_brush(item.brush()),
+                    'attr': self.serialize_item_attributes(item),
+                    'path': self.serialize_path(item.path()),
+                    'smooth': True if item.smooth else False,
+                }
+
+        elif isinstance(item, CustomGraphicsItemGroup):
+            if item.parentItem():
+                pass
+
+            else:
+                data = {
+                    'type': 'CustomGraphicsItemGroup',
+                    'attr': self.serialize_item_attributes(item),
+                    'children': self.serialize_group(item)
+                }
+
+        elif isinstance(item, LeaderLineItem):
+            if item.parentItem():
+                pass
+
+            else:
+                data = {
+                    'type': 'LeaderLineItem',
+                    'pen': self.serialize_pen(item.pen()),
+                    'brush': self.serialize_brush(item.brush()),
+                    'attr': self.serialize_item_attributes(item),
+                    'path': self.serialize_path(item.path()),
+                    'text': item.text_element.toPlainText(),
+                    'textcolor': self.serialize_color(item.text_element.defaultTextColor()),
+                    'textfont': self.serialize_font(item.text_element.font()),
+                    'textposx': item.text_element.pos().x(),
+                    'textposy': item.text_element.pos().y(),
+                    'textzval': item.text_element.zValue(),
+                    'texttransform': self.serialize_transform(item.text_element.transform()),
+                    'textscale': item.text_element.scale(),
+                    'texttransformorigin': self.serialize_point(item.transformOriginPoint()),
+                    'textrotation': item.text_element.rotation(),
+                    'textvisible': item.text_element.isVisible(),
+                }
+
+        elif isinstance(item, CustomSvgItem):
+            if item.parentItem():
+                pass
+
+            else:
+                data = {
+                    'type': 'CustomSvgItem',
+                    'attr': self.serialize_item_attributes(item),
+                    'filename': item.source() if
+                    os.path.exists(item.source() if item.source() is not None else '') else None,
+                    'asset': self.serialize_svg_asset(item),
+                }
+
+        elif isinstance(item, CustomPixmapItem):
+            if item.parentItem():
+                pass
+
+            else:
+                data = {
+                    'type': 'CustomPixmapItem',
+                    'attr': self.serialize_item_attributes(item),
+                    'filename': item.return_filename() if
+                    os.path.exists(item.return_filename() if item.return_filename() is not None else '') else None,
+                    'asset': self.serialize_pixmap_asset(item),
+                }
+
+        # Scene bounds go into the item index so a document can be loaded viewport first
+        if data is not None:
+            data['bounds'] = self.serialize_bounds(item)
+
+        return data
+
+    def serialize_bounds(self, item):
+        rect = item.sceneBoundingRect().united(item.mapRectToScene(item.childrenBoundingRect()))
+        return [rect.x(), rect.y(), rect.width(), rect.height()]
+
     def serialize_item_attributes(self, item):
         return [{
             'rotation': item.rotation(),
@@ -199,16 +232,23 @@ class MPSerializer:
         }
 
     def serialize_path(self, path: QPainterPath):
-        elements = []
-        for i in range(path.elementCount()):
-            element = path.elementAt(i)
-            if element.isMoveTo():
-                elements.append({'type': 'moveTo', 'x': element.x, 'y': element.y})
-            elif element.isLineTo():
-                elements.append({'type': 'lineTo', 'x': element.x, 'y': element.y})
-            elif element.isCurveTo():
-                elements.append({'type': 'curveTo', 'x': element.x, 'y': element.y})
-        return elements
+        # Packed as one element type byte per element plus float64 x, y pairs. Qt streams
+        # the elements in a fixed layout, so they are read back in a single NumPy pass
+        # instead of one elementAt call per element (curve control points included)
+        buffer = QByteArray()
+        stream = QDataStream(buffer, QIODevice.WriteOnly)
+        stream << path
+
+        elements = np.frombuffer(buffer.data(), PATH_STREAM_ELEMENT, path.elementCount(), 4)
+        coords = np.empty((len(elements), 2), '<f8')
+        coords[:, 0] = elements['x']
+        coords[:, 1] = elements['y']
+
+        return {
+            'types': elements['type'].astype(np.uint8).tobytes(),
+            'coords': coords.tobytes(),
+            'fillrule': int(path.fillRule()),
+        }
 
     def serialize_group(self, group: CustomGraphicsItemGroup):
         children = []
@@ -240,7 +280,7 @@ class MPSerializer:
                     'y': child.pos().y(),
                     'name': child.toolTip(),
                     'zval': child.zValue(),
-                    'elements': self.serialize_path(child.path()),
+                    'path': self.serialize_path(child.path()),
                     'visible': child.isVisible(),
                 }
 
@@ -290,45 +330,155 @@ class MPSerializer:
         with open(file, 'r', encoding='utf-8') as f:
             return f.read()
 
+    def serialize_asset(self, data: bytes):
+        key = hashlib.sha256(data).hexdigest()
+        self.assets.setdefault(key, data)
+
+        return key
+
+    def serialize_svg_asset(self, item: CustomSvgItem):
+        source = item.source()
+
+        if os.path.exists(source if source is not None else ''):
+            # Course elements are usually placed many times, only read each file once
+            if source not in self.file_assets:
+                self.file_assets[source] = self.serialize_asset(self.serialize_file(source).encode('utf-8'))
+
+            return self.file_assets[source]
+
+        if item.svgData() is not None:
+            return self.serialize_asset(item.svgData().encode('utf-8'))
+
+    def serialize_pixmap_asset(self, item: CustomPixmapItem):
+        # Duplicated pixmap items share their pixmap data, so only hash (or encode) it once
+        key = item.pixmap().cacheKey()
+
+        if key not in self.pixmap_assets:
+            if item.encodedData() is not None:
+                self.pixmap_assets[key] = self.serialize_asset(item.encodedData())
+
+            else:
+                # Pixmaps that never came from a file are encoded as PNG
+                buffer = QBuffer()
+                buffer.open(QIODevice.WriteOnly)
+                item.pixmap().save(buffer, "PNG")
+                self.pixmap_assets[key] = self.serialize_asset(buffer.data().data())
+
+        return self.pixmap_assets[key]
+
 
 class MPDeserializer:
-    def __init__(self, scene):
+    # Images and markdown are decoded on worker threads ahead of item construction. Image
+    # decoding runs in Qt without the GIL, markdown is pure Python and holds it, so more
+    # threads than this only contend with the GUI thread
+    decode_threads = min(4, os.cpu_count() or 1)
+
+    def __init__(self, scene, interactive=True):
         self.scene = scene
 
+        # Headless callers get warnings on stderr instead of message boxes
+        self.interactive = interactive
+
+        self.assets = {}
+        self.svg_renderers = {}
+        self.pixmaps = {}
+        self.markdown_html = {}
+
+        self.decoder = None
+        self.decoding = {}
+
     def deserialize_items(self, items_data):
         # Handle metadata
-        metadata = items_data.pop(0)
-        if metadata.get('mpversion', 'unknown') != self.scene.mpversion:
+        self.deserialize_metadata(items_data.pop(0))
+        self.prefetch(items_data)
+
+        with self.scene.batch():
+            for item_data in items_data:
+                item = self.deserialize_item(item_data)
+
+                if item is not None:
+                    self.scene.addItem(item)
+
+        self.scene.parentWindow.use_exit_add_canvas()
+
+    def deserialize_metadata(self, metadata):
+        self.cancel_decoding()
+        self.assets = metadata.get('assets', {})
+        self.svg_renderers = {}
+        self.pixmaps = {}
+        self.markdown_html = {}
+
+        if metadata.get('mpversion', 'unknown') != self.scene.mpversion and not self.interactive:
+            print(f'Warning: document was saved in MPRUN {metadata.get("mpversion", "unknown")}, '
+                  f'this is {self.scene.mpversion}', file=sys.stderr)
+
+        elif metadata.get('mpversion', 'unknown') != self.scene.mpversion:
             QMessageBox.warning(self.scene.parentWindow, 'Open File', 'You are attempting to open a file saved in an '
                                                                       'different version of MPRUN, this may cause '
                                                                       'errors.')
 
-        if metadata.get('item_count', 'unknown') >= 500:
-            QMessageBox.warning(self.scene.parentWindow, 'Open File', 'You are attempting to open a file with a large '
-                                                                      'amount of items, this can cause your computer '
-                                                                      'to slow down.')
-
-        for item_data in items_data:
-            item = None
-            if item_data['type'] == 'CanvasItem':
-                item = self.deserialize_canvas(item_data)
-            elif item_data['type'] == 'CustomTextItem':
-                item = self.deserialize_custom_text_item(item_data)
-            elif item_data['type'] == 'CustomPathItem':
-                item = self.deserialize_custom_path_item(item_data)
-            elif item_data['type'] == 'CustomGraphicsItemGroup':
-                item = self.deserialize_custom_group_item(item_data)
-            elif item_data['type'] == 'LeaderLineItem':
-                item = self.deserialize_leader_line_item(item_data)
-            elif item_data['type'] == 'CustomSvgItem':
-                item = self.deserialize_custom_svg_item(item_data)
-            elif item_data['type'] == 'CustomPixmapItem':
-                item = self.deserialize_custom_pixmap_item(item_data)
-
-            if item is not None:
-                self.scene.addItem(item)
-
-        self.scene.parentWindow.use_exit_add_canvas()
+    def deserialize_item(self, item_data):
+        if item_data['type'] == 'CanvasItem':
+            return self.deserialize_canvas(item_data)
+        elif item_data['type'] == 'CustomTextItem':
+            return self.deserialize_custom_text_item(item_data)
+        elif item_data['type'] == 'CustomPathItem':
+            return self.deserialize_custom_path_item(item_data)
+        elif item_data['type'] == 'CustomGraphicsItemGroup':
+            return self.deserialize_custom_group_item(item_data)
+        elif item_data['type'] == 'LeaderLineItem':
+            return self.deserialize_leader_line_item(item_data)
+        elif item_data['type'] == 'CustomSvgItem':
+            return self.deserialize_custom_svg_item(item_data)
+        elif item_data['type'] == 'CustomPixmapItem':
+            return self.deserialize_custom_pixmap_item(item_data)
+
+        return None
+
+    def prefetch(self, records):
+        # Starts decoding everything the records need on the decoder threads, the
+        # deserialize_* calls pick the results up and only wait if a decode is unfinished
+        if self.decoder is None:
+            self.decoder = ThreadPoolExecutor(self.decode_threads, thread_name_prefix='mprun-decode')
+
+        for record in records:
+            self.prefetch_record(record)
+
+    def prefetch_record(self, record):
+        # SVGs are not prefetched, QSvgRenderer is a QObject and is only built on the GUI
+        # thread (see deserialize_svg_asset)
+        if record['type'] == 'CustomPixmapItem' and 'asset' in record:
+            self.start_decoding(('pixmap', record['asset']), self.pixmaps, decode_pixmap_asset,
+                                lambda: bytes(self.assets[record['asset']]))
+
+        elif record['type'] == 'CustomTextItem' and record.get('markdown', True):
+            self.start_decoding(('markdown', record['text']), self.markdown_html, markdown.markdown,
+                                lambda: record['text'])
+
+        elif record['type'] == 'CustomGraphicsItemGroup':
+            for child in record['children']:
+                self.prefetch_record(child)
+
+    def start_decoding(self, key, cache, decode, data):
+        if key[1] in cache or key in self.decoding:
+            return
+
+        self.decoding[key] = self.decoder.submit(decode, data())
+
+    def decoded(self, key, decode, data):
+        # The worker's result if one was started, otherwise decode right here
+        future = self.decoding.pop(key, None)
+
+        if future is not None:
+            return future.result()
+
+        return decode(data)
+
+    def cancel_decoding(self):
+        for future in self.decoding.values():
+            future.cancel()
+
+        self.decoding = {}
 
     def deserialize_color(self, color):
         return QColor(color['red'], color['green'], color['blue'], color['alpha'])
@@ -384,24 +534,12 @@ class MPDeserializer:
         self.process_attributes(text_item, data['attr'])
 
         if data.get('markdown', True):
-            text_item.toMarkdown()
+            text_item.toMarkdown(self.deserialize_markdown(data['text']))
 
         return text_item
 
     def deserialize_custom_path_item(self, data):
-        sub_path = QPainterPath()
-        for element in data['elements']:
-            if element['type'] == 'moveTo':
-                sub_path.moveTo(element['x'], element['y'])
-            elif element['type'] == 'lineTo':
-                sub_path.lineTo(element['x'], element['y'])
-            elif element['type'] == 'curveTo':
-                sub_path.cubicTo(element['x'],
-                                 element['y'],
-                                 element['x'],
-                                 element['y'],
-                                 element['x'],
-                                 element['y'])
+        sub_path = self.deserialize_path(data)
 
         path_item = CustomPathItem(sub_path)
         path_item.setPen(self.deserialize_pen(data['pen']))
@@ -417,6 +555,55 @@ class MPDeserializer:
 
         return path_item
 
+    def deserialize_path(self, data):
+        if 'path' not in data:
+            return self.deserialize_path_elements(data['elements'])
+
+        # Rebuild the QDataStream form of the path and let Qt read it in one call
+        types = np.frombuffer(data['path']['types'], np.uint8)
+        coords = np.frombuffer(data['path']['coords'], '<f8').reshape(-1, 2)
+
+        elements = np.empty(len(types), PATH_STREAM_ELEMENT)
+        elements['type'] = types
+        elements['x'] = coords[:, 0]
+        elements['y'] = coords[:, 1]
+
+        # The current subpath starts at the last moveTo
+        move_tos = np.flatnonzero(types == 0)
+        subpath_start = move_tos[-1] if len(move_tos) else 0
+
+        stream_data = (np.array([len(types)], '>i4').tobytes()
+                       + elements.tobytes()
+                       + np.array([subpath_start, data['path'].get('fillrule', 0)], '>i4').tobytes())
+
+        # The stream only borrows the buffer, keep it alive while reading
+        buffer = QByteArray(stream_data)
+        stream = QDataStream(buffer, QIODevice.ReadOnly)
+
+        path = QPainterPath()
+        stream >> path
+
+        return path
+
+    def deserialize_path_elements(self, elements):
+        # Documents saved before paths were packed, these only kept the first control
+        # point of every curve
+        sub_path = QPainterPath()
+        for element in elements:
+            if element['type'] == 'moveTo':
+                sub_path.moveTo(element['x'], element['y'])
+            elif element['type'] == 'lineTo':
+                sub_path.lineTo(element['x'], element['y'])
+            elif element['type'] == 'curveTo':
+                sub_path.cubicTo(element['x'],
+                                 element['y'],
+                                 element['x'],
+                                 element['y'],
+                                 element['x'],
+                                 element['y'])
+
+        return sub_path
+
     def deserialize_custom_group_item(self, data):
         group_item = CustomGraphicsItemGroup()
 
@@ -437,19 +624,7 @@ class MPDeserializer:
         return group_item
 
     def deserialize_leader_line_item(self, data):
-        sub_path = QPainterPath()
-        for element in data['elements']:
-            if element['type'] == 'moveTo':
-                sub_path.moveTo(element['x'], element['y'])
-            elif element['type'] == 'lineTo':
-                sub_path.lineTo(element['x'], element['y'])
-            elif element['type'] == 'curveTo':
-                sub_path.cubicTo(element['x'],
-                                 element['y'],
-                                 element['x'],
-                                 element['y'],
-                                 element['x'],
-                                 element['y'])
+        sub_path = self.deserialize_path(data)
 
         path_item = LeaderLineItem(sub_path, data['text'])
         path_item.setPen(self.deserialize_pen(data['pen']))
@@ -474,7 +649,12 @@ class MPDeserializer:
         try:
             svg_item = CustomSvgItem()
             svg_item.store_filename(data['filename'])
-            svg_item.loadFromData(data['raw_svg_data'])
+
+            if 'asset' in data:
+                svg_item.loadFromData(*self.deserialize_svg_asset(data['asset']))
+
+            else:
+                svg_item.loadFromData(data['raw_svg_data'])
 
             self.process_attributes(svg_item, data['attr'])
 
@@ -484,22 +664,46 @@ class MPDeserializer:
             print(e)
 
     def deserialize_custom_pixmap_item(self, data):
-        pixmap = QPixmap(data['filename'])
-        pixmap_item = CustomPixmapItem(pixmap)
+        # Every image is decoded exactly once, the encoded bytes stay with the item
+        pixmap_item = CustomPixmapItem()
+
+        if 'asset' in data:
+            pixmap_item.loadFromData(*self.deserialize_pixmap_asset(data['asset']))
+
+        else:
+            pixmap_item.loadFromData(data['data'])
+
         pixmap_item.store_filename(data['filename'])
-        pixmap_item.loadFromData(data['data'])
 
         self.process_attributes(pixmap_item, data['attr'])
 
-        pixmap = pixmap_item.pixmap()
-        buffer = QBuffer()
-        buffer.open(QIODevice.WriteOnly)
-        pixmap.save(buffer, "PNG")
-        pixmap_data = buffer.data().data()
-        pixmap_item.loadFromData(pixmap_data)
-
         return pixmap_item
 
+    def deserialize_svg_asset(self, key):
+        # One renderer per unique SVG, shared by every item that uses it. The renderer parses
+        # the SVG when it is built, which happens here on the GUI thread
+        if key not in self.svg_renderers:
+            svg_data = bytes(self.assets[key])
+            self.svg_renderers[key] = (svg_data.decode('utf-8'), QSvgRenderer(QByteArray(svg_data)))
+
+        return self.svg_renderers[key]
+
+    def deserialize_pixmap_asset(self, key):
+        # One decode per unique image, items using it share the bytes and the pixmap
+        if key not in self.pixmaps:
+            data = bytes(self.assets[key])
+            image = self.decoded(('pixmap', key), decode_pixmap_asset, data)
+            self.pixmaps[key] = (data, QPixmap.fromImage(image))
+
+        return self.pixmaps[key]
+
+    def deserialize_markdown(self, text):
+        # Labels often repeat, each distinct text is rendered once
+        if text not in self.markdown_html:
+            self.markdown_html[text] = self.decoded(('markdown', text), markdown.markdown, text)
+
+        return self.markdown_html[text]
+
     def process_attributes(self, item, data):
         for _data in data:
             item.setTransformOriginPoint(self.deserialize_point(_data['transformorigin']))
@@ -512,10 +716,308 @@ class MPDeserializer:
             item.setVisible(_data['visible'])
 
 
+class MPProgressiveLoader:
+    # Loads a container document viewport first: every item gets a placeholder from the
+    # item index, items on screen are built straight away and the rest stream in while
+    # the event loop is idle
+    batch_time = 0.015
+
+    # Records read ahead of the ones being built, their assets decode on the worker
+    # threads while the event loop is idle
+    read_ahead_count = 64
+
+    def __init__(self, scene, deserializer: MPDeserializer, reader: MPFileReader):
+        self.scene = scene
+        self.deserializer = deserializer
+        self.reader = reader
+        self.pending = []
+        self.records = {}
+        self.placeholders = None
+        self.total = 0
+        self.progress = None
+
+        self.timer = QTimer()
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.load_batch)
+
+    def start(self):
+        metadata = self.reader.metadata()
+        metadata['assets'] = self.reader.assets()
+        self.deserializer.deserialize_metadata(metadata)
+        self.scene.manager.autosaver.seed_assets(metadata['assets'])
+
+        self.pending = [(entry, QRectF(*entry['bounds'])) for entry in self.reader.index()]
+        self.total = len(self.pending)
+
+        # Whatever intersects the viewport first, then outwards from its center
+        visible = self.visible_rect()
+        center = visible.center()
+
+        def priority(pending):
+            rect = pending[1]
+            distance = QLineF(center, rect.center()).length()
+
+            return not visible.intersects(rect), distance
+
+        self.pending.sort(key=priority)
+
+        visible_count = 0
+        while visible_count < len(self.pending) and self.pending[visible_count][1].intersects(visible):
+            visible_count += 1
+
+        # Everything outside the viewport is outlined until it is loaded
+        if visible_count < len(self.pending):
+            self.placeholders = PlaceholderLayer({entry['uid']: rect for entry, rect in self.pending[visible_count:]},
+                                                 max(entry['zval'] for entry, rect in self.pending))
+            self.scene.addItem(self.placeholders)
+
+        self.load_entries(visible_count)
+        self.scene.parentWindow.use_exit_add_canvas()
+
+        if self.pending:
+            self.read_ahead(self.read_ahead_count)
+
+            self.progress = QProgressDialog('Loading document...', 'Cancel', 0, self.total, self.scene.parentWindow)
+            self.progress.setWindowTitle('Open File')
+            self.progress.setWindowModality(Qt.NonModal)
+            self.progress.setMinimumDuration(500)
+            self.progress.setValue(self.total - len(self.pending))
+            self.progress.canceled.connect(self.cancel)
+            self.timer.start()
+
+        else:
+            # Everything was in view
+            self.reader.close()
+
+    def visible_rect(self):
+        if not self.scene.views():
+            return QRectF()
+
+        view = self.scene.views()[0]
+        return view.mapToScene(view.viewport().rect()).boundingRect()
+
+    def isLoading(self):
+        return len(self.pending) > 0
+
+    def read_ahead(self, count):
+        entries = [entry for entry, rect in self.pending[:count] if entry['uid'] not in self.records]
+        records = self.reader.read_records(entries)
+
+        for entry, record in zip(entries, records):
+            self.records[entry['uid']] = record
+
+        self.deserializer.prefetch(records)
+
+    def load_entries(self, count):
+        # Everything built in one go starts decoding together
+        self.read_ahead(count)
+
+        with self.scene.batch():
+            for entry, rect in self.pending[:count]:
+                record = self.records.pop(entry['uid'])
+                item = self.deserializer.deserialize_item(record)
+
+                if self.placeholders is not None:
+                    self.placeholders.remove(entry['uid'])
+
+                if item is not None:
+                    self.scene.addItem(item)
+                    self.scene.manager.tracker.track(item, entry['uid'])
+                    self.scene.manager.autosaver.seed(item, record, entry['bounds'])
+
+        del self.pending[:count]
+
+    def load_batch(self):
+        start = time.perf_counter()
+
+        with self.scene.batch():
+            while self.pending and time.perf_counter() - start < self.batch_time:
+                self.load_entries(1)
+
+        if self.progress is not None:
+            self.progress.setValue(self.total - len(self.pending))
+
+        if not self.pending:
+            self.finish()
+
+        else:
+            self.read_ahead(self.read_ahead_count)
+
+    def finish(self):
+        # Builds everything that is left, used before the document is saved
+        self.load_entries(len(self.pending))
+        self.stop()
+        self.scene.parentWindow.use_exit_add_canvas()
+
+    def stop(self):
+        self.timer.stop()
+        self.pending = []
+        self.records = {}
+        self.deserializer.cancel_decoding()
+
+        if self.placeholders is not None:
+            try:
+                if self.placeholders.scene() is self.scene:
+                    self.scene.removeItem(self.placeholders)
+
+            except RuntimeError:
+                # Already deleted by scene.clear()
+                pass
+
+            self.placeholders = None
+
+        # Nothing is read from the document anymore, so it is not held open (or mapped) for
+        # the rest of the session
+        self.reader.close()
+
+        if self.progress is not None:
+            self.progress.canceled.disconnect(self.cancel)
+            self.progress.close()
+            self.progress = None
+
+    def cancel(self):
+        # A partially loaded document must never be saved over the original
+        self.stop()
+        self.scene.manager.reset_to_default_scene()
+
+
+class MPChangeTracker:
+    # Remembers which items changed since the document was last written, so saving only
+    # has to append those items to the document's journal instead of rewriting everything
+    max_journals = 32
+
+    def __init__(self, scene):
+        self.scene = scene
+
+        # Items changed since the last autosave snapshot, consumed by MPAutosaver
+        self.autosave_dirty = set()
+
+        self.clear()
+
+    def clear(self):
+        self.filename = None
+        self.uids = {}
+        self.dirty = set()
+        self.asset_keys = set()
+        self.next_uid = 0
+        self.journal_count = 0
+        self.journal_size = 0
+        self.base_size = 0
+        self.stamp = None
+
+    def open(self, filename, reader: MPFileReader):
+        self.clear()
+        self.filename = filename
+        self.asset_keys = set(reader.assets())
+        self.next_uid = max([entry['uid'] for entry in reader.index()], default=-1) + 1
+        self.journal_count = len(reader.journals)
+        self.journal_size = reader.journal_size()
+        self.base_size = reader.base_size()
+        self.stamp = self.file_stamp(filename)
+
+    def saved(self, filename, items, assets):
+        # Called after a full save, record uids are the positions in the item index
+        self.clear()
+        self.filename = filename
+        self.uids = {item: uid for uid, item in enumerate(items)}
+        self.asset_keys = set(assets)
+        self.next_uid = len(items)
+        self.base_size = os.path.getsize(filename)
+        self.stamp = self.file_stamp(filename)
+
+    def file_stamp(self, filename):
+        stat = os.stat(filename)
+        return stat.st_size, stat.st_mtime_ns
+
+    def track(self, item, uid):
+        self.uids[item] = uid
+
+    def markDirty(self, items):
+        for item in items:
+            self.dirty.add(item.topLevelItem())
+            self.autosave_dirty.add(item.topLevelItem())
+
+    @staticmethod
+    def commandItems(command):
+        # The items an undo command and its children touch
+        items = []
+
+        if getattr(command, 'item', None) is not None:
+            items.append(command.item)
+
+        if getattr(command, 'items', None) is not None:
+            items.extend(command.items)
+
+        if getattr(command, 'oldPositions', None) is not None:
+            items.extend(command.oldPositions.keys())
+
+        for i in range(command.childCount()):
+            items.extend(MPChangeTracker.commandItems(command.child(i)))
+
+        return [item for item in items if isinstance(item, QGraphicsItem)]
+
+    def markCommand(self, command):
+        self.markDirty(self.commandItems(command))
+
+    def canAppend(self, filename):
+        # Fall back to a full save (which compacts the journal) once the journal grows
+        # past the document itself, or when the file was changed behind our back
+        if self.filename != filename or not os.path.exists(filename):
+            return False
+
+        return (self.stamp == self.file_stamp(filename)
+                and self.journal_count < self.max_journals
+                and self.journal_size < self.base_size)
+
+    def append(self, serializer: MPSerializer, preview=None):
+        # preview is the scene's MPDocumentPreview, its summary is refreshed with the journal
+        # and its thumbnail when the changed items touch it
+        items = [item for item in self.scene.items() if item.parentItem() is None]
+        present = set(items)
+
+        removed = [item for item in self.uids if item not in present]
+        deletes = [self.uids[item] for item in removed]
+        changed = self.dirty | set(removed) | {item for item in items if item not in self.uids}
+        puts = []
+
+        serializer.reset_assets()
+
+        for item in items:
+            if item in self.uids and item not in self.dirty:
+                continue
+
+            data = serializer.serialize_item(item)
+
+            if data is not None:
+                if item not in self.uids:
+                    self.uids[item] = self.next_uid
+                    self.next_uid += 1
+
+                puts.append((self.uids[item], data))
+
+        for item in removed:
+            del self.uids[item]
+
+        self.dirty.clear()
+
+        if not puts and not deletes:
+            return
+
+        assets = {key: data for key, data in serializer.assets.items() if key not in self.asset_keys}
+
+        self.journal_size += MPFileWriter(self.filename).append(puts, deletes, assets,
+                                                                preview.build(len(self.uids), changed) if preview else None)
+        self.journal_count += 1
+        self.asset_keys.update(assets)
+        self.stamp = self.file_stamp(self.filename)
+
+
 class MPDataRepairer:
+    # File > Repair File, runs MPRepairEngine behind a progress dialog and shows its report
     def __init__(self, parent: QMainWindow, filename=None):
         self.parent = parent
         self.filename = None
+        self.report = None
 
         if filename is None:
             file, _ = QFileDialog.getOpenFileName(parent, 'Choose File', '', 'MPRUN files (*.mp)')
@@ -528,48 +1030,40 @@ class MPDataRepairer:
         self.repair()
 
     def repair(self):
-        if self.filename is not None:
-            try:
-                with open(self.filename, 'rb') as f:
-                    items_data = pickle.load(f)
-                    print("Loaded data:", items_data)
+        if self.filename is None:
+            return
 
-                # Handle metadata (ignore this)
-                metadata = items_data.pop(0)
+        progress = QProgressDialog(f'Repairing {os.path.basename(self.filename)}...', 'Cancel', 0, 0, self.parent)
+        progress.setWindowTitle('Repair File')
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
 
-                repaired_data = []
-                for data in items_data:
-                    # Check data integrity here (validate structure, etc.)
-                    if self.is_valid(data):
-                        repaired_data.append(data)
-                    else:
-                        print(f"Data corrupted: {data}. Attempting to repair.")
-                        repaired_data.append(self.repair_data(data))  # Attempt to repair corrupted data
+        def update(done, total):
+            progress.setMaximum(total)
+            progress.setValue(done)
+            QApplication.processEvents()
 
-                # Save repaired data back to file
-                self.save_repaired_data(repaired_data, metadata)
+            return not progress.wasCanceled()
 
-            except (pickle.UnpicklingError, EOFError) as e:
-                print(f"Error loading file: {e}")
+        self.report = MPRepairEngine(self.filename).run(update)
+        progress.close()
 
-            QMessageBox.information(self.parent, 'Process Complete', 'File repair completed successfully.')
+        message_box = QMessageBox(self.parent)
+        message_box.setWindowTitle('Repair File')
+        message_box.setText(self.report.summary())
 
-    def is_valid(self, data):
-        # Placeholder: validate the structure of the data
-        return isinstance(data, dict)  # Example validation (adjust based on your data structure)
+        if self.report.failed is not None:
+            message_box.setIcon(QMessageBox.Critical)
 
-    def repair_data(self, data):
-        # Attempt to fix corrupted data (example logic)
-        repaired_data = {}
-        try:
-            # Custom repair logic based on expected structure
-            repaired_data = {key: value if value else "default" for key, value in data.items()}
-        except Exception as e:
-            print(f"Unable to repair: {e}")
-        return repaired_data
+        elif self.report.written:
+            message_box.setIcon(QMessageBox.Warning)
+            message_box.setInformativeText(f'The damaged document was kept as {os.path.basename(self.filename)}.bak, '
+                                           f'open the document again to see the repaired items.')
+
+        else:
+            message_box.setIcon(QMessageBox.Information)
 
-    def save_repaired_data(self, repaired_data, metadata):
-        with open(self.filename, 'wb') as f:
-            pickle.dump([metadata] + repaired_data, f)
-        print(f"Repaired data saved to {self.filename}.")
+        if self.report.details():
+            message_box.setDetailedText(self.report.details())
 
+        message_box.exec_()
@@ -0,0 +1,240 @@
+import abc
+import shutil
+import threading
+
+from src.scripts.imports import *
+from src.framework.exporter import MPCanvasExporter, MPExportCache
+
+if getattr(sys, 'frozen', False):
+    os.chdir(sys._MEIPASS)
+
+
+class MPUploadBackend(abc.ABC):
+    # Where shared files go, subclasses implement upload()
+    name = 'Upload'
+
+    # Uploads the backend can take at once
+    max_concurrency = 4
+
+    @abc.abstractmethod
+    def upload(self, filename):
+        # Runs on a worker thread and raises on failure, the uploader retries it
+        pass
+
+
+class MPLocalDirectoryBackend(MPUploadBackend):
+    # Stands in for a cloud service, "uploads" by copying into a directory. The latency and
+    # failure rate let the whole pipeline be tested and benchmarked offline
+    name = 'Local Directory'
+
+    def __init__(self, directory, latency=0.0, failure_rate=0.0):
+        self.directory = directory
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, filename):
+        time.sleep(self.latency)
+
+        if random.random() < self.failure_rate:
+            raise ConnectionError(f'Simulated failure uploading {os.path.basename(filename)}')
+
+        shutil.copyfile(filename, os.path.join(self.directory, os.path.basename(filename)))
+
+
+class UploadTask(QRunnable):
+    def __init__(self, uploader, filename):
+        super().__init__()
+        self.uploader = uploader
+        self.filename = filename
+
+    def run(self):
+        error = ''
+
+        for attempt in range(self.uploader.retries + 1):
+            if self.uploader.cancelled.is_set():
+                error = MPUploader.cancelled_error
+                break
+
+            try:
+                self.uploader.backend.upload(self.filename)
+                error = ''
+                break
+
+            except Exception as e:
+                error = str(e)
+
+                # Backs off 1s, 2s, 4s... and wakes up early when cancelled
+                if attempt < self.uploader.retries:
+                    self.uploader.cancelled.wait(self.uploader.retry_delay * 2 ** attempt)
+
+        self.uploader.uploaded.emit(self.filename, error)
+
+
+class MPUploader(QObject):
+    # Uploads files on a bounded thread pool as soon as they are queued, retrying failures.
+    # finished is emitted once close() was called and every queued file is done
+    uploaded = pyqtSignal(str, str)  # filename, error ('' when uploaded), emitted from the pool
+    progress = pyqtSignal(int)
+    finished = pyqtSignal()
+
+    cancelled_error = 'Upload cancelled'
+
+    retries = 3
+    retry_delay = 1.0
+
+    def __init__(self, backend: MPUploadBackend, concurrency=4):
+        super().__init__()
+        self.backend = backend
+
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max(1, min(concurrency, backend.max_concurrency)))
+
+        self.pending = 0
+        self.closed = False
+        self.done = []
+        self.errors = []
+        self.cancelled = threading.Event()
+
+        self.uploaded.connect(self.onUploaded)
+
+    def queue(self, filename):
+        if self.closed:
+            return
+
+        self.pending += 1
+        self.pool.start(UploadTask(self, filename))
+
+    def close(self):
+        # No more files are coming
+        if not self.closed:
+            self.closed = True
+
+            if self.pending == 0:
+                self.finished.emit()
+
+    def cancel(self):
+        # Queued uploads see the flag and return without uploading
+        self.cancelled.set()
+        self.close()
+
+    def onUploaded(self, filename, error):
+        self.pending -= 1
+
+        if not error:
+            self.done.append(filename)
+
+        elif error != self.cancelled_error:
+            self.errors.append(f'{os.path.basename(filename)}: {error}')
+
+        self.progress.emit(len(self.done) + len(self.errors))
+
+        if self.closed and self.pending == 0:
+            self.finished.emit()
+
+
+class MPSharePipeline(QObject):
+    # Exports canvases and hands each file to the uploader as soon as it is written, so
+    # rendering and network time overlap instead of adding up
+    progress = pyqtSignal(int)
+    finished = pyqtSignal()
+
+    def __init__(self, scene, backend: MPUploadBackend, cache: MPExportCache = None, scale=1.0, concurrency=4):
+        super().__init__()
+        self.exporter = MPCanvasExporter(scene, scale, cache)
+        self.uploader = MPUploader(backend, concurrency)
+
+        self.started = False
+        self.export_finished = False
+        self.queued = set()
+
+        self.exporter.exported.connect(self.onExported)
+        self.exporter.finished.connect(self.onExportFinished)
+        self.exporter.progress.connect(self.onProgress)
+        self.uploader.progress.connect(self.onProgress)
+        self.uploader.finished.connect(self.finished)
+
+    @property
+    def cancelled(self):
+        return self.uploader.cancelled.is_set()
+
+    @property
+    def uploaded(self):
+        return self.uploader.done
+
+    @property
+    def errors(self):
+        return self.exporter.errors + self.uploader.errors
+
+    def start(self, jobs):
+        # jobs: (canvas, filename) pairs, as for MPCanvasExporter
+        self.started = False
+        self.export_finished = False
+        self.queued = set()
+        self.exporter.export(jobs)
+
+        # Canvases that came from the export cache are ready straight away
+        for filename in self.exporter.written:
+            self.queue(filename)
+
+        self.started = True
+
+        if self.export_finished:
+            self.uploader.close()
+
+    def exec(self, jobs, parent=None, title='Share'):
+        # Runs behind a progress dialog and returns the files uploaded, or None when it was
+        # cancelled. The event loop keeps running meanwhile
+        progress = QProgressDialog(f'Exporting and uploading to {self.uploader.backend.name}...', 'Cancel',
+                                   0, len(jobs) * 2, parent)
+        progress.setWindowTitle(title)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        progress.setValue(0)
+        progress.canceled.connect(self.cancel)
+        self.progress.connect(progress.setValue)
+
+        loop = QEventLoop()
+        self.finished.connect(loop.quit)
+        self.start(jobs)
+
+        if not self.uploader.closed or self.uploader.pending:
+            loop.exec_()
+
+        self.finished.disconnect(loop.quit)
+        self.progress.disconnect(progress.setValue)
+        progress.canceled.disconnect(self.cancel)
+        progress.close()
+
+        return None if self.cancelled or self.exporter.cancelled else self.uploaded
+
+    def cancel(self):
+        self.exporter.cancel()
+        self.uploader.cancel()
+
+    def queue(self, filename):
+        if filename not in self.queued:
+            self.queued.add(filename)
+            self.uploader.queue(filename)
+
+    def onExported(self, filename, error):
+        if not error:
+            self.queue(filename)
+
+    def onExportFinished(self):
+        self.export_finished = True
+
+        # The exporter can finish before this pipeline saw its last file, and reused files
+        # are only queued once start() gets them
+        if self.started:
+            for filename in self.exporter.written:
+                self.queue(filename)
+
+            self.uploader.close()
+
+    def onProgress(self):
+        exported = len(self.exporter.written) + len(self.exporter.errors)
+        uploaded = len(self.uploader.done) + len(self.uploader.errors)
+
+        self.progress.emit(exported + uploaded)
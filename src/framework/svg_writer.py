@@ -0,0 +1,514 @@
+import copy
+import re
+import xml.etree.ElementTree as ET
+
+from src.scripts.imports import *
+from src.framework.custom_classes import *
+
+if getattr(sys, 'frozen', False):
+    os.chdir(sys._MEIPASS)
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+XLINK_HREF = f'{{{XLINK_NS}}}href'
+
+ET.register_namespace('', SVG_NS)
+ET.register_namespace('xlink', XLINK_NS)
+
+# Qt's font weights to CSS ones
+font_weights = [(87, 900), (81, 800), (75, 700), (63, 600), (57, 500), (50, 400), (25, 300), (12, 200), (0, 100)]
+
+
+def number(value, digits=2):
+    # Shortest form of a coordinate, 12.50 -> 12.5, 3.00 -> 3, -0.00 -> 0
+    text = f'{value:.{digits}f}'.rstrip('0').rstrip('.')
+
+    return '0' if text in ('-0', '') else text
+
+
+def path_data(path: QPainterPath):
+    # A compact d string, repeated commands are left out and negative numbers need no space
+    parts = []
+    last = None
+    i = 0
+
+    while i < path.elementCount():
+        element = path.elementAt(i)
+
+        if element.isMoveTo():
+            command, points = 'M', [element]
+            i += 1
+
+        elif element.isLineTo():
+            command, points = 'L', [element]
+            i += 1
+
+        else:
+            command, points = 'C', [element, path.elementAt(i + 1), path.elementAt(i + 2)]
+            i += 3
+
+        # A repeated M would be read as a line
+        if command != last or command == 'M':
+            parts.append(command)
+
+        parts.append(' '.join(f'{number(point.x)} {number(point.y)}' for point in points))
+        last = command
+
+    data = ' '.join(parts).replace(' -', '-')
+
+    for command in 'MLC':
+        data = data.replace(f' {command} ', command).replace(f'{command} ', command)
+
+    return data
+
+
+def transform_data(transform: QTransform):
+    if transform.isIdentity():
+        return None
+
+    if transform.type() == QTransform.TxTranslate:
+        return f'translate({number(transform.dx())} {number(transform.dy())})'
+
+    return (f'matrix({number(transform.m11(), 5)} {number(transform.m12(), 5)} {number(transform.m21(), 5)} '
+            f'{number(transform.m22(), 5)} {number(transform.dx())} {number(transform.dy())})')
+
+
+class MPSVGWriter:
+    # Writes canvases as SVG by walking the scene items instead of recording paint calls.
+    # Course elements are defined once as <symbol>s and placed with <use>, images are
+    # embedded once, paths become compact d strings and text stays text
+    title = 'MPRUN SVG Document'
+
+    def __init__(self, scene):
+        self.scene = scene
+
+        # Parsed course elements by source, kept between canvases
+        self.element_trees = {}
+
+        self.defs = None
+        self.symbols = {}
+        self.images = {}
+
+        screen = QGuiApplication.primaryScreen()
+        self.dpi = screen.logicalDotsPerInchY() if screen is not None else 96
+
+    def write(self, canvas, filename):
+        ET.ElementTree(self.toElement(canvas)).write(filename, encoding='utf-8', xml_declaration=True)
+
+    def toString(self, canvas):
+        return ET.tostring(self.toElement(canvas), encoding='unicode')
+
+    def toElement(self, canvas):
+        rect = canvas.sceneBoundingRect()
+
+        root = ET.Element(f'{{{SVG_NS}}}svg', {
+            'version': '1.1',
+            'width': number(rect.width()),
+            'height': number(rect.height()),
+            'viewBox': f'{number(rect.x())} {number(rect.y())} {number(rect.width())} {number(rect.height())}',
+        })
+        ET.SubElement(root, 'title').text = self.title
+
+        self.defs = ET.SubElement(root, 'defs')
+        self.symbols = {}
+        self.images = {}
+
+        for item in self.scene.items(rect, Qt.IntersectsItemBoundingRect, Qt.AscendingOrder):
+            if not item.isVisible() or isinstance(item, (QGraphicsItemGroup, CanvasTextItem, PlaceholderLayer)):
+                # Groups draw nothing themselves, their children are in the list
+                continue
+
+            element = self.item_element(item)
+
+            if element is not None:
+                transform = transform_data(item.sceneTransform())
+                if transform is not None:
+                    element.set('transform', transform)
+
+                if item.effectiveOpacity() < 1:
+                    element.set('opacity', number(item.effectiveOpacity(), 3))
+
+                root.append(element)
+
+        if not len(self.defs):
+            root.remove(self.defs)
+
+        return root
+
+    def item_element(self, item):
+        # The item in its own coordinates, None when it draws nothing
+        if isinstance(item, LeaderLineItem):
+            return self.leader_line_element(item)
+
+        elif isinstance(item, CustomPathItem):
+            return self.path_item_element(item)
+
+        elif isinstance(item, QGraphicsPathItem):
+            return self.shape_element(item.path(), item.pen(), item.brush())
+
+        elif isinstance(item, QGraphicsRectItem):
+            path = QPainterPath()
+            path.addRect(item.rect())
+            return self.shape_element(path, item.pen(), item.brush())
+
+        elif isinstance(item, QGraphicsEllipseItem):
+            path = QPainterPath()
+            path.addEllipse(item.rect())
+            return self.shape_element(path, item.pen(), item.brush())
+
+        elif isinstance(item, QGraphicsTextItem):
+            return self.text_element(item)
+
+        elif isinstance(item, QGraphicsSvgItem) and not item.elementId():
+            element = self.svg_item_element(item)
+            if element is not None:
+                return element
+
+        elif isinstance(item, QGraphicsPixmapItem):
+            return self.pixmap_item_element(item)
+
+        return self.raster_element(item)
+
+    def shape_element(self, path: QPainterPath, pen: QPen, brush: QBrush):
+        if path.isEmpty():
+            return None
+
+        element = ET.Element('path', {'d': path_data(path)})
+        self.set_fill(element, brush)
+        self.set_stroke(element, pen)
+
+        if path.fillRule() == Qt.OddEvenFill and brush.style() != Qt.NoBrush:
+            element.set('fill-rule', 'evenodd')
+
+        return element
+
+    def path_item_element(self, item: CustomPathItem):
+        shape = self.shape_element(item.path(), item.pen(), item.brush())
+
+        if not item.add_text or not item.text_along_path:
+            return shape
+
+        group = ET.Element('g')
+        if shape is not None:
+            group.append(shape)
+
+        # Each character sits on the path as it is painted, rotated to the path's angle
+        text = ET.SubElement(group, 'g')
+        self.set_font(text, item.text_along_path_font)
+        self.set_color(text, 'fill', item.text_along_path_color)
+
+        for char, point, angle in item.textAlongPathLayout():
+            glyph = ET.SubElement(text, 'text', {
+                'transform': f'translate({number(point.x())} {number(point.y())}) rotate({number(-angle)})',
+                'y': number(-item.text_along_path_spacing),
+            })
+            glyph.text = char
+
+        return group
+
+    def leader_line_element(self, item: LeaderLineItem):
+        # The line, the frame around the label and the arrowhead, the label itself is a child
+        group = ET.Element('g')
+
+        for element in (self.shape_element(item.path(), item.pen(), item.brush()),
+                        self.frame_element(item), self.arrow_head_element(item)):
+            if element is not None:
+                group.append(element)
+
+        return group
+
+    def frame_element(self, item: LeaderLineItem):
+        path = QPainterPath()
+        path.addRect(item.leaderGeometry()[1])
+
+        return self.shape_element(path, item.pen(), item.brush())
+
+    def arrow_head_element(self, item: LeaderLineItem):
+        arrow_head, frame_rect, arrow_brush, bounding_rect, shape = item.leaderGeometry()
+
+        if arrow_head is None:
+            return None
+
+        path = QPainterPath()
+        path.addPolygon(arrow_head)
+        path.closeSubpath()
+
+        return self.shape_element(path, item.pen(), arrow_brush)
+
+    def text_element(self, item: QGraphicsTextItem):
+        # Lines of text where the item's own layout put them, one tspan per format run
+        document = item.document()
+        default_color = item.defaultTextColor()
+
+        # The item's font and color go on the group, runs only carry what differs
+        group = ET.Element('g')
+        self.set_font(group, document.defaultFont())
+        self.set_color(group, 'fill', default_color)
+
+        block = document.begin()
+        while block.isValid():
+            layout = block.layout()
+            origin = layout.position()
+
+            for i in range(layout.lineCount()):
+                line = layout.lineAt(i)
+                start = block.position() + line.textStart()
+                end = start + line.textLength()
+
+                text = ET.SubElement(group, 'text', {'xml:space': 'preserve',
+                                                     'y': number(origin.y() + line.y() + line.ascent())})
+
+                fragments = block.begin()
+                while not fragments.atEnd():
+                    fragment = fragments.fragment()
+                    fragments += 1
+
+                    first = max(start, fragment.position())
+                    last = min(end, fragment.position() + fragment.length())
+
+                    if first >= last:
+                        continue
+
+                    characters = fragment.text()[first - fragment.position():last - fragment.position()]
+                    characters = characters.replace('\u2028', '').replace('\u2029', '')
+
+                    if not characters.strip():
+                        continue
+
+                    char_format = fragment.charFormat()
+                    span = ET.SubElement(text, 'tspan')
+                    span.text = characters
+
+                    self.set_font(span, char_format.font().resolve(document.defaultFont()))
+
+                    if char_format.foreground().style() != Qt.NoBrush:
+                        self.set_color(span, 'fill', char_format.foreground().color())
+
+                    for name, value in group.attrib.items():
+                        if span.get(name) == value:
+                            del span.attrib[name]
+
+                    span.set('x', number(origin.x() + line.cursorToX(first - block.position())[0]))
+
+                if not len(text):
+                    group.remove(text)
+
+            block = block.next()
+
+        return group if len(group) else None
+
+    def svg_item_element(self, item: QGraphicsSvgItem):
+        # Every placement of a course element shares one symbol
+        key = item.source() if isinstance(item, CustomSvgItem) and os.path.exists(item.source() or '') else None
+        data = item.svgData() if isinstance(item, CustomSvgItem) else None
+
+        if key is None and data is None:
+            return None
+
+        if key is None:
+            key = hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+        if key not in self.symbols:
+            symbol = self.symbol(key, data, item.renderer().viewBoxF())
+
+            if symbol is None:
+                return None
+
+            self.defs.append(symbol)
+            self.symbols[key] = symbol.get('id')
+
+        size = item.boundingRect().size()
+
+        return ET.Element('use', {XLINK_HREF: f'#{self.symbols[key]}',
+                                  'width': number(size.width()), 'height': number(size.height())})
+
+    def symbol(self, key, data, view_box: QRectF):
+        if key not in self.element_trees:
+            try:
+                if data is None:
+                    with open(key, 'rb') as f:
+                        data = f.read()
+
+                self.element_trees[key] = ET.fromstring(data)
+
+            except (OSError, ET.ParseError) as e:
+                print(e)
+                self.element_trees[key] = None
+
+        source = self.element_trees[key]
+
+        if source is None:
+            return None
+
+        prefix = f'e{len(self.symbols)}-'
+        symbol = ET.Element('symbol', {
+            'id': prefix[:-1],
+            'viewBox': f'{number(view_box.x())} {number(view_box.y())} '
+                       f'{number(view_box.width())} {number(view_box.height())}',
+            'preserveAspectRatio': 'none',
+        })
+
+        # Styling on the element's root carries over through a group
+        content = ET.SubElement(symbol, 'g', {name: value for name, value in source.attrib.items()
+                                              if name not in ('id', 'x', 'y', 'width', 'height', 'viewBox',
+                                                              'version', 'preserveAspectRatio')})
+
+        for child in source:
+            content.append(self.namespaced(copy.deepcopy(child), prefix))
+
+        return symbol
+
+    def namespaced(self, element, prefix):
+        # Course elements are exported from the same tools and reuse ids and class names
+        # (.cls-1, Layer_1), which would clash once they share a document
+        def reference(value):
+            return re.sub(r'url\(\s*#([^)\s]+)\s*\)', lambda match: f'url(#{prefix}{match.group(1)})', value)
+
+        def selectors(css):
+            return re.sub(r'([^{}]+)(\{[^{}]*\})',
+                          lambda match: re.sub(r'([.#])(-?[A-Za-z_][\w-]*)', rf'\1{prefix}\2', match.group(1))
+                          + reference(match.group(2)), css)
+
+        for node in element.iter():
+            for name, value in node.attrib.items():
+                if name == 'id':
+                    node.set(name, prefix + value)
+
+                elif name == 'class':
+                    node.set(name, ' '.join(prefix + token for token in value.split()))
+
+                elif name in ('href', XLINK_HREF) and value.startswith('#'):
+                    node.set(name, f'#{prefix}{value[1:]}')
+
+                elif 'url(' in value:
+                    node.set(name, reference(value))
+
+            if node.tag in ('style', f'{{{SVG_NS}}}style') and node.text:
+                node.text = selectors(node.text)
+
+        return element
+
+    def pixmap_item_element(self, item: QGraphicsPixmapItem):
+        # Duplicated images share their pixmap, and are embedded once
+        pixmap = item.pixmap()
+
+        if pixmap.isNull():
+            return None
+
+        key = pixmap.cacheKey()
+
+        if key not in self.images:
+            data = item.encodedData() if isinstance(item, CustomPixmapItem) else None
+            self.images[key] = f'i{len(self.images)}'
+            self.defs.append(self.image(self.images[key], pixmap.toImage(), data))
+
+        offset = item.offset()
+        element = ET.Element('use', {XLINK_HREF: f'#{self.images[key]}'})
+
+        if not offset.isNull():
+            element.set('x', number(offset.x()))
+            element.set('y', number(offset.y()))
+
+        return element
+
+    def raster_element(self, item: QGraphicsItem):
+        # Anything else is drawn into an image at twice its size
+        rect = item.boundingRect()
+
+        if rect.isEmpty():
+            return None
+
+        image = QImage((rect.size() * 2).toSize(), QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.scale(2, 2)
+        painter.translate(-rect.topLeft())
+        item.paint(painter, QStyleOptionGraphicsItem())
+        painter.end()
+
+        element = self.image(None, image)
+        element.set('x', number(rect.x()))
+        element.set('y', number(rect.y()))
+        element.set('width', number(rect.width()))
+        element.set('height', number(rect.height()))
+
+        return element
+
+    def image(self, id, image: QImage, data=None):
+        # The original file when it is a PNG or JPEG, otherwise encoded as PNG
+        if data is not None and data[:8] == b'\x89PNG\r\n\x1a\n':
+            mime = 'image/png'
+
+        elif data is not None and data[:3] == b'\xff\xd8\xff':
+            mime = 'image/jpeg'
+
+        else:
+            buffer = QBuffer()
+            buffer.open(QIODevice.WriteOnly)
+            image.save(buffer, 'PNG')
+            data, mime = buffer.data().data(), 'image/png'
+
+        element = ET.Element('image', {'width': str(image.width()), 'height': str(image.height()),
+                                       XLINK_HREF: f'data:{mime};base64,{base64.b64encode(data).decode("ascii")}'})
+
+        if id is not None:
+            element.set('id', id)
+
+        return element
+
+    def set_color(self, element, attribute, color: QColor):
+        element.set(attribute, color.name())
+
+        if color.alpha() < 255:
+            element.set(f'{attribute}-opacity', number(color.alphaF(), 3))
+
+    def set_fill(self, element, brush: QBrush):
+        if brush.style() == Qt.NoBrush or brush.color().alpha() == 0:
+            element.set('fill', 'none')
+
+        else:
+            self.set_color(element, 'fill', brush.color())
+
+    def set_stroke(self, element, pen: QPen):
+        if pen.style() == Qt.NoPen or pen.color().alpha() == 0:
+            return
+
+        self.set_color(element, 'stroke', pen.color())
+
+        width = pen.widthF()
+        if width == 0:
+            # Cosmetic pens are one pixel wide at any zoom
+            element.set('vector-effect', 'non-scaling-stroke')
+            width = 1
+
+        if width != 1:
+            element.set('stroke-width', number(width))
+
+        element.set('stroke-linecap', {Qt.FlatCap: 'butt', Qt.RoundCap: 'round'}.get(pen.capStyle(), 'square'))
+        element.set('stroke-linejoin', {Qt.RoundJoin: 'round', Qt.BevelJoin: 'bevel'}.get(pen.joinStyle(), 'miter'))
+
+        if pen.joinStyle() in (Qt.MiterJoin, Qt.SvgMiterJoin) and pen.miterLimit() != 4:
+            element.set('stroke-miterlimit', number(pen.miterLimit()))
+
+        if pen.style() != Qt.SolidLine:
+            # Qt's dash patterns are in pen widths
+            element.set('stroke-dasharray', ' '.join(number(dash * width) for dash in pen.dashPattern()))
+
+    def set_font(self, element, font: QFont):
+        # A generic family to fall back on where the font isn't installed
+        generic = {QFont.Serif: 'serif', QFont.Monospace: 'monospace', QFont.TypeWriter: 'monospace',
+                   QFont.Cursive: 'cursive', QFont.Fantasy: 'fantasy'}.get(font.styleHint(), 'sans-serif')
+        element.set('font-family', f"'{font.family()}', {generic}")
+        element.set('font-size', number(font.pixelSize() if font.pixelSize() > 0 else font.pointSizeF() * self.dpi / 72))
+
+        weight = next(css for qt, css in font_weights if font.weight() >= qt)
+        if weight != 400:
+            element.set('font-weight', str(weight))
+
+        if font.italic():
+            element.set('font-style', 'italic')
+
+        if font.underline():
+            element.set('text-decoration', 'underline')
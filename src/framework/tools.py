@@ -1,6 +1,7 @@
 from src.scripts.imports import *
 from src.framework.undo_commands import *
 from src.framework.custom_classes import *
+from src.framework.path_measure import MPPathMeasure
 
 class PathDrawerTool:
     def __init__(self, canvas, view):
@@ -8,6 +9,7 @@ class PathDrawerTool:
         self.view = view
         self.temp_path_item = None
         self.path = None
+        self.measure = None
         self.last_point = None
 
     def show_tooltip(self, event):
@@ -17,7 +19,7 @@ class PathDrawerTool:
         p.setX(p.x() + 10)
 
         if self.path:
-            QToolTip.showText(p, f'path length: {int(self.path.length())} pt')
+            QToolTip.showText(p, f'path length: {int(self.measure.length())} pt')
 
         else:
             self.view.show_tooltip(event)
@@ -31,6 +33,10 @@ class PathDrawerTool:
             self.path.moveTo(self.view.mapToScene(event.pos()))
             self.last_point = self.view.mapToScene(event.pos())
 
+            # The length shown in the tooltip grows with the stroke
+            self.measure = MPPathMeasure()
+            self.measure.move_to(self.last_point)
+
             # Set drag mode
             self.view.setDragMode(QGraphicsView.NoDrag)
 
@@ -39,6 +45,7 @@ class PathDrawerTool:
         if event.buttons() == Qt.LeftButton:
             self.path.lineTo(self.view.mapToScene(event.pos()))
             self.last_point = self.view.mapToScene(event.pos())
+            self.measure.line_to(self.last_point)
 
             # Remove temporary path if it exists
             if self.temp_path_item:
@@ -51,7 +58,7 @@ class PathDrawerTool:
             self.temp_path_item.setZValue(1)
             self.canvas.addItem(self.temp_path_item)
 
-            self.canvas.update()
+            self.canvas.markDirty(self.temp_path_item)
 
     def on_path_draw_end(self, event):
         # Check the buttons
@@ -61,10 +68,9 @@ class PathDrawerTool:
 
             # Check if there is a temporary path (if so, remove it now)
             if self.temp_path_item:
+                self.canvas.markDirtyRect(self.temp_path_item.sceneBoundingRect())
                 self.canvas.removeItem(self.temp_path_item)
 
-            self.canvas.update()
-
             # Load main path as QGraphicsItem
             path_item = CustomPathItem(self.path)
             path_item.setPen(self.view.pen)
@@ -84,6 +90,7 @@ class PathDrawerTool:
 
             self.temp_path_item = None
             self.path = None
+            self.measure = None
             self.last_point = None
 
 class PenDrawerTool:
@@ -91,6 +98,7 @@ class PenDrawerTool:
         self.canvas = canvas
         self.view = view
         self.path = None
+        self.measure = None
         self.temp_path_item = None
         self.last_point = None
 
@@ -101,7 +109,7 @@ class PenDrawerTool:
         p.setX(p.x() + 10)
 
         if self.path:
-            QToolTip.showText(p, f'path length: {int(self.path.length())} pt')
+            QToolTip.showText(p, f'path length: {int(self.measure.length())} pt')
 
         else:
             self.view.show_tooltip(event)
@@ -115,6 +123,10 @@ class PenDrawerTool:
             self.path.moveTo(self.view.mapToScene(event.pos()))
             self.last_point = self.view.mapToScene(event.pos())
 
+            # The length shown in the tooltip grows with the stroke
+            self.measure = MPPathMeasure()
+            self.measure.move_to(self.last_point)
+
             # Set drag mode
             self.view.setDragMode(QGraphicsView.NoDrag)
 
@@ -123,6 +135,7 @@ class PenDrawerTool:
             # Check the buttons
             if event.buttons() == Qt.LeftButton:
                 self.path.lineTo(self.view.mapToScene(event.pos()))
+                self.measure.line_to(self.view.mapToScene(event.pos()))
 
                 # Remove temporary path if it exists
                 if self.temp_path_item is not None:
@@ -141,13 +154,14 @@ class PenDrawerTool:
                     if event.modifiers() & Qt.ShiftModifier:
                         self.temp_path_item.simplify(self.last_point, self.view.mapToScene(event.pos()))
                         self.path = self.temp_path_item.path()
+                        self.measure = MPPathMeasure(self.path)
                     else:
                         self.temp_path_item.setPath(self.temp_path_item.smooth_path(self.temp_path_item.path(), 0.75))
 
                 except Exception:
                     pass
 
-                self.canvas.update()
+                self.canvas.markDirty(self.temp_path_item)
 
     def on_draw_end(self, event):
         if self.path is not None:
@@ -161,10 +175,9 @@ class PenDrawerTool:
 
                     # Check if there is a temporary path (if so, remove it now)
                     if self.temp_path_item is not None:
+                        self.canvas.markDirtyRect(self.temp_path_item.sceneBoundingRect())
                         self.canvas.removeItem(self.temp_path_item)
 
-                    self.canvas.update()
-
                     # Load main path as QGraphicsItem
                     path_item = CustomPathItem(self.path)
                     path_item.path().setFillRule(Qt.WindingFill)
@@ -194,6 +207,7 @@ class PenDrawerTool:
                         self.canvas.addCommand(add_command)
 
                     self.path = None
+                    self.measure = None
                     self.temp_path_item = None
                     self.last_point = None
 
@@ -221,7 +235,7 @@ class LineAndLabelTool:
             self.pathg_item.text_element.setPos(self.start_point - QPointF(0, self.pathg_item.text_element.boundingRect().height()))
 
             self.canvas.addItem(self.pathg_item)
-            self.canvas.update()
+            self.canvas.markDirty(self.pathg_item)
 
     def on_label(self, event):
         if self.label_drawing:
@@ -231,8 +245,7 @@ class LineAndLabelTool:
             temp_line.lineTo(current_point)
             self.pathg_item.setPath(temp_line)
             self.pathg_item.updatePathEndPoint()
-            self.pathg_item.update()
-            self.canvas.update()
+            self.canvas.markDirty(self.pathg_item)
 
     def on_label_end(self, event):
         if event.button() == Qt.LeftButton and self.label_drawing:
@@ -240,7 +253,7 @@ class LineAndLabelTool:
             end_point = self.view.mapToScene(event.pos())
             self.leader_line.lineTo(end_point)
             self.pathg_item.setPath(self.leader_line)
-            self.canvas.update()
+            self.canvas.markDirty(self.pathg_item)
 
             self.pathg_item.text_element.select_text_and_set_cursor()
 
@@ -633,10 +646,10 @@ height: {int(self.canvas_item.rect().height())}''')
                 command = AddItemCommand(self.view.scene(), self.canvas_item)
                 self.canvas.addCommand(command)
 
+            self.canvas.markDirty(self.canvas_item.text)
+
             self.canvas_item = None
             self.clicked_canvas_point = None
 
-            self.canvas.update()
-
 
 
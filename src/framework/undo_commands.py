@@ -19,12 +19,12 @@ class MultiAddItemCommand(QUndoCommand):
         self.items = items
 
     def redo(self):
-        for item in self.items:
-            self.scene.addItem(item)
+        self.scene.addItems(self.items)
 
     def undo(self):
-        for item in self.items:
-            self.scene.removeItem(item)
+        with self.scene.batch():
+            for item in self.items:
+                self.scene.removeItem(item)
 
 class MultiItemPositionChangeCommand(QUndoCommand):
     def __init__(self, parent, items, old_positions, new_positions):
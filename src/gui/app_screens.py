@@ -1,6 +1,9 @@
 import sys
 
 from src.framework.undo_commands import MultiItemPositionChangeCommand
+from src.framework.container import MPFileReader
+from src.framework.exporter import MPCanvasExporter, MPExportCache, MPPDFExporter, canvas_order, \
+    export_all_canvases, export_all_counts
 from src.gui.custom_widgets import *
 from src.scripts.app_internal import *
 from src.scripts.imports import *
@@ -57,6 +60,15 @@ class CanvasItemSelector(QDialog):
         self.watermark_check_btn.setToolTip('Help support us by adding an MPRUN watermark')
         self.watermark_check_btn.clicked.connect(self.add_watermark)
 
+        # Resolution for bitmap exports, large ones are rendered in tiles
+        resolution_label = QLabel('Resolution:')
+        self.resolution_combo = QComboBox()
+        self.resolution_combo.setToolTip('Resolution of PNG, JPG and other image exports')
+        self.resolution_combo.addItem('72 DPI (Screen)', 72)
+        self.resolution_combo.addItem('150 DPI', 150)
+        self.resolution_combo.addItem('300 DPI (Print)', 300)
+        self.resolution_combo.addItem('600 DPI (Poster)', 600)
+
         # Export button
         self.export_btn = QPushButton("Export")
         self.export_btn.setToolTip('Export the selected canvas')
@@ -69,6 +81,8 @@ class CanvasItemSelector(QDialog):
         self.layout.addWidget(export_options_label)
         self.layout.addWidget(self.transparent_check_btn)
         self.layout.addWidget(self.watermark_check_btn)
+        self.layout.addWidget(resolution_label)
+        self.layout.addWidget(self.resolution_combo)
         self.layout.addItem(QSpacerItem(20, 20, QSizePolicy.Minimum, QSizePolicy.Expanding))
         self.layout.addWidget(self.export_btn)
         self.hlayout.addLayout(self.layout)
@@ -152,6 +166,7 @@ class AllCanvasExporter(QDialog):
         self.setFixedHeight(500)
 
         self.canvas = canvas
+        self.canvas.manager.finish_loading()
         self.canvas.parentWindow.use_exit_add_canvas()
         self.watermark_item = None
 
@@ -173,6 +188,7 @@ class AllCanvasExporter(QDialog):
         # Labels
         file_type_label = QLabel('File Type:')
         folder_name_label = QLabel('Folder Name:')
+        page_order_label = QLabel('Page Order:')
         export_options_label = QLabel('Export Options:')
 
         # Canvas selector
@@ -181,12 +197,21 @@ class AllCanvasExporter(QDialog):
         for value, key in export_all_file_types.items():
             self.file_type_combo.addItem(value, key)
 
+        self.file_type_combo.currentIndexChanged.connect(self.file_type_changed)
+
         # Folder name entry
         self.folder_name_entry = QLineEdit()
         self.folder_name_entry.setPlaceholderText('Canvas Assets')
         self.folder_name_entry.setObjectName('modernLineEdit')
         self.folder_name_entry.setToolTip('Change the name of the folder that canvases are exported to')
 
+        # Page order, for exporting every canvas into one PDF
+        self.page_order_combo = QComboBox()
+        self.page_order_combo.setToolTip('Order of the pages when exporting to one PDF')
+        self.page_order_combo.addItem('Canvas Position', 'position')
+        self.page_order_combo.addItem('Canvas Name', 'name')
+        self.page_order_combo.setEnabled(False)
+
         # Watermark option checkbox
         self.watermark_check_btn = QCheckBox()
         self.watermark_check_btn.setText('Add Watermark')
@@ -205,6 +230,8 @@ class AllCanvasExporter(QDialog):
         self.layout.addWidget(self.file_type_combo)
         self.layout.addWidget(folder_name_label)
         self.layout.addWidget(self.folder_name_entry)
+        self.layout.addWidget(page_order_label)
+        self.layout.addWidget(self.page_order_combo)
         self.layout.addItem(QSpacerItem(20, 20, QSizePolicy.Minimum, QSizePolicy.Expanding))
         self.layout.addWidget(self.watermark_check_btn)
         self.layout.addWidget(self.export_btn)
@@ -233,7 +260,14 @@ class AllCanvasExporter(QDialog):
         except Exception:
             pass
 
+    def file_type_changed(self):
+        self.page_order_combo.setEnabled(self.file_type_combo.currentData() == '.pdf')
+
     def export(self):
+        if self.file_type_combo.currentData() == '.pdf':
+            self.export_pdf()
+            return
+
         try:
             directory = QFileDialog.getExistingDirectory(self, 'Export Directory')
 
@@ -244,27 +278,29 @@ class AllCanvasExporter(QDialog):
                 os.makedirs(subdirectory, exist_ok=True)
 
                 file_extension = self.file_type_combo.itemData(self.file_type_combo.currentIndex())
-                tooltip_count = {}
+                canvases = export_all_canvases(self.canvas)
+                jobs = []
 
-                for item in self.canvas.items():
-                    if isinstance(item, CanvasItem):
-                        tooltip = item.toolTip()
-                        if tooltip in tooltip_count:
-                            tooltip_count[tooltip] += 1
-                        else:
-                            tooltip_count[tooltip] = 1
+                # mprun render names its files the same way
+                for item, count in zip(canvases, export_all_counts([item.toolTip() for item in canvases])):
+                    unique_filename = f"{item.toolTip()}_{count}{file_extension}"
+                    jobs.append((item, os.path.join(subdirectory, unique_filename)))
 
-                        unique_filename = f"{tooltip}_{tooltip_count[tooltip]}{file_extension}"
-                        filename = os.path.join(subdirectory, unique_filename)
+                # Canvases are rendered and encoded on a thread pool while the app stays responsive,
+                # canvases that haven't changed since they were last exported come from the cache
+                exporter = MPCanvasExporter(self.canvas, cache=MPExportCache())
+                if exporter.exec(jobs, self, 'Export All') is None:
+                    return
 
-                        if file_extension == '.svg':
-                            self.export_canvases_as_svg(filename, item)
-                        else:
-                            self.export_canvases_as_bitmap(filename, item)
+                if exporter.errors:
+                    QMessageBox.critical(self, 'Export Error', 'Failed to export some canvases:\n\n'
+                                         + '\n'.join(exporter.errors))
+                    return
 
                 # If saving was successful, show a notification
                 self.canvas.views()[0].showMessage('Export Finished',
-                                                   f'Export to {subdirectory} completed successfully.')
+                                                   f'Export to {subdirectory} completed successfully '
+                                                   f'({len(exporter.reused)} unchanged canvases reused).')
 
                 # Open the folder on the computer
                 QDesktopServices.openUrl(QUrl.fromLocalFile(subdirectory))
@@ -272,56 +308,47 @@ class AllCanvasExporter(QDialog):
         except Exception as e:
             print(e)
 
-    def export_canvases_as_svg(self, file_path, selected_item):
+    def export_pdf(self):
         try:
-            # Get the bounding rect
-            rect = selected_item.sceneBoundingRect()
+            name = self.folder_name_entry.text() if self.folder_name_entry.text() != '' else 'Canvas Assets'
+            filename, _ = QFileDialog.getSaveFileName(self, 'Export All', f'{name}.pdf', 'PDF files (*.pdf)')
 
-            # Export as SVG
-            svg_generator = QSvgGenerator()
-            svg_generator.setFileName(file_path)
-            svg_generator.setSize(rect.size().toSize())
-            svg_generator.setViewBox(rect)
-            svg_generator.setTitle('MPRUN SVG Document (Powered by QSvgGenerator)')
+            if not filename:
+                return
 
-            # Clear selection
-            self.canvas.clearSelection()
+            if not filename.lower().endswith('.pdf'):
+                filename += '.pdf'
 
-            # Create a QPainter to paint onto the QSvgGenerator
-            painter = QPainter()
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-            painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
-            painter.begin(svg_generator)
+            canvases = canvas_order([item for item in self.canvas.items() if isinstance(item, CanvasItem)],
+                                    self.page_order_combo.currentData())
 
-            # Render the scene onto the QPainter
-            self.canvas.render(painter, target=rect, source=rect)
+            # Every canvas goes into one file in a single pass, a page each
+            progress = QProgressDialog('Exporting canvases...', 'Cancel', 0, len(canvases), self)
+            progress.setWindowTitle('Export All')
+            progress.setWindowModality(Qt.WindowModal)
+            progress.setMinimumDuration(500)
 
-            # End painting
-            painter.end()
+            def update(done, total):
+                progress.setValue(done)
 
-        except Exception as e:
-            # Show export error notification
-            QMessageBox.information(self, 'Export Failed', f'Export failed: {e}',
-                                    QMessageBox.Ok)
-
-    def export_canvases_as_bitmap(self, filename, selected_item):
-        # Create a QImage with the size of the selected item (QGraphicsRectItem)
-        rect = selected_item.sceneBoundingRect()
-        image = QImage(rect.size().toSize(), QImage.Format_ARGB32)
-
-        # Render the QGraphicsRectItem onto the image
-        painter = QPainter(image)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
-        self.canvas.render(painter, target=QRectF(image.rect()), source=rect)
-        painter.end()
+                return not progress.wasCanceled()
 
-        try:
-            image.save(filename)
+            exporter = MPPDFExporter(self.canvas)
+            finished = exporter.export(canvases, filename, update)
+            progress.close()
+
+            if not finished:
+                return
+
+            # If saving was successful, show a notification
+            self.canvas.views()[0].showMessage('Export Finished',
+                                               f'Exported {exporter.pages} pages in {exporter.seconds:.1f}s.')
+
+            # Open the PDF with the default viewer
+            QDesktopServices.openUrl(QUrl.fromLocalFile(filename))
 
         except Exception as e:
-            # If saving failed, show an error notification
-            QMessageBox.critical(self, "Export Error", f"Failed to export canvas to file: {e}")
+            QMessageBox.critical(self, 'Export Error', f'Failed to export canvases to PDF: {e}')
 
     def closeEvent(self, e):
         self.parent().use_exit_add_canvas()
@@ -679,6 +706,120 @@ class FindActionWin(QWidget):
             self.close()
 
 
+class RecentFilesWin(QDialog):
+    # Grid of the most recent documents, only the preview saved in front of each document is
+    # read so even 50 of them show up instantly
+    max_files = 50
+
+    def __init__(self, recent_files: list, parent):
+        super().__init__(parent)
+        self.setWindowTitle('Open Recent')
+        self.setWindowIcon(QIcon('ui/Main Logos/MPRUN_icon.png'))
+        self.setWindowModality(Qt.ApplicationModal)
+        self.setMinimumWidth(900)
+        self.setMinimumHeight(600)
+
+        self.parent = parent
+        self.recent_files = [file for file in reversed(recent_files) if os.path.exists(file)][:self.max_files]
+
+        self.createUI()
+        self.load_previews()
+
+    def createUI(self):
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        # Search entry
+        self.search_entry = QLineEdit()
+        self.search_entry.setObjectName('modernLineEdit')
+        self.search_entry.setPlaceholderText('Search recent documents...')
+        self.search_entry.textChanged.connect(self.search)
+
+        # Document grid
+        self.list_widget = QListWidget()
+        self.list_widget.setViewMode(QListWidget.IconMode)
+        self.list_widget.setIconSize(QSize(192, 192))
+        self.list_widget.setGridSize(QSize(220, 280))
+        self.list_widget.setResizeMode(QListWidget.Adjust)
+        self.list_widget.setMovement(QListWidget.Static)
+        self.list_widget.setWordWrap(True)
+        self.list_widget.itemActivated.connect(self.open)
+
+        self.status_label = QLabel()
+
+        # Buttons
+        browse_btn = QPushButton('Browse...')
+        browse_btn.setToolTip('Open a document that is not in the list')
+        browse_btn.clicked.connect(self.browse)
+
+        open_btn = QPushButton('Open')
+        open_btn.setToolTip('Open the selected document')
+        open_btn.clicked.connect(lambda: self.open(self.list_widget.currentItem()))
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+        button_layout.addWidget(browse_btn)
+        button_layout.addWidget(open_btn)
+
+        layout.addWidget(self.search_entry)
+        layout.addWidget(self.list_widget)
+        layout.addLayout(button_layout)
+
+    def load_previews(self):
+        start = time.perf_counter()
+        placeholder = QIcon('ui/Main Logos/MPRUN_icon.png')
+
+        for file in self.recent_files:
+            try:
+                preview = MPFileReader.readPreview(file)
+
+            except (OSError, ValueError) as e:
+                print(e)
+                preview = None
+
+            item = QListWidgetItem(os.path.basename(file))
+            item.setData(Qt.UserRole, file)
+            item.setToolTip(os.path.abspath(file))
+            item.setIcon(placeholder)
+
+            if preview is not None:
+                pixmap = QPixmap()
+
+                if pixmap.loadFromData(preview['thumbnail'], 'PNG'):
+                    item.setIcon(QIcon(pixmap))
+
+                modified = time.strftime('%b %d %Y, %H:%M', time.localtime(preview['modified']))
+                item.setText(f"{os.path.basename(file)}\n"
+                             f"{preview['canvas_count']} canvases, {preview['item_count']} items\n"
+                             f"{modified}")
+                item.setToolTip(f"{os.path.abspath(file)}\n{', '.join(preview['canvases'])}")
+
+            self.list_widget.addItem(item)
+
+        self.status_label.setText(f'{len(self.recent_files)} documents loaded in '
+                                  f'{(time.perf_counter() - start) * 1000:.0f} ms')
+
+        if self.list_widget.count():
+            self.list_widget.setCurrentRow(0)
+
+    def search(self):
+        text = self.search_entry.text().lower()
+
+        for i in range(self.list_widget.count()):
+            item = self.list_widget.item(i)
+            item.setHidden(text not in item.text().lower())
+
+    def open(self, item):
+        if item is not None:
+            self.accept()
+            self.parent.open_recent(item.data(Qt.UserRole))
+
+    def browse(self):
+        self.accept()
+        self.parent.canvas.manager.load(self.parent)
+
+
 class DisclaimerWin(QMessageBox):
     def __init__(self, data_file, parent=None):
         super().__init__(parent)
@@ -774,8 +915,28 @@ class SettingsWin(QDialog):
 
             self.general_tab.layout().addWidget(startup_gb)
 
+        def createAutosaveGB():
+            autosave_gb = QGroupBox('Autosave')
+            autosave_gb.setLayout(QVBoxLayout())
+
+            autosave_label = QLabel('Save a recovery copy every:')
+            self.autosave_interval_spin = QSpinBox(self)
+            self.autosave_interval_spin.setRange(0, 60)
+            self.autosave_interval_spin.setSuffix(' min')
+            self.autosave_interval_spin.setSpecialValueText('Off')
+            self.autosave_interval_spin.setFixedWidth(100)
+            autosave_hlayout = ToolbarHorizontalLayout()
+            autosave_hlayout.layout.addWidget(autosave_label)
+            autosave_hlayout.layout.addWidget(self.autosave_interval_spin)
+            autosave_hlayout.layout.addStretch()
+
+            autosave_gb.layout().addWidget(autosave_hlayout)
+
+            self.general_tab.layout().addWidget(autosave_gb)
+
         createDialogAndGuiGB()
         createOnStartupGB()
+        createAutosaveGB()
         self.general_tab.layout().addStretch()
 
     def createPerformanceSettings(self):
@@ -844,6 +1005,7 @@ class SettingsWin(QDialog):
 
         for data in _data:
             self.undo_limit_spin.setValue(data['undo_limit'])
+            self.autosave_interval_spin.setValue(data.get('autosave_interval', 5))
             self.show_tip_of_day_checkbtn.setChecked(data['show_daily_tips'])
             self.use_gpu_checkbtn.setChecked(data['use_gpu'])
             for k, v in self.colors.items():
@@ -859,6 +1021,7 @@ class SettingsWin(QDialog):
 
         for data in _data:
             data['undo_limit'] = self.undo_limit_spin.value()
+            data['autosave_interval'] = self.autosave_interval_spin.value()
             data['show_daily_tips'] = self.show_tip_of_day_checkbtn.isChecked()
             data['use_gpu'] = self.use_gpu_checkbtn.isChecked()
             data['default_stroke'] = self.default_stroke_combo.itemData(self.default_stroke_combo.currentIndex())
@@ -866,6 +1029,7 @@ class SettingsWin(QDialog):
             data['default_font'] = self.default_font_combo.itemData(self.default_font_combo.currentIndex())
 
         self.p.write_settings(_data)
+        self.p.canvas.manager.autosaver.setInterval(self.autosave_interval_spin.value())
 
         self.close()
 
@@ -885,6 +1049,7 @@ class SettingsWin(QDialog):
 
     def restore(self):
         self.undo_limit_spin.setValue(200)
+        self.autosave_interval_spin.setValue(5)
         self.show_tip_of_day_checkbtn.setChecked(True)
         self.use_gpu_checkbtn.setChecked(True)
         for k, v in self.colors.items():
@@ -5,6 +5,8 @@ from src.scripts.imports import *
 from src.gui.custom_widgets import ToolbarHorizontalLayout
 from src.gui.app_screens import AllCanvasExporter
 from src.framework.custom_classes import *
+from src.framework.exporter import MPExportCache
+from src.framework.sharing import MPUploadBackend, MPSharePipeline
 
 if getattr(sys, 'frozen', False):
     os.chdir(sys._MEIPASS)
@@ -66,19 +68,15 @@ class iCloudIntegraterWin(QDialog):
             if api.requires_2fa:
                 code, ok = QInputDialog.getInt(self.parent, '2FA Code', 'Enter the 2FA code sent to your Apple device:')
 
-                if ok:
-                    if api.validate_2fa_code(str(code)):
-                        for photo in self.export():
-                            with open(photo, 'rb') as f:
-                                api.drive['Downloads'].upload(f, filename=os.path.basename(photo))
-                    else:
-                        QMessageBox.warning(self.parent, 'Incorrect Code', 'Failed to verify security code.')
-                        return
+                if not ok:
+                    return
 
-            else:
-                for photo in self.export():
-                    with open(photo, 'rb') as f:
-                        api.drive['Downloads'].upload(f)
+                if not api.validate_2fa_code(str(code)):
+                    QMessageBox.warning(self.parent, 'Incorrect Code', 'Failed to verify security code.')
+                    return
+
+            if not self.share(iCloudDriveBackend(api)):
+                return
 
             QMessageBox.information(self.parent, 'File Shared', 'The file has successfully been '
                                                                 'transferred to iCloud. It has been saved '
@@ -89,55 +87,64 @@ class iCloudIntegraterWin(QDialog):
         except Exception as e:
             QMessageBox.critical(self.parent, 'Error', f'An unexpected error occurred: {e}')
 
-    def export(self):
-        try:
-            # Get the user's Downloads folder
-            downloads_folder = downloads_path
+    def share(self, backend: MPUploadBackend):
+        # Each canvas is uploaded as soon as its PNG is written, while the next ones render.
+        # Returns False when cancelled or something failed
+        self.canvas.manager.finish_loading()
 
-            # Create a subdirectory in Downloads
-            subdirectory = os.path.join(downloads_folder,
-                                        'Canvas Assets')
-            os.makedirs(subdirectory, exist_ok=True)
+        pipeline = MPSharePipeline(self.canvas, backend, cache=MPExportCache())
+        uploaded = pipeline.exec(self.jobs(), self, 'Share To iCloud')
 
-            file_extension = '.png'  # Set file extension to PNG
-            tooltip_count = {}
-            exported_filenames = []
+        # Sharing was cancelled
+        if uploaded is None:
+            return False
 
-            for item in self.canvas.items():
-                if isinstance(item, CanvasItem):
-                    tooltip = item.toolTip()
-                    if tooltip in tooltip_count:
-                        tooltip_count[tooltip] += 1
-                    else:
-                        tooltip_count[tooltip] = 1
+        if pipeline.errors:
+            QMessageBox.critical(self.parent, 'Error', 'Failed to share some canvases:\n\n'
+                                 + '\n'.join(pipeline.errors))
+            return False
 
-                    unique_filename = f"{tooltip}_{tooltip_count[tooltip]}{file_extension}"
-                    filename = os.path.join(subdirectory, unique_filename)
-                    exported_filenames.append(filename)
+        return True
 
-                    # Export the item as a PNG
-                    self.export_as_png(filename, item)
+    def jobs(self):
+        # Get the user's Downloads folder
+        downloads_folder = downloads_path
 
-            return exported_filenames
+        # Create a subdirectory in Downloads
+        subdirectory = os.path.join(downloads_folder,
+                                    'Canvas Assets')
+        os.makedirs(subdirectory, exist_ok=True)
 
-        except Exception as e:
-            print(e)
+        file_extension = '.png'  # Set file extension to PNG
+        tooltip_count = {}
+        jobs = []
 
-    def export_as_png(self, filename, selected_item):
-        # Create a QImage with the size of the selected item (QGraphicsRectItem)
-        rect = selected_item.sceneBoundingRect()
-        image = QImage(rect.size().toSize(), QImage.Format_ARGB32)
+        for item in self.canvas.items():
+            if isinstance(item, CanvasItem):
+                tooltip = item.toolTip()
+                if tooltip in tooltip_count:
+                    tooltip_count[tooltip] += 1
+                else:
+                    tooltip_count[tooltip] = 1
 
-        # Render the QGraphicsRectItem onto the image
-        painter = QPainter(image)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
-        self.canvas.render(painter, target=QRectF(image.rect()), source=rect)
-        painter.end()
+                unique_filename = f"{tooltip}_{tooltip_count[tooltip]}{file_extension}"
+                jobs.append((item, os.path.join(subdirectory, unique_filename)))
 
-        try:
-            image.save(filename)
+        return jobs
 
-        except Exception as e:
-            # If saving failed, show an error notification
-            QMessageBox.critical(self, "Export Error", f"Failed to export canvas to file: {e}")
+
+class iCloudDriveBackend(MPUploadBackend):
+    # Uploads into a folder of the user's iCloud Drive
+    name = 'iCloud Drive'
+
+    # pyicloud shares one requests session between calls, uploads go one at a time (they
+    # still overlap with rendering)
+    max_concurrency = 1
+
+    def __init__(self, api: PyiCloudService, folder='Downloads'):
+        self.api = api
+        self.folder = folder
+
+    def upload(self, filename):
+        with open(filename, 'rb') as f:
+            self.api.drive[self.folder].upload(f, filename=os.path.basename(filename))
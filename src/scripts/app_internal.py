@@ -51,7 +51,8 @@ export_all_file_types = {
     'TIFF files (*.tiff)': '.tiff',
     'WEBP files (*.webp)': '.webp',
     'ICO files (*.ico)': '.ico',
-    'HEIC files (*.heic)': '.heic'
+    'HEIC files (*.heic)': '.heic',
+    'PDF file, one page per canvas (*.pdf)': '.pdf'
 }
 
 default_text = """Run #:
@@ -11,6 +11,7 @@ import markdown
 import json
 import sys
 import base64
+import hashlib
 import random
 import subprocess
 from PyQt5.QtWidgets import *